@@ -36,10 +36,13 @@ if [ "$BUCOFFEAPREFETCH" = true ]; then
     echo "Prefetching."
     FLIST=$(readlink -e input*.txt)
     touch tmp.txt
+    # The sources of the local copies are looked up in the file catalog
+    touch prefetched.txt
     while read file; do
         LOCAL=$(echo "${file}" | md5sum | awk '{print $1}').root
         xrdcp $file ./$LOCAL
         echo $LOCAL >> tmp.txt
+        echo "$LOCAL $file" >> prefetched.txt
     done < $FLIST
     mv tmp.txt $FLIST
 fi
@@ -56,5 +59,7 @@ echo "Run done: $(date)"
 echo "Cleaning up."
 rm -vf *.root
 rm -vf ${FLIST}
+rm -vf prefetched.txt
+rm -rvf scratch
 echo "End: $(date)"
 
@@ -0,0 +1,195 @@
+"""Background copies of input files to the local disk of a worker"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import warnings
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from coffea.processor.executor import WorkItem
+from tqdm import tqdm
+
+from bucoffea.helpers.paths import xrootd_format
+
+pjoin = os.path.join
+
+def local_name(path):
+    '''Name of the local copy of a file'''
+    return hashlib.md5(path.encode('utf-8')).hexdigest() + '.root'
+
+def _local_path(path):
+    '''Path of a file on local disk, or None for remote files'''
+    if path.startswith('file://'):
+        return path[len('file://'):]
+    if '://' in path:
+        return None
+    return path
+
+def copy_file(source, destination):
+    """Copies a file with xrdcp, or from local disk for testing
+
+    The copy is written to a temporary file first, so that
+    the destination only appears once it is complete.
+    """
+    tmp = f"{destination}.part"
+    local = _local_path(source)
+    try:
+        if local is None:
+            subprocess.run(['xrdcp', '--silent', '--force', source, tmp], check=True)
+        else:
+            shutil.copyfile(local, tmp)
+        os.replace(tmp, destination)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class FileStager(object):
+    '''
+    Copies input files to local disk ahead of processing.
+
+    Up to a given number of copies run in background threads, as long
+    as the files on disk fit into the disk budget. Processed files are
+    handed back with release(), which deletes them and makes room for
+    the next copies. Files that cannot be copied are handed out with
+    their remote path, so that they are read over xrootd instead.
+
+    Typical use:
+
+        stager = FileStager(files, 'staged')
+        for paths in stager:
+            process(paths)
+            for path in paths:
+                stager.release(path)
+    '''
+    def __init__(self, files, destdir, nahead=2, budget=20*1024**3, copy=copy_file):
+        """
+        :param files: Files to copy, in the order they are needed
+        :type files: list
+        :param destdir: Local directory to copy to
+        :type destdir: str
+        :param nahead: Maximum number of concurrent copies
+        :type nahead: int, optional
+        :param budget: Maximum number of bytes held on local disk
+        :type budget: int, optional
+        :param copy: Function copying a file, takes source and destination
+        :type copy: callable, optional
+        """
+        if nahead < 1:
+            raise ValueError(f"Number of concurrent copies has to be positive, got {nahead}.")
+        self.destdir = destdir
+        self.budget = budget
+        self.nahead = nahead
+        self._copy = copy
+        self._pending = [xrootd_format(x) for x in files]
+        self._copies = {}
+        self._held = {}
+        # Remote path of every local copy
+        self.sources = {}
+        self._largest = 0
+        self._pool = ThreadPoolExecutor(nahead)
+        os.makedirs(destdir, exist_ok=True)
+        self._fill()
+
+    def _size_estimate(self, path):
+        local = _local_path(path)
+        if local is not None and os.path.exists(local):
+            return os.path.getsize(local)
+        # Remote files are assumed to be as large as the largest one seen so far
+        return self._largest
+
+    def _fill(self):
+        '''Starts copies while the concurrency limit and disk budget allow'''
+        while self._pending and len(self._copies) < self.nahead:
+            source = self._pending[0]
+            size = self._size_estimate(source)
+            used = sum(self._held.values()) + sum(x[2] for x in self._copies.values())
+            # At least one file has to be on its way
+            if (self._held or self._copies) and used + size > self.budget:
+                break
+            self._pending.pop(0)
+            destination = pjoin(self.destdir, local_name(source))
+            future = self._pool.submit(self._copy, source, destination)
+            self._copies[future] = (source, destination, size)
+
+    def __iter__(self):
+        while True:
+            paths = self.ready()
+            if not paths:
+                return
+            yield paths
+
+    def ready(self):
+        """Waits for at least one copy and returns all files that can be processed
+
+        :return: Local paths, or remote paths for files that could not be copied.
+                 Empty if all files have been handed out.
+        :rtype: list
+        """
+        self._fill()
+        if not self._copies:
+            return []
+        done, _ = wait(list(self._copies), return_when=FIRST_COMPLETED)
+        paths = []
+        for future in done:
+            source, destination, _ = self._copies.pop(future)
+            try:
+                future.result()
+            except (OSError, subprocess.CalledProcessError) as e:
+                warnings.warn(f'Copy of {source} failed, reading it remotely: {e}')
+                paths.append(source)
+                continue
+            size = os.path.getsize(destination)
+            self._largest = max(self._largest, size)
+            self._held[destination] = size
+            self.sources[destination] = source
+            paths.append(destination)
+        self._fill()
+        return paths
+
+    def release(self, path):
+        '''Deletes a processed file and starts the next copies'''
+        if path in self._held:
+            os.remove(path)
+            del self._held[path]
+        self._fill()
+
+    def close(self):
+        '''Stops copying and deletes all local copies'''
+        self._pending = []
+        for future in self._copies:
+            future.cancel()
+        self._pool.shutdown(wait=True)
+        for source, destination, _ in self._copies.values():
+            if os.path.exists(destination):
+                os.remove(destination)
+        self._copies = {}
+        for path in list(self._held):
+            self.release(path)
+
+def staged_executor(items, function, accumulator, pool, release=None, status=True, unit='items', desc='Processing', **kwargs):
+    """Executor for run_uproot_job_nanoaod that releases files as soon as they are processed
+
+    Work items are submitted to an existing pool, so that the worker
+    processes are kept between calls. Once the last chunk of a file
+    is done, the file is handed to the release function, e.g. the
+    release() method of a FileStager. Other executor arguments,
+    such as the number of workers, are ignored.
+
+    :param pool: Pool to submit to
+    :type pool: concurrent.futures.Executor
+    :param release: Function called with the name of each processed file
+    :type release: callable, optional
+    """
+    futures = {pool.submit(function, item) : item for item in items}
+    remaining = Counter(x.filename for x in futures.values() if isinstance(x, WorkItem))
+    for future in tqdm(as_completed(futures), total=len(futures), disable=not status, unit=unit, desc=desc):
+        accumulator.add(future.result())
+        item = futures[future]
+        if not isinstance(item, WorkItem):
+            continue
+        remaining[item.filename] -= 1
+        if release and not remaining[item.filename]:
+            release(item.filename)
+    return accumulator
@@ -3,6 +3,7 @@ import numpy as np
 import re
 from coffea import hist
 import coffea.processor as processor
+from bucoffea.gen.pdfgrid import PDFReweighter
 
 
 #  export LHAPDF_DATA_PATH=/cvmfs/sft.cern.ch/lcg/releases/MCGenerators/lhapdf/6.2.1-7149a/x86_64-centos7-gcc8-opt/share/LHAPDF/
@@ -66,31 +67,24 @@ class pdfWeightProcessor(processor.ProcessorABC):
             'none' : np.ones(df.size)
         }
 
-        pdf_objs = setup_pdf_objs(self._all_pdfs)
-        for ipdf in self._all_pdfs:
-            w = np.ones(df.size)
-            for i in range(df.size):
-                id1 = df['Generator_id1'][i]
-                id2 = df['Generator_id2'][i]
-                x1 = df['Generator_x1'][i]
-                x2 = df['Generator_x2'][i]
-                q2 = df['Generator_scalePDF'][i]
-
-                w[i] = pdf_objs[ipdf].xfxQ2(id1, x1, q2) * pdf_objs[ipdf].xfxQ2(id2, x2, q2)
-                # print(id1, id2, x1, x2, q, w[i])
-            pdf_weights[ipdf] = w
-
+        # Tabulated PDFs, evaluated for all events at once
+        reweighter = PDFReweighter.from_ids(self._all_pdfs, base=base_pdf)
+        pdf_weights.update(
+            reweighter.ratios(
+                              id1=df['Generator_id1'],
+                              id2=df['Generator_id2'],
+                              x1=df['Generator_x1'],
+                              x2=df['Generator_x2'],
+                              q2=df['Generator_scalePDF']
+                              )
+        )
 
         output["gen_weight_sign"].fill(
             sign=np.sign(df['Generator_weight']),
             dataset=dataset
         )
         for ipdf in pdf_weights.keys():
-            weight = df['Generator_weight']
-            if ipdf !='none':
-                reweight = pdf_weights[ipdf]/pdf_weights[base_pdf]
-                reweight[abs(reweight)>10] = 1
-                weight = weight * reweight
+            weight = df['Generator_weight'] * pdf_weights[ipdf]
             output['gen_vpt'].fill(
                                 vpt = df['LHE_Vpt'],
                                 dataset=dataset,
@@ -0,0 +1,220 @@
+import os
+import warnings
+
+import numpy as np
+
+pjoin = os.path.join
+
+# Parton IDs stored in the grid, LHAPDF numbering
+PIDS = [-6, -5, -4, -3, -2, -1, 21, 1, 2, 3, 4, 5, 6]
+
+# Maps pid + 6 to the position of the parton in PIDS
+# Both 0 and 21 denote the gluon
+_PID_INDEX = np.full(28, -1, dtype=np.int64)
+for _i, _pid in enumerate(PIDS):
+    _PID_INDEX[_pid + 6] = _i
+_PID_INDEX[0 + 6] = PIDS.index(21)
+
+def default_x_points():
+    """Sampling points in x: logarithmic at low x, linear at high x"""
+    return np.unique(np.concatenate([
+        np.logspace(-7, -1, 180, endpoint=False),
+        np.linspace(0.1, 1, 91)
+    ]))
+
+def default_q2_points():
+    """Sampling points in Q2, logarithmic from 1 GeV^2 to 1e8 GeV^2"""
+    return np.logspace(0, 8, 121)
+
+class PDFGrid(object):
+    '''
+    Tabulated x*f(x, Q2) values for one PDF set member.
+
+    The values are stored on a fixed (log x, log Q2) grid for every
+    parton and are bilinearly interpolated in log x and log Q2 when
+    evaluated. Points outside of the grid are not extrapolated, but
+    evaluated at the closest edge of the grid, with a warning. Same
+    as LHAPDF, partons that are not part of the grid, e.g. photons,
+    have zero density.
+    '''
+    def __init__(self, x, q2, values, pids=PIDS):
+        """
+        :param x: Sampling points in x, increasing
+        :type x: numpy.ndarray
+        :param q2: Sampling points in Q2, increasing
+        :type q2: numpy.ndarray
+        :param values: x*f values with shape (len(pids), len(x), len(q2))
+        :type values: numpy.ndarray
+        :param pids: Parton IDs along the first axis of values
+        :type pids: list
+        """
+        self.x = np.asarray(x, dtype=np.float64)
+        self.q2 = np.asarray(q2, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.pids = list(pids)
+        if self.values.shape != (len(self.pids), len(self.x), len(self.q2)):
+            raise ValueError(f"Grid shape {self.values.shape} does not match the number of sampling points.")
+        if list(self.pids) != PIDS:
+            raise ValueError(f"Grids need to contain all partons in the order {PIDS}.")
+        self._logx = np.log(self.x)
+        self._logq2 = np.log(self.q2)
+
+    @classmethod
+    def from_function(cls, xfxQ2, x=None, q2=None):
+        """Tabulates a function of (pid, x, q2) on the grid
+
+        Can be used with the xfxQ2 method of a LHAPDF object,
+        or with any synthetic function for testing.
+        """
+        x = default_x_points() if x is None else np.asarray(x)
+        q2 = default_q2_points() if q2 is None else np.asarray(q2)
+        values = np.empty((len(PIDS), len(x), len(q2)))
+        for ipid, pid in enumerate(PIDS):
+            for ix, xval in enumerate(x):
+                for iq, q2val in enumerate(q2):
+                    values[ipid, ix, iq] = xfxQ2(pid, float(xval), float(q2val))
+        return cls(x, q2, values)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['x'], f['q2'], f['values'], list(f['pids']))
+
+    def save(self, path):
+        # Write to a temporary file first, so that parallel
+        # jobs never pick up a partially written grid
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, x=self.x, q2=self.q2, values=self.values, pids=np.array(self.pids))
+        os.replace(tmp, path)
+
+    def covers(self, x, q2):
+        """Whether points are within the range of the grid
+
+        :rtype: numpy.ndarray
+        """
+        x = np.asarray(x, dtype=np.float64)
+        q2 = np.asarray(q2, dtype=np.float64)
+        return (x >= self.x[0]) & (x <= self.x[-1]) & (q2 >= self.q2[0]) & (q2 <= self.q2[-1])
+
+    @staticmethod
+    def _locate(edges, values):
+        """Returns lower bin index and interpolation fraction, clamping to the edges"""
+        values = np.clip(values, edges[0], edges[-1])
+        idx = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+        frac = (values - edges[idx]) / (edges[idx + 1] - edges[idx])
+        return idx, frac
+
+    def xfxQ2(self, pid, x, q2):
+        """Vectorized version of the LHAPDF xfxQ2 method
+
+        :param pid: Parton IDs
+        :type pid: numpy.ndarray
+        :param x: Momentum fractions
+        :type x: numpy.ndarray
+        :param q2: Squared factorization scales
+        :type q2: numpy.ndarray
+        :return: x*f(x, Q2) for each entry, zero for partons not in the grid
+        :rtype: numpy.ndarray
+        """
+        pid = np.asarray(pid, dtype=np.int64)
+        x = np.asarray(x, dtype=np.float64)
+        q2 = np.asarray(q2, dtype=np.float64)
+        known = (pid >= -6) & (pid <= 21)
+        ipid = np.where(known, _PID_INDEX[np.clip(pid + 6, 0, len(_PID_INDEX) - 1)], -1)
+        known = ipid >= 0
+
+        outside = known & ~self.covers(x, q2)
+        if np.any(outside):
+            warnings.warn(f"{np.count_nonzero(outside)} points outside of the PDF grid are evaluated at its edges.")
+
+        ix, fx = self._locate(self._logx, np.log(x))
+        iq, fq = self._locate(self._logq2, np.log(q2))
+
+        v = self.values
+        ipid = np.where(known, ipid, 0)
+        values = (
+                (1 - fx) * (1 - fq) * v[ipid, ix, iq]
+                + fx * (1 - fq) * v[ipid, ix + 1, iq]
+                + (1 - fx) * fq * v[ipid, ix, iq + 1]
+                + fx * fq * v[ipid, ix + 1, iq + 1]
+               )
+        return np.where(known, values, 0.)
+
+def _make_lhapdf(pdf_id):
+    from bucoffea.gen.pdfWeightProcessor import setup_pdf_objs
+    return setup_pdf_objs([pdf_id])[pdf_id]
+
+def load_pdf_grid(pdf_id, cache_dir=None, cache={}):
+    """Returns the grid for a given LHAPDF ID
+
+    The grid is kept in memory for the lifetime of the process.
+    On first use, it is read from the disk cache if available,
+    and is otherwise tabulated from LHAPDF and written to the cache.
+
+    :param pdf_id: LHAPDF ID of the PDF set member
+    :type pdf_id: int
+    :param cache_dir: Directory for the disk cache, defaults to the
+                      BUCOFFEA_PDF_CACHE environment variable or /tmp/bucoffea_pdfgrid
+    :type cache_dir: str, optional
+    :return: The grid
+    :rtype: PDFGrid
+    """
+    if pdf_id in cache:
+        return cache[pdf_id]
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('BUCOFFEA_PDF_CACHE', '/tmp/bucoffea_pdfgrid')
+    path = pjoin(cache_dir, f'pdfgrid_{pdf_id}.npz')
+
+    if os.path.exists(path):
+        grid = PDFGrid.load(path)
+    else:
+        grid = PDFGrid.from_function(_make_lhapdf(pdf_id).xfxQ2)
+        os.makedirs(cache_dir, exist_ok=True)
+        grid.save(path)
+    cache[pdf_id] = grid
+    return grid
+
+class PDFReweighter(object):
+    '''
+    Calculates per-event PDF reweighting factors for several PDF sets.
+    '''
+    def __init__(self, grids, base):
+        """
+        :param grids: Mapping between PDF ID and the corresponding grid
+        :type grids: dict
+        :param base: ID of the PDF the sample was generated with
+        :type base: int
+        """
+        if base not in grids:
+            raise ValueError(f"Base PDF {base} is not among the available grids.")
+        self._grids = grids
+        self._base = base
+
+    @classmethod
+    def from_ids(cls, pdf_ids, base, cache_dir=None):
+        grids = {pdf_id : load_pdf_grid(pdf_id, cache_dir) for pdf_id in set(pdf_ids) | {base}}
+        return cls(grids, base)
+
+    def products(self, id1, id2, x1, x2, q2):
+        """Returns x1*f(x1) * x2*f(x2) per event for each PDF"""
+        return {
+            pdf_id : grid.xfxQ2(id1, x1, q2) * grid.xfxQ2(id2, x2, q2)
+            for pdf_id, grid in self._grids.items()
+        }
+
+    def ratios(self, id1, id2, x1, x2, q2, cap=10):
+        """Returns the per-event weight ratio relative to the base PDF for each PDF
+
+        Ratios with an absolute value above the cap are set to one,
+        as are the ratios for events with partons not in the grid.
+        """
+        products = self.products(id1, id2, x1, x2, q2)
+        base = products[self._base]
+        ratios = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for pdf_id, product in products.items():
+                ratio = product / base
+                ratio[~np.isfinite(ratio) | (np.abs(ratio) > cap)] = 1
+                ratios[pdf_id] = ratio
+        return ratios
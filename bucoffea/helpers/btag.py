@@ -0,0 +1,110 @@
+import os
+import threading
+
+import numpy as np
+from coffea.btag_tools.btagscalefactor import BTagScaleFactor
+
+# Scale factor objects already parsed in this process
+_SF_CACHE = {}
+_SF_LOCK = threading.Lock()
+
+class MultiBTagScaleFactor(BTagScaleFactor):
+    '''
+    BTagScaleFactor that can evaluate several systematics at once.
+
+    The jet arrays are flattened and the flavor, eta and pt bins
+    are looked up only once, and are then shared by all systematics
+    that use the same binning. In practice, central, up and down
+    variations are binned identically, so that each jet is only
+    looked up a single time.
+    '''
+    def _functions(self, systematic):
+        try:
+            return self._compiled[systematic]
+        except KeyError:
+            functions = [BTagScaleFactor._compile(f) for f in self._corrections[systematic][-1]]
+            self._compiled[systematic] = functions
+            return functions
+
+    def eval_many(self, systematics, flavor, abseta, pt, ignore_missing=False):
+        """Evaluates the scale factor for multiple systematics
+
+        :param systematics: Systematics to evaluate, e.g. ['central', 'up', 'down']
+        :type systematics: list
+        :param flavor: Hadron flavor of the jets
+        :type flavor: JaggedArray
+        :param abseta: Absolute pseudorapidity of the jets
+        :type abseta: JaggedArray
+        :param pt: Transverse momentum of the jets
+        :type pt: JaggedArray
+        :param ignore_missing: If true, return 1 for jets without a correction instead of raising
+        :type ignore_missing: bool, optional
+        :return: Mapping between systematic and scale factor array shaped like pt
+        :rtype: dict
+        """
+        if self.workingpoint == BTagScaleFactor.RESHAPE:
+            raise ValueError('RESHAPE scale factors are not supported by eval_many')
+        try:
+            flavor.counts
+            jin, flavor = flavor, flavor.flatten()
+            abseta = abseta.flatten()
+            pt = pt.flatten()
+        except AttributeError:
+            jin = None
+
+        # Flavor binning is the same for all systematics
+        flavor_idx = 2 - self._lookup(self._flavor, flavor)
+
+        # Bin indices and clipped pt, shared between systematics with identical edges
+        binning = {}
+
+        results = {}
+        for systematic in systematics:
+            functions = self._functions(systematic)
+            edges_eta, edges_pt, _, mapping, _ = self._corrections[systematic]
+
+            binning_key = (edges_eta.tobytes(), edges_pt.tobytes())
+            if binning_key not in binning:
+                binning[binning_key] = (
+                    self._lookup(edges_eta, abseta),
+                    self._lookup(edges_pt, pt),
+                    np.clip(pt, edges_pt[0], edges_pt[-1])
+                )
+            eta_idx, pt_idx, var = binning[binning_key]
+
+            mapidx = mapping[(flavor_idx, eta_idx, pt_idx, 0)]
+            out = np.ones(mapidx.shape, dtype=pt.dtype)
+            for ifunc in np.unique(mapidx):
+                if ifunc < 0 and not ignore_missing:
+                    raise ValueError('No correction was available for some items')
+                functions[ifunc](var, out=out, where=(mapidx == ifunc))
+
+            results[systematic] = jin.copy(content=out) if jin is not None else out
+        return results
+
+def get_btag_sf(filename, workingpoint, methods='comb,comb,incl'):
+    """Returns the b tag scale factor object for a given file and working point
+
+    The CSV file is only parsed the first time a combination of
+    file, working point and methods is requested in a process.
+    Later calls return the same object. A changed file modification
+    time results in the file being read again.
+
+    :param filename: Path to the BTV CSV file
+    :type filename: str
+    :param workingpoint: Working point, e.g. 'MEDIUM'
+    :type workingpoint: str
+    :param methods: Derivation methods for b, c and light flavor jets
+    :type methods: str
+    :return: Scale factor object
+    :rtype: MultiBTagScaleFactor
+    """
+    key = (os.path.abspath(filename), os.path.getmtime(filename), str(workingpoint).upper(), methods)
+    with _SF_LOCK:
+        if key not in _SF_CACHE:
+            _SF_CACHE[key] = MultiBTagScaleFactor(
+                                                  filename=filename,
+                                                  workingpoint=workingpoint,
+                                                  methods=methods
+                                                  )
+        return _SF_CACHE[key]
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
+import calendar
 import os
 import pickle
+import re
 import socket
 import subprocess
-import htcondor
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 pjoin = os.path.join
 def condor_submit(jobfile):
@@ -26,6 +30,19 @@ def condor_submit(jobfile):
         jobid = stdout.split()[-1].decode('utf-8').replace('.','')
     return jobid
 
+def condor_submit_dag(dagfile):
+    cmd = ["condor_submit_dag", dagfile]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"Condor DAG submission failed. Stderr:\n {stderr}.")
+    # The output ends with a line of dashes, the cluster is mentioned before
+    match = re.search(r"submitted to cluster (\d+)", stdout.decode('utf-8'))
+    if not match:
+        raise RuntimeError(f"Could not find the cluster ID in the output of condor_submit_dag:\n {stdout}.")
+    return match.group(1)
+
 
 
 def read_logs(directories):
@@ -35,8 +52,129 @@ def read_logs(directories):
             logs.extend([os.path.join(path, x) for x in files if x.startswith("log_")])
     return list(map(os.path.abspath, logs))
 
+# Names of the event codes in job event logs,
+# same as in htcondor.JobEventType
+EVENT_TYPES = [
+    'SUBMIT', 'EXECUTE', 'EXECUTABLE_ERROR', 'CHECKPOINTED', 'JOB_EVICTED',
+    'JOB_TERMINATED', 'IMAGE_SIZE', 'SHADOW_EXCEPTION', 'GENERIC', 'JOB_ABORTED',
+    'JOB_SUSPENDED', 'JOB_UNSUSPENDED', 'JOB_HELD', 'JOB_RELEASED', 'NODE_EXECUTE',
+    'NODE_TERMINATED', 'POST_SCRIPT_TERMINATED', 'GLOBUS_SUBMIT', 'GLOBUS_SUBMIT_FAILED', 'GLOBUS_RESOURCE_UP',
+    'GLOBUS_RESOURCE_DOWN', 'REMOTE_ERROR', 'JOB_DISCONNECTED', 'JOB_RECONNECTED', 'JOB_RECONNECT_FAILED',
+    'GRID_RESOURCE_UP', 'GRID_RESOURCE_DOWN', 'GRID_SUBMIT', 'JOB_AD_INFORMATION', 'JOB_STATUS_UNKNOWN',
+    'JOB_STATUS_KNOWN', 'JOB_STAGE_IN', 'JOB_STAGE_OUT', 'ATTRIBUTE_UPDATE', 'PRESKIP',
+    'CLUSTER_SUBMIT', 'CLUSTER_REMOVE', 'FACTORY_PAUSED', 'FACTORY_RESUMED', 'NONE',
+    'FILE_TRANSFER',
+]
+
+JobEvent = namedtuple('JobEvent', ['type', 'cluster', 'timestamp', 'returnvalue'])
+
+# E.g. "005 (1234.000.000) 2020-10-01 12:00:00 Job terminated."
+_EVENT_HEADER = re.compile(r'^(\d{3}) \((\d+)\.\d+\.\d+\) (\S+ [\d:.]+)')
+_RETURN_VALUE = re.compile(r'\(return value (-?\d+)\)')
+
+def _parse_timestamp(timestamp):
+    '''Seconds since the epoch, for both the ISO and the old date format without a year'''
+    for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%m/%d %H:%M:%S']:
+        try:
+            return calendar.timegm(datetime.strptime(timestamp, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError(f'Unknown time stamp format: {timestamp}')
+
+def _parse_event(lines):
+    match = _EVENT_HEADER.match(lines[0])
+    if not match:
+        return None
+    code, cluster, timestamp = match.groups()
+    code = int(code)
+    returnvalue = None
+    for line in lines[1:]:
+        m = _RETURN_VALUE.search(line)
+        if m:
+            returnvalue = int(m.group(1))
+            break
+    return JobEvent(
+                    type=EVENT_TYPES[code] if code < len(EVENT_TYPES) else str(code),
+                    cluster=int(cluster),
+                    timestamp=_parse_timestamp(timestamp),
+                    returnvalue=returnvalue
+                    )
+
+def parse_events(data):
+    """Parses the complete events in a chunk of a job event log
+
+    Every event ends with a line holding only "...". An event
+    that is still being written at the end of the chunk is left
+    for later.
+
+    :param data: Content of the log
+    :type data: bytes
+    :return: Events, and the number of bytes up to the end of the last complete event
+    :rtype: tuple
+    """
+    events = []
+    consumed = 0
+    position = 0
+    lines = []
+    for line in data.splitlines(keepends=True):
+        position += len(line)
+        if not line.endswith(b'\n'):
+            break
+        text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        if text == '...':
+            event = _parse_event(lines) if lines else None
+            if event:
+                events.append(event)
+            lines = []
+            consumed = position
+        else:
+            lines.append(text)
+    return events, consumed
+
+class EventLogTail():
+    '''
+    Reads a job event log incrementally.
+
+    The byte offset up to which the log has been parsed
+    is kept, so that each read only parses the events that
+    were appended since. Logs that have not been modified
+    since the last read are not opened at all.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.first = None
+        self._stamp = None
+
+    def read(self):
+        """Returns the events added since the last read
+
+        :rtype: list
+        """
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime, stat.st_size)
+        if stamp == self._stamp:
+            return []
+        if stat.st_size < self.offset:
+            # Log was replaced, start over
+            self.offset = 0
+            self.first = None
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        events, consumed = parse_events(data)
+        self.offset += consumed
+        self._stamp = stamp
+        if events and self.first is None:
+            self.first = events[0].timestamp
+        return events
+
 class ConJob():
     '''Condor Job'''
+    # Default for jobs pickled before logs were read incrementally
+    _tail = None
+
     def __init__(self,log):
         self.log = log
         self.status = None
@@ -108,33 +246,30 @@ class ConJob():
         if self.status == 'JOB_TERMINATED':
             return
 
-        # Updating works by opening the log file,
-        # Looping through and only keeping the last event,
-        # which really tells us what's going on.
-        # This is not very efficient, so an alternative
-        # implementation would be welcome
-        jel = htcondor.JobEventLog(self._log)
-
-        first = None
+        # Only the events appended since the last update are
+        # parsed, and the latest one tells us what's going on
+        if self._tail is None:
+            self._tail = EventLogTail(self._log)
         try:
-            for event in jel.events(stop_after=0):
-                if not first:
-                    first = event
-                latest = event
-            try:
-                self._code = latest["ReturnValue"]
-            except KeyError:
-                self._code = "-"
-            self.status = str(htcondor.JobEventType.values[latest.type])
-            self.cluster = latest.cluster
-            self.runtime = latest.timestamp - first.timestamp
-        except OSError:
+            events = self._tail.read()
+        except (OSError, ValueError):
             self.code = "-"
             self.status = "NOPARSE"
             self.cluster = "-"
             self.runtime = -1
-        finally:
-            jel.close()
+            return
+
+        if not events:
+            if self._tail.first is None:
+                self.code = "-"
+                self.cluster = "-"
+                self.runtime = 0
+            return
+        latest = events[-1]
+        self.code = "-" if latest.returnvalue is None else latest.returnvalue
+        self.status = latest.type
+        self.cluster = latest.cluster
+        self.runtime = latest.timestamp - self._tail.first
 
     def jdl(self):
         return self.log.replace('log_','job_').replace('.txt','.jdl')
@@ -151,10 +286,11 @@ class ConMan():
 
     Wraps a list of condor jobs.
     '''
-    def __init__(self,directory):
+    def __init__(self,directory, workers=8):
         self.directory = directory
         self.pkl = pjoin(directory, "jobs.pkl")
         self.autoresub = False
+        self.workers = workers
 
         self.init_jobs()
 
@@ -200,13 +336,16 @@ class ConMan():
         all_logs = set(read_logs([self.directory]))
         existing_logs = set([os.path.abspath(job.log) for job in jobs])
         logs_to_initialize = all_logs - existing_logs
-        jobs.extend(map(ConJob, logs_to_initialize))
+        with ThreadPoolExecutor(self.workers) as pool:
+            jobs.extend(pool.map(ConJob, logs_to_initialize))
 
         self.jobs = jobs
 
     def update(self):
-        for j in self.jobs:
-            j.update()
+        '''Updates the status of all unfinished jobs in parallel'''
+        unfinished = [j for j in self.jobs if j.status != 'JOB_TERMINATED']
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(ConJob.update, unfinished))
         if self.autoresub:
             self.resubmit_failed(max_resub=3)
 
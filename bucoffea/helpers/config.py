@@ -0,0 +1,145 @@
+import threading
+
+from bucoffea.helpers.dataset import extract_year
+from bucoffea.helpers.paths import bucoffea_path
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+ERAS = ['default', 'era2016', 'era2017', 'era2018']
+
+def _freeze(value):
+    """Recursively convert mappings and lists into their immutable counterparts"""
+    if isinstance(value, Mapping):
+        return FrozenConfig(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+class FrozenConfig(Mapping):
+    '''
+    Immutable, pre-resolved snapshot of a dynaconf configuration.
+
+    Values can be accessed either as items or as attributes.
+    Same as for the dynaconf settings object, the look up is
+    case-insensitive, so that cfg.BTAG.ALGO and cfg.btag.algo
+    resolve to the same value. Iteration returns the keys
+    as they are written in the configuration file.
+    '''
+    def __init__(self, data):
+        store = {key : _freeze(value) for key, value in data.items()}
+        object.__setattr__(self, '_data', store)
+        object.__setattr__(self, '_lower', {str(key).lower() : key for key in store})
+
+    def _resolve(self, key):
+        if key in self._data:
+            return key
+        try:
+            return self._lower[str(key).lower()]
+        except KeyError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        return self._data[self._resolve(key)]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f"Configuration has no parameter '{name}'.")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenConfig objects are immutable.")
+
+    def __contains__(self, key):
+        try:
+            self._resolve(key)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"FrozenConfig({self.as_dict()})"
+
+    def as_dict(self):
+        '''Returns a mutable deep copy of the configuration as plain dicts and lists'''
+        def thaw(value):
+            if isinstance(value, FrozenConfig):
+                return value.as_dict()
+            if isinstance(value, tuple):
+                return [thaw(x) for x in value]
+            return value
+        return {key : thaw(value) for key, value in self._data.items()}
+
+def load_config(settings_file, env='default'):
+    """Reads a configuration file for a given environment
+
+    A private dynaconf settings object is used, so that the
+    global dynaconf settings are never modified.
+
+    :param settings_file: Path of the configuration file relative to the bucoffea package
+    :type settings_file: str
+    :param env: Environment to load, e.g. 'default' or 'era2017'
+    :type env: str
+    :return: Fully resolved configuration
+    :rtype: FrozenConfig
+    """
+    from dynaconf import LazySettings
+    settings = LazySettings(
+                            SETTINGS_FILE_FOR_DYNACONF=bucoffea_path(settings_file),
+                            ENV_FOR_DYNACONF=env,
+                            MERGE_ENABLED_FOR_DYNACONF=True,
+                            DYNACONF_WORKS="merge_configs"
+                            )
+    return FrozenConfig(settings.as_dict())
+
+class ConfigCache(object):
+    '''
+    Per-era cache of configurations for one configuration file.
+
+    Each era is parsed at most once and then reused for
+    every chunk. The cached configurations are plain data,
+    so they travel together with the processor instance
+    when it is pickled and sent to the workers.
+    '''
+    def __init__(self, settings_file, preload=True):
+        self._settings_file = settings_file
+        self._configs = {}
+        self._lock = threading.Lock()
+        if preload:
+            for env in ERAS:
+                self.get(env)
+
+    def get(self, env='default'):
+        '''Returns the configuration for the given environment'''
+        try:
+            return self._configs[env]
+        except KeyError:
+            pass
+        with self._lock:
+            if env not in self._configs:
+                self._configs[env] = load_config(self._settings_file, env)
+        return self._configs[env]
+
+    def for_dataset(self, dataset):
+        '''Returns the configuration for the era the dataset belongs to'''
+        return self.get(f"era{extract_year(dataset)}")
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
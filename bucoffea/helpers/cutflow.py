@@ -1,5 +1,91 @@
 import tabulate
 
+from bucoffea.helpers.profiling import timed
+
+def cumulative_cutflow(selection, cuts, weights=None):
+    """Evaluate a sequence of cuts in a single running-AND pass
+
+    Every cut is applied on top of all previous ones, so that
+    all prefix masks of the sequence are computed with one AND
+    per cut, instead of re-evaluating each prefix from scratch.
+
+    :param selection: Selection holding the individual cuts
+    :type selection: coffea.processor.PackedSelection
+    :param cuts: Names of the cuts in the order they are applied
+    :type cuts: list
+    :param weights: Per-event weights for a weighted cutflow, defaults to None
+    :type weights: numpy.ndarray, optional
+    :return: Final mask, number of events passing after each cut and,
+             if weights are given, sum of weights passing after each cut (else None)
+    :rtype: tuple
+    """
+    mask = selection.all()
+    counts = []
+    weighted = [] if weights is not None else None
+    for cut in cuts:
+        mask &= selection.all(cut)
+        counts.append(mask.sum())
+        if weights is not None:
+            weighted.append(weights[mask].sum())
+    return mask, counts, weighted
+
+
+class SelectionPlanner(object):
+    '''
+    Evaluates the masks of many regions with shared cut prefixes.
+
+    The cut sequences of all regions are arranged in a trie, so that
+    a sequence of cuts that several regions start with is only
+    evaluated once per chunk. Each additional region then only costs
+    the cuts in which it differs from the others.
+    '''
+    def __init__(self, regions):
+        """
+        :param regions: Mapping between region name and its list of cuts
+        :type regions: dict
+        """
+        self._root = self._node()
+        for region, cuts in regions.items():
+            node = self._root
+            for cut in cuts:
+                node = node['children'].setdefault(cut, self._node())
+            node['regions'].append(region)
+
+    @staticmethod
+    def _node():
+        return {'children' : {}, 'regions' : []}
+
+    def nodes(self):
+        '''Number of cut evaluations needed per chunk'''
+        count = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            count += len(node['children'])
+            stack.extend(node['children'].values())
+        return count
+
+    @timed('selection')
+    def evaluate(self, selection):
+        """Evaluate the masks and cutflows for all regions
+
+        :param selection: Selection holding the individual cuts
+        :type selection: coffea.processor.PackedSelection
+        :return: Mapping between region name and a tuple of final mask
+                 and number of events passing after each cut
+        :rtype: dict
+        """
+        results = {}
+        stack = [(self._root, selection.all(), [])]
+        while stack:
+            node, mask, counts = stack.pop()
+            for region in node['regions']:
+                results[region] = (mask, counts)
+            for cut, child in node['children'].items():
+                child_mask = mask & selection.all(cut)
+                stack.append((child, child_mask, counts + [child_mask.sum()]))
+        return results
+
 def print_cutflow(output, outfile=None):
     """Pretty-print cutflow data to the terminal."""
     for i, cutflow_name in enumerate([ x for x in output.keys() if x.startswith("cutflow") ]):
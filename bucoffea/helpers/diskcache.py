@@ -0,0 +1,132 @@
+"""Least recently used caches on local disk"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+pjoin = os.path.join
+
+def cache_path(name, envvar):
+    '''Location below ~/.cache/bucoffea, can be set via the given environment variable'''
+    return os.environ.get(envvar, os.path.expanduser(pjoin('~/.cache/bucoffea', name)))
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def write_atomic(path, write):
+    """Writes a file or directory under a temporary name, then moves it into place
+
+    Readers never see partially written content, even if
+    several processes write the same path.
+
+    :param path: Path to write
+    :type path: str
+    :param write: Function writing the content to the temporary path it is given
+    :type write: callable
+    :return: False if path is a directory written by another process in the meantime
+    :rtype: bool
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    write(tmp)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        _remove(tmp)
+        return False
+    return True
+
+class DiskCache(object):
+    '''
+    Base class of the on-disk caches with a size limit.
+
+    Every entry is a file or directory named after its key, see
+    _path. Subclasses implement get and put, and call touch when
+    an entry is read. The least recently used entries are removed
+    once the total size exceeds the limit.
+    '''
+    # Name of the default directory below ~/.cache/bucoffea,
+    # and the environment variable to set a different one
+    dirname = None
+    envvar = None
+
+    def __init__(self, cachedir=None, maxsize=None):
+        """
+        :param cachedir: Directory to store the cache in, defaults to default_dir()
+        :type cachedir: str, optional
+        :param maxsize: Maximum total size of the cache in bytes
+        :type maxsize: int
+        """
+        self.cachedir = cachedir if cachedir else self.default_dir()
+        self.maxsize = maxsize
+        os.makedirs(self.cachedir, exist_ok=True)
+
+    @classmethod
+    def default_dir(cls):
+        return cache_path(cls.dirname, cls.envvar)
+
+    @staticmethod
+    def key(**content):
+        '''Builds the cache key from the given content'''
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        raise NotImplementedError
+
+    def touch(self, path):
+        '''Marks an entry as recently used'''
+        os.utime(path)
+
+    def entries(self):
+        """Lists the cache entries, oldest first
+
+        :return: Tuples of (path, size in bytes, last use time)
+        :rtype: list
+        """
+        entries = []
+        for path in glob.glob(self._path('*')):
+            if path.endswith('.tmp'):
+                continue
+            try:
+                used = os.stat(path).st_mtime
+                if os.path.isdir(path):
+                    size = sum(os.stat(pjoin(path, x)).st_size for x in os.listdir(path))
+                else:
+                    size = os.stat(path).st_size
+            except FileNotFoundError:
+                continue
+            entries.append((path, size, used))
+        return sorted(entries, key=lambda x: x[2])
+
+    def size(self):
+        return sum(x[1] for x in self.entries())
+
+    def prune(self, maxsize=None):
+        '''Removes the least recently used entries until the cache fits into maxsize'''
+        maxsize = self.maxsize if maxsize is None else maxsize
+        entries = self.entries()
+        total = sum(x[1] for x in entries)
+        for path, size, _ in entries:
+            if total <= maxsize:
+                break
+            _remove(path)
+            total -= size
+
+    def clear(self, older_than=None):
+        """Removes cache entries
+
+        :param older_than: If given, only remove entries not used for this many seconds
+        :type older_than: float, optional
+        """
+        now = time.time()
+        for path, _, used in self.entries():
+            if older_than is None or now - used > older_than:
+                _remove(path)
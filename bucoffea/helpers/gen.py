@@ -12,6 +12,7 @@ from bucoffea.helpers.dataset import (
                                       is_nlo_z,
                                       is_lo_znunu
                                       )
+from bucoffea.helpers.profiling import timed
 
 def find_first_parent(in_mother, in_pdg, maxgen=10):
     """Finds the first parent with a PDG ID different from the daughter
@@ -232,6 +233,7 @@ def fill_gen_v_info(df, gen, dressed):
     df['gen_v_pt_lhe'] = df['LHE_Vpt']
     df['gen_v_phi_lhe'] = np.zeros(df.size)
 
+@timed('candidates')
 def setup_gen_candidates(df):
     gen = JaggedCandidateArray.candidatesfromcounts(
         df['nGenPart'],
@@ -276,6 +278,7 @@ def setup_gen_jets_ak8(df):
         )
     return genjets
 
+@timed('candidates')
 def setup_dressed_gen_candidates(df):
     dressed = JaggedCandidateArray.candidatesfromcounts(
         df['nGenDressedLepton'],
@@ -304,6 +307,7 @@ def setup_lhe_candidates(df):
         )
     return lhe
 
+@timed('candidates')
 def setup_lhe_cleaned_genjets(df):
     genjets = JaggedCandidateArray.candidatesfromcounts(
             df['nGenJet'],
@@ -1,5 +1,16 @@
+import hashlib
+import math
+import os
+import pickle
+import threading
+import time
+
 from bucoffea.helpers.paths import bucoffea_path
+import numba
 import numpy as np
+from awkward import JaggedArray
+
+pjoin = os.path.join
 
 def dphi(phi1, phi2):
     """Calculates delta phi between objects"""
@@ -72,24 +83,66 @@ def weight_shape(values, weight):
     """Broadcasts weight array to right shape for given values"""
     return (~np.isnan(values) * weight).flatten()
 
+@numba.njit(cache=True)
+def _overlap_kernel(offsets, eta, phi, against_offsets, against_eta, against_phi, dr, mask):
+    """Sets the mask to False for candidates within dr of any candidate in the other collection"""
+    for iev in range(len(offsets) - 1):
+        for i in range(offsets[iev], offsets[iev + 1]):
+            if not mask[i]:
+                continue
+            for j in range(against_offsets[iev], against_offsets[iev + 1]):
+                x = abs(phi[i] - against_phi[j])
+                if x > np.pi:
+                    x = 2 * np.pi - x
+                if not math.hypot(x, eta[i] - against_eta[j]) > dr:
+                    mask[i] = False
+                    break
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
 def object_overlap(toclean, cleanagainst, dr=0.4):
     """Generate a mask to use for overlap removal
 
+    The distances are computed per event by a compiled loop
+    over the candidate pairs, without creating the pair arrays.
+    A candidate is kept if it is further away than dr from all
+    candidates it is cleaned against.
+
     :param toclean: Candidates that should be cleaned (lower priority candidats)
     :type toclean: JaggedCandidateArray
-    :param cleanagainst: Candidates that should be cleaned against (higher priority)
-    :type cleanagainst: JaggedCandidateArray
-    :param dr: Delta R parameter, defaults to 0.4
-    :type dr: float, optional
+    :param cleanagainst: Candidates that should be cleaned against (higher priority),
+                         or a list of several such collections
+    :type cleanagainst: JaggedCandidateArray or list
+    :param dr: Delta R parameter, defaults to 0.4, or a list with one value per collection
+    :type dr: float or list, optional
     :return: Mask to select non-overlapping candidates in the collection to be cleaned
     :rtype: JaggedArray
     """
-    comb_phi = toclean.phi.cross(cleanagainst.phi, nested=True)
-    comb_eta = toclean.eta.cross(cleanagainst.eta, nested=True)
-    delta_r = np.hypot( dphi(comb_phi.i0, comb_phi.i1), comb_eta.i0-comb_eta.i1)
-
-    return delta_r.min() > dr
-
+    if not isinstance(cleanagainst, (list, tuple)):
+        cleanagainst = [cleanagainst]
+    if not isinstance(dr, (list, tuple)):
+        dr = [dr] * len(cleanagainst)
+    if len(dr) != len(cleanagainst):
+        raise ValueError(f"Expected one dr value per collection, got {len(dr)} for {len(cleanagainst)} collections.")
+
+    counts = toclean.counts
+    offsets = _offsets(counts)
+    eta = np.asarray(toclean.eta.flatten(), dtype=np.float64)
+    phi = np.asarray(toclean.phi.flatten(), dtype=np.float64)
+    mask = np.ones(len(eta), dtype=np.bool_)
+    for other, other_dr in zip(cleanagainst, dr):
+        _overlap_kernel(
+                        offsets, eta, phi,
+                        _offsets(other.counts),
+                        np.asarray(other.eta.flatten(), dtype=np.float64),
+                        np.asarray(other.phi.flatten(), dtype=np.float64),
+                        float(other_dr),
+                        mask
+                        )
+    return JaggedArray.fromcounts(counts, mask)
 
 
 def mask_or(df, masks):
@@ -137,32 +190,136 @@ def mask_and(df, masks):
 
 from coffea.lookup_tools import extractor
 
-def evaluator_from_config(cfg):
-    """Initiates the SF evaluator and populates it with the right values
+# Evaluators that have already been built in this process,
+# keyed by the content of the SF definitions they were built from
+_EVALUATOR_CACHE = {}
+_EVALUATOR_LOCK = threading.Lock()
+
+# Counters for monitoring the cache, reported in the executor metrics
+EVALUATOR_STATS = {
+    'hits' : 0,
+    'diskhits' : 0,
+    'builds' : 0,
+    'buildtime' : 0.,
+}
+
+def _sf_weight_sets(cfg):
+    """Returns the weight set definitions needed for the SF evaluator
 
     :param cfg: Configuration
-    :type cfg: DynaConf object
-    :return: Ready-to-use SF evaluator
-    :rtype: coffea.lookup_tools.evaluator
+    :type cfg: FrozenConfig
+    :return: Tuples of (name, histogram, absolute file path)
+    :rtype: list
     """
-    ext = extractor()
-
+    weight_sets = []
     for sfname, definition in cfg.SF.items():
         if not 'file' in definition:
             continue
         fpath = bucoffea_path(definition['file'])
 
         if fpath.endswith(".root"):
-            ext.add_weight_sets([f"{sfname} {definition['histogram']} {fpath}"])
-            ext.add_weight_sets([f"{sfname}_error {definition['histogram']}_error {fpath}"])
-        else:
-            continue
+            weight_sets.append((sfname, definition['histogram'], fpath))
+    return weight_sets
+
+def _evaluator_key(weight_sets):
+    """Unique key for an evaluator built from the given weight sets.
+
+    The modification time and size of every input file are
+    part of the key, so that an updated SF file is never
+    served from an outdated cache entry.
+    """
+    content = []
+    for sfname, histogram, fpath in weight_sets:
+        stat = os.stat(fpath)
+        content.append((sfname, histogram, fpath, stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha256(repr(sorted(content)).encode('utf-8')).hexdigest()
 
+def _build_evaluator(weight_sets):
+    ext = extractor()
+    for sfname, histogram, fpath in weight_sets:
+        ext.add_weight_sets([f"{sfname} {histogram} {fpath}"])
+        ext.add_weight_sets([f"{sfname}_error {histogram}_error {fpath}"])
     ext.finalize()
+    return ext.make_evaluator()
+
+def _load_evaluator(cache_file):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # Unreadable, or written by a different version of the code
+        # or its dependencies. Removed so that it is rebuilt.
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+        return None
+
+def _dump_evaluator(evaluator, cache_file):
+    # Write to a temporary file first so that concurrent
+    # jobs never see a partially written cache file
+    tmp = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump(evaluator, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except IOError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def evaluator_from_config(cfg, cache_dir=None):
+    """Initiates the SF evaluator and populates it with the right values
 
-    evaluator = ext.make_evaluator()
+    Evaluators are built only once per process for a given set of
+    SF definitions and input files, and are reused afterwards.
+    If a cache directory is given, or the BUCOFFEA_SF_CACHE environment
+    variable is set, the finished evaluator is also pickled there,
+    so that new processes can skip reading the ROOT files.
+
+    :param cfg: Configuration
+    :type cfg: FrozenConfig
+    :param cache_dir: Directory for the on-disk evaluator cache, defaults to None
+    :type cache_dir: str, optional
+    :return: Ready-to-use SF evaluator
+    :rtype: coffea.lookup_tools.evaluator
+    """
+    weight_sets = _sf_weight_sets(cfg)
+    key = _evaluator_key(weight_sets)
+
+    with _EVALUATOR_LOCK:
+        if key in _EVALUATOR_CACHE:
+            EVALUATOR_STATS['hits'] += 1
+            return _EVALUATOR_CACHE[key]
+
+        if cache_dir is None:
+            cache_dir = os.environ.get('BUCOFFEA_SF_CACHE', None)
+
+        evaluator = None
+        if cache_dir:
+            cache_file = pjoin(cache_dir, f'evaluator_{key}.pkl')
+            evaluator = _load_evaluator(cache_file)
+            if evaluator is not None:
+                EVALUATOR_STATS['diskhits'] += 1
+
+        if evaluator is None:
+            tic = time.time()
+            evaluator = _build_evaluator(weight_sets)
+            EVALUATOR_STATS['builds'] += 1
+            EVALUATOR_STATS['buildtime'] += time.time() - tic
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+                _dump_evaluator(evaluator, cache_file)
+
+        _EVALUATOR_CACHE[key] = evaluator
     return evaluator
 
+def evaluator_stats():
+    """Returns a copy of the evaluator cache counters"""
+    with _EVALUATOR_LOCK:
+        return dict(EVALUATOR_STATS)
+
 
 def sigmoid(x,a,b,c,d):
     """
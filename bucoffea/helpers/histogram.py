@@ -0,0 +1,156 @@
+import numpy as np
+from coffea.hist.hist_tools import DenseAxis
+
+from bucoffea.helpers.profiling import timed
+
+class FillPlan(object):
+    '''
+    Deferred, batched filling of coffea histograms.
+
+    Fills are collected with add(), which takes the same arguments
+    as Hist.fill, and are carried out together by execute():
+
+        * Bin indices are computed once per column and binning, so that
+          a column used by several histograms is only binned once. Columns
+          are identified by the array object, i.e. the same array has to be
+          passed to benefit from this.
+        * All pending fills are turned into one array of flat bin
+          positions, and the sums of weights for all histograms are
+          accumulated with a single call of np.bincount, instead of one
+          call of np.add.at per histogram.
+
+    The pending fills are executed automatically once they exceed
+    a given number of entries, to limit the memory usage.
+    '''
+    def __init__(self, output, maxsize=2**22, **defaults):
+        """
+        :param output: Accumulator holding the histograms
+        :type output: dict_accumulator
+        :param maxsize: Number of pending entries after which fills are executed
+        :type maxsize: int, optional
+        :param defaults: Default values for sparse axes, e.g. dataset
+        """
+        self._output = output
+        self.maxsize = maxsize
+        self.defaults = defaults
+        self._reset()
+
+    def _reset(self):
+        self._pending = []
+        self._npending = 0
+        self._indices = {}
+        self._columns = []
+        self._axis_keys = {}
+
+    def _axis_key(self, axis):
+        '''Identifies the binning of a dense axis'''
+        try:
+            return self._axis_keys[id(axis)]
+        except KeyError:
+            pass
+        if axis._uniform:
+            key = ('uniform', axis._bins, axis._lo, axis._hi)
+        else:
+            key = ('variable', axis._bins.tobytes())
+        self._axis_keys[id(axis)] = key
+        return key
+
+    def _index(self, axis, values):
+        '''Bin indices of a column, computed once per binning'''
+        if not isinstance(values, np.ndarray):
+            return axis.index(values)
+        key = (id(values), self._axis_key(axis))
+        try:
+            return self._indices[key]
+        except KeyError:
+            pass
+        index = axis.index(values)
+        self._indices[key] = index
+        # Keep the column alive, so that its id is not reused
+        self._columns.append(values)
+        return index
+
+    def add(self, name, **kwargs):
+        """Schedules a fill of a histogram
+
+        :param name: Name of the histogram in the output
+        :type name: str
+        :param kwargs: Values per axis and weight, like for Hist.fill
+        """
+        with timed('fill'):
+            self._add(name, **kwargs)
+
+    def _add(self, name, **kwargs):
+        hist = self._output[name]
+        values = dict(self.defaults)
+        values.update(kwargs)
+
+        if not all(d.name in values for d in hist._axes):
+            missing = ", ".join(d.name for d in hist._axes if d.name not in values)
+            raise ValueError("Not all axes specified for %r.  Missing: %s" % (hist, missing))
+        if not all(n in hist._axes or n == 'weight' for n in values):
+            extra = ", ".join(n for n in values if not (n in hist._axes or n == 'weight'))
+            raise ValueError("Unrecognized axes specified for %r.  Extraneous: %s" % (hist, extra))
+
+        weight = values.get('weight', None)
+        if weight is not None and hist._sumw2 is None:
+            hist._init_sumw2()
+
+        sparse_key = tuple(d.index(values[d.name]) for d in hist.sparse_axes())
+        if sparse_key not in hist._sumw:
+            hist._sumw[sparse_key] = np.zeros(shape=hist._dense_shape, dtype=hist._dtype)
+            if hist._sumw2 is not None:
+                hist._sumw2[sparse_key] = np.zeros(shape=hist._dense_shape, dtype=hist._dtype)
+
+        dense = [self._index(d, values[d.name]) for d in hist._axes if isinstance(d, DenseAxis)]
+        if dense:
+            dense = np.broadcast_arrays(*dense)
+            flat = np.ravel_multi_index(dense, hist._dense_shape).ravel()
+            weight = np.ones(flat.size) if weight is None else np.broadcast_to(weight, flat.shape)
+        else:
+            # Without dense axes, the weights are summed into a single bin
+            weight = np.ones(1) if weight is None else np.ravel(weight)
+            flat = np.zeros(weight.size, dtype=np.intp)
+
+        self._pending.append((hist, sparse_key, flat, weight))
+        self._npending += flat.size
+        if self._npending > self.maxsize:
+            self._execute()
+
+    def execute(self):
+        '''Carries out all pending fills'''
+        with timed('fill'):
+            self._execute()
+
+    def _execute(self):
+        if not self._pending:
+            return
+
+        # Every (histogram, sparse bin) gets a slice of
+        # a common array holding the bin contents
+        offsets = {}
+        targets = []
+        size = 0
+        indices = []
+        weights = []
+        for hist, sparse_key, flat, weight in self._pending:
+            key = (id(hist), sparse_key)
+            if key not in offsets:
+                offsets[key] = size
+                targets.append((hist, sparse_key, size))
+                size += hist._sumw[sparse_key].size
+            indices.append(flat + offsets[key])
+            weights.append(weight)
+
+        indices = np.concatenate(indices)
+        weights = np.concatenate(weights)
+        sumw = np.bincount(indices, weights=weights, minlength=size)
+        sumw2 = np.bincount(indices, weights=weights**2, minlength=size)
+
+        for hist, sparse_key, start in targets:
+            stop = start + hist._sumw[sparse_key].size
+            hist._sumw[sparse_key] += sumw[start:stop].reshape(hist._dense_shape)
+            if hist._sumw2 is not None:
+                hist._sumw2[sparse_key] += sumw2[start:stop].reshape(hist._dense_shape)
+
+        self._reset()
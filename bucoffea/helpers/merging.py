@@ -1,9 +1,14 @@
 #!/usr/bin/env python
+import hashlib
 import itertools
+import json
+import re
 import time
 import os
+import shutil
+import tempfile
 from tqdm import tqdm
-from coffea.util import load
+from coffea.util import load, save
 from klepto.archives import dir_archive
 
 pjoin = os.path.join
@@ -52,39 +57,271 @@ def _load_and_sum(args):
     
     assert(len(items)==1)
     
-    # dump the content using klepto
+    _dump_to_klepto(outname, key, items[0])
+    return 0
+
+def _dump_to_klepto(outname, key, item):
+    '''Writes a single item into the klepto dir'''
     arc = dir_archive(
                     outname,
                     serialized=True,
                     compression=0,
                     memsize=1e3,
                     )
-    arc[key] = items[0]
+    arc[key] = item
     arc.dump(key)
     arc.clear()
+
+def _load_and_spill(args):
+    """
+    Sum all items from a batch of coffea files and spill them to disk
+
+    Every file is loaded exactly once. The per-key sums over
+    the batch are written to one file per key in the scratch
+    directory, so that at most one batch sum is held in memory.
+
+    :param args: Tuple (batch index, file list, scratch directory, whether to keep trees)
+    :type args: tuple
+    :return: Keys that were written
+    :rtype: list
+    """
+    ibatch, files, scratch, save_trees = args
+
+    sums = {}
+    for fn in files:
+        for key, item in load(fn).items():
+            key = str(key)
+            if not save_trees and key.startswith("tree"):
+                continue
+            if key in sums:
+                sums[key] = sums[key] + item
+            else:
+                sums[key] = item
+
+    for key, item in sums.items():
+        keydir = pjoin(scratch, key)
+        os.makedirs(keydir, exist_ok=True)
+        save(item, pjoin(keydir, f"{ibatch}.coffea"))
+    return list(sums.keys())
+
+def _sum_partials(args):
+    """
+    Sum the spilled partial sums for one key and dump them to the klepto dir
+
+    The partial sums are loaded one after the other, so that
+    only the running sum and one partial are in memory at a time.
+
+    :param args: Tuple (key to use, partial file list, output name)
+    :type args: tuple
+    :return: 0
+    :rtype: int
+    """
+    key, files, outname = args
+
+    total = None
+    for fn in files:
+        item = load(fn)
+        total = item if total is None else total + item
+        os.remove(fn)
+
+    _dump_to_klepto(outname, key, total)
     return 0
 
+def merge_files(files, outname):
+    """
+    Sum the accumulators from a list of coffea files and save the result
+
+    The files are loaded one after the other, so that only
+    the running sum and one input are in memory at a time.
+
+    :param files: Coffea files to merge
+    :type files: list
+    :param outname: Path of the output coffea file
+    :type outname: str
+    """
+    if not files:
+        raise RuntimeError(f"No input files to merge into {outname}.")
+    total = None
+    for fn in tqdm(files, desc='Merging inputs'):
+        item = load(fn)
+        total = item if total is None else total + item
+
+    # Avoid leaving a partially written output behind
+    tmp = f"{outname}.tmp"
+    save(total, tmp)
+    os.replace(tmp, outname)
+
+def _sha256(fn):
+    '''Returns the SHA-256 digest of a file'''
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def merge_group(fn):
+    '''
+    Returns the name of the group a job output belongs to.
+
+    Job outputs are named after the processor and dataset,
+    optionally followed by a chunk index, so stripping
+    the index groups all outputs of one dataset.
+    '''
+    return re.sub(r'(_\d+)?\.coffea$', '', os.path.basename(fn))
+
+def _update_group(args):
+    """
+    Bring the partial sum of one group up to date
+
+    If all previously merged files are unchanged, only the new
+    files are loaded and added to the existing partial sum. If a
+    file was modified or removed, e.g. because the job was
+    resubmitted, the group is merged again from scratch,
+    so that no output is counted twice.
+
+    :param args: Tuple (partial sum path, manifest entry of the group, current files)
+    :type args: tuple
+    :return: Updated manifest entry of the group
+    :rtype: dict
+    """
+    partial, merged, files = args
+
+    current = {}
+    for fn in files:
+        stat = os.stat(fn)
+        current[fn] = {'size' : stat.st_size, 'mtime' : stat.st_mtime}
+
+    # Files whose size or time stamp changed are compared by content
+    unchanged = bool(merged) and os.path.exists(partial)
+    for fn, info in merged.items():
+        if fn not in current:
+            unchanged = False
+            break
+        if (info['size'], info['mtime']) == (current[fn]['size'], current[fn]['mtime']):
+            current[fn]['sha256'] = info['sha256']
+            continue
+        current[fn]['sha256'] = _sha256(fn)
+        if current[fn]['sha256'] != info['sha256']:
+            unchanged = False
+            break
+
+    if unchanged:
+        to_add = [fn for fn in files if fn not in merged]
+        total = load(partial) if to_add else None
+    else:
+        to_add = files
+        total = None
+
+    if not to_add:
+        return current
+
+    for fn in to_add:
+        if 'sha256' not in current[fn]:
+            current[fn]['sha256'] = _sha256(fn)
+        item = load(fn)
+        total = item if total is None else total + item
+
+    tmp = f"{partial}.{os.getpid()}.tmp"
+    save(total, tmp)
+    os.replace(tmp, partial)
+    return current
+
+class IncrementalMerge(object):
+    '''
+    Keeps per-group partial sums of job outputs up to date.
+
+    The state directory holds one partial sum per group and a
+    manifest recording size, modification time and hash of every
+    file that has been folded in. Repeated merges then only load
+    outputs that are new, and only re-merge the groups in which
+    outputs were replaced.
+    '''
+    def __init__(self, statedir, jobs=1):
+        self._statedir = statedir
+        self._manifest_path = pjoin(statedir, 'manifest.json')
+        self._jobs = jobs
+        os.makedirs(statedir, exist_ok=True)
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'r') as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {}
+
+    def _partial(self, group):
+        return pjoin(self._statedir, f'{group}.coffea')
+
+    def update(self, files):
+        """Fold the given files into the partial sums
+
+        :param files: All job outputs that should be part of the merge
+        :type files: list
+        :return: Paths of the partial sums, one per group
+        :rtype: list
+        """
+        groups = {}
+        for fn in sorted(files):
+            groups.setdefault(merge_group(fn), []).append(os.path.abspath(fn))
+
+        # Groups without any remaining files are dropped
+        for group in set(self._manifest) - set(groups):
+            self._manifest.pop(group)
+            if os.path.exists(self._partial(group)):
+                os.remove(self._partial(group))
+
+        args = [(self._partial(group), self._manifest.get(group, {}), groupfiles) for group, groupfiles in groups.items()]
+        if self._jobs > 1:
+            with multiprocessing.Pool(processes=self._jobs) as pool:
+                entries = pool.map(_update_group, args)
+        else:
+            entries = list(map(_update_group, tqdm(args, desc='Updating partial merges')))
+
+        for group, entry in zip(groups.keys(), entries):
+            self._manifest[group] = entry
+        self.save()
+
+        return [self._partial(group) for group in sorted(groups.keys())]
+
+    def digest(self):
+        '''Returns a hash that identifies the merged content'''
+        content = json.dumps(
+                             {group : {fn : info['sha256'] for fn, info in entry.items()} for group, entry in self._manifest.items()},
+                             sort_keys=True
+                             )
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def save(self):
+        tmp = f"{self._manifest_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self._manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self._manifest_path)
+
 class CoffeaMerger(object):
     '''
     Handles the merging of large numbers of coffea files.
     
     The results are stored using the klepto library.
     '''
-    def __init__(self, indir, jobs=1, save_trees=False):
+    def __init__(self, indir, jobs=1, save_trees=False, incremental=False):
         files = filter(lambda x: x.endswith(".coffea") and not ('cache' in x), os.listdir(indir))
         files = list(map(lambda x: os.path.abspath(pjoin(indir, x)), files))
+
+        # Only fold in new outputs and merge the per-dataset partial sums
+        if incremental:
+            files = IncrementalMerge(pjoin(indir, 'merged_cache_incremental'), jobs=jobs).update(files)
+
         self._files = files
         self._keys = set()
         self._save_trees = save_trees
 
         # Open a multiproc pool for various operations
         self._pool = multiprocessing.Pool(processes=jobs)
-        self._init_keys()
 
     def _init_keys(self):
         '''
         Construct set of all keys.
         '''
+        if self._keys:
+            return
         pool_result = self._pool.map_async(
             _load_keys,
             self._files
@@ -98,7 +335,10 @@ class CoffeaMerger(object):
     def to_klepto_dir(self, outname):
         '''
         Run the merging and save to a klepto dir.
+
+        Every file is loaded once for each key.
         '''
+        self._init_keys()
 
         # Queue asynchronous jobs for each key
         results = []
@@ -121,3 +361,51 @@ class CoffeaMerger(object):
                     results.remove(res)
                     t.update()
             time.sleep(1)
+        t.close()
+
+    def to_klepto_dir_single_pass(self, outname, batch_size=10, scratch=None):
+        '''
+        Run the merging in a single pass over the inputs and save to a klepto dir.
+
+        The input files are split into batches. For each batch,
+        every file is loaded only once and the per-key sums are
+        spilled to a scratch directory. The partial sums are then
+        reduced per key in parallel. The output is identical to
+        the one of to_klepto_dir.
+
+        :param outname: Path of the output klepto dir
+        :type outname: str
+        :param batch_size: Number of input files to sum in memory per worker
+        :type batch_size: int
+        :param scratch: Directory in which to create the temporary directory
+                        for the partial sums, defaults to the parent of the output
+        :type scratch: str, optional
+        '''
+        if scratch is None:
+            scratch = os.path.dirname(os.path.abspath(outname))
+        os.makedirs(scratch, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix='merge_scratch_', dir=scratch)
+
+        try:
+            # Map: load each file once, sum within batches
+            batches = [
+                    (ibatch, self._files[i:i+batch_size], scratch, self._save_trees)
+                    for ibatch, i in enumerate(range(0, len(self._files), batch_size))
+                    ]
+            partials = {}
+            t = tqdm(total=len(batches), desc='Loading inputs')
+            for (ibatch, *_), keys in zip(batches, self._pool.imap(_load_and_spill, batches)):
+                for key in keys:
+                    partials.setdefault(key, []).append(pjoin(scratch, key, f"{ibatch}.coffea"))
+                t.update()
+            t.close()
+            self._keys = set(partials.keys())
+
+            # Reduce: sum partials per key
+            args = [(key, files, outname) for key, files in partials.items()]
+            t = tqdm(total=len(args), desc='Merging inputs')
+            for _ in self._pool.imap_unordered(_sum_partials, args):
+                t.update()
+            t.close()
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
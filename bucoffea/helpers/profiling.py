@@ -0,0 +1,105 @@
+"""Lightweight timing of the processing steps"""
+
+import time
+from collections import defaultdict
+from contextlib import ContextDecorator
+
+import tabulate
+
+_TIMES = defaultdict(float)
+_STACK = []
+
+class timed(ContextDecorator):
+    '''
+    Adds the time spent in a block or function to a named timer.
+
+    Timers are exclusive: time spent in a nested timed block
+    is only counted for the inner block, so that all timers
+    together add up to the total time spent in timed blocks.
+
+    Usable as context manager, with timed('name'): ..., or as
+    decorator, @timed('name'). The state is kept on a stack
+    rather than the instance, so that decorated functions
+    can be called recursively and pickled.
+    '''
+    def __init__(self, name):
+        """
+        :param name: Name of the timer
+        :type name: str
+        """
+        self.name = name
+
+    def __enter__(self):
+        # Start time and time spent in nested blocks, filled in by those
+        _STACK.append([time.perf_counter(), 0.])
+        return self
+
+    def __exit__(self, *exc):
+        tic, nested = _STACK.pop()
+        elapsed = time.perf_counter() - tic
+        _TIMES[self.name] += elapsed - nested
+        if _STACK:
+            _STACK[-1][1] += elapsed
+        return False
+
+def timing_stats():
+    """Returns a copy of the timers"""
+    return dict(_TIMES)
+
+def timing_difference(before, after):
+    '''Time spent per timer between two calls of timing_stats'''
+    return {k : v - before.get(k, 0.) for k, v in after.items() if v != before.get(k, 0.)}
+
+# Rows of the summary table, branch reading is summed up
+# over all timers with names starting with "read/"
+SECTIONS = [
+    ('open', 'Opening files'),
+    ('prefetch', 'Prefetching baskets'),
+    ('read', 'Reading branches'),
+    ('columncache', 'Column cache'),
+    ('candidates', 'Building candidates'),
+    ('weights', 'Weights and SFs'),
+    ('selection', 'Selections'),
+    ('fill', 'Histogram filling'),
+    ('process', 'Other processing'),
+]
+
+def profile_table(profile, nbranches=10):
+    """Summary of the time spent per processing step
+
+    :param profile: Profile as recorded by the executor, with
+                    chunks, entries and times per dataset
+    :type profile: dict
+    :param nbranches: Number of slowest branches to list per dataset
+    :type nbranches: int, optional
+    :return: Table as text
+    :rtype: str
+    """
+    lines = []
+    for dataset in sorted(profile):
+        item = profile[dataset]
+        chunks, entries = item['chunks'].value, item['entries'].value
+        times = {k : v.value for k, v in item['times'].items()}
+        reads = {k[len('read/'):] : v for k, v in times.items() if k.startswith('read/')}
+        sections = {name : times.get(name, 0.) for name, _ in SECTIONS}
+        sections['read'] = sum(reads.values())
+        total = sum(sections.values())
+
+        table = []
+        for name, title in SECTIONS:
+            table.append([
+                title,
+                sections[name],
+                100 * sections[name] / total if total else 0,
+                1e6 * sections[name] / entries if entries else 0,
+            ])
+        table.append(['Total', total, 100 if total else 0, 1e6 * total / entries if entries else 0])
+        lines.append(f"{dataset}: {chunks} chunks, {entries} events")
+        lines.append(tabulate.tabulate(table, headers=['Step', 'Time [s]', 'Fraction [%]', 'ms / 1k events'], floatfmt='.2f'))
+
+        slowest = sorted(reads.items(), key=lambda x: -x[1])[:nbranches]
+        if slowest:
+            lines.append('')
+            lines.append(tabulate.tabulate(slowest, headers=['Branch', 'Read time [s]'], floatfmt='.3f'))
+        lines.append('')
+    return '\n'.join(lines)
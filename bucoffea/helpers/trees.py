@@ -0,0 +1,126 @@
+"""Event trees written to Parquet files per chunk"""
+
+import hashlib
+import os
+
+import numpy as np
+
+pjoin = os.path.join
+
+# Key of the list of written tree files in the processor output
+MANIFEST = 'tree_files'
+
+def default_tree_dir():
+    '''Directory to write the tree files to, can be set via BUCOFFEA_TREE_DIR'''
+    return os.environ.get('BUCOFFEA_TREE_DIR', '.')
+
+def tree_accumulators(output):
+    '''Names of the tree accumulators in a processor output'''
+    return [x for x in map(str, output.keys()) if x.startswith('tree_') and x != MANIFEST]
+
+def chunk_name(df):
+    '''Identifier of the chunk of events in a data frame'''
+    chunk = f"{df['filename']}:{df['entrystart']}:{df['entrystop']}"
+    return hashlib.md5(chunk.encode('utf-8')).hexdigest()
+
+def column_type(array):
+    """Type to store a column with
+
+    Parquet has no half precision floats,
+    so these are stored as single precision.
+    """
+    if array.dtype == np.float16:
+        return np.dtype(np.float32)
+    return array.dtype
+
+def write_chunk_trees(output, df, treedir=None):
+    """Moves the tree columns of a chunk from the output into Parquet files
+
+    One file is written per region with selected events. The tree
+    accumulators are emptied afterwards, so that the columns do
+    not have to be merged and pickled along with the output. The
+    written files are listed in output[MANIFEST], with their
+    path relative to the tree directory.
+
+    :param output: Output of the processor for this chunk
+    :type output: dict_accumulator
+    :param df: Data frame of the chunk
+    :type df: LazyDataFrame
+    :param treedir: Directory to write to, defaults to default_tree_dir()
+    :type treedir: str, optional
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    treedir = treedir if treedir else default_tree_dir()
+    dataset = df['dataset']
+    chunk = chunk_name(df)
+
+    columns = {}
+    for name in tree_accumulators(output):
+        for region, variables in output[name].items():
+            for variable, column in variables.items():
+                columns.setdefault(region, {})[variable] = column.value
+        output[name] = output[name].identity()
+
+    for region, variables in columns.items():
+        lengths = set(len(v) for v in variables.values())
+        if len(lengths) != 1:
+            raise RuntimeError(f"Tree columns of region {region} differ in length: {sorted(lengths)}")
+        entries = lengths.pop()
+        if not entries:
+            continue
+
+        path = f"tree_{dataset}_{region}_{chunk}.parquet"
+        table = pa.table({k : v.astype(column_type(v), copy=False) for k, v in sorted(variables.items())})
+        os.makedirs(treedir, exist_ok=True)
+        tmp = pjoin(treedir, f"{path}.{os.getpid()}.tmp")
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, pjoin(treedir, path))
+
+        output[MANIFEST].append({
+            'dataset' : dataset,
+            'region' : region,
+            'path' : path,
+            'entries' : entries,
+        })
+
+def open_trees(files, treedir, region=None, dataset=None):
+    """Lazy dataset of the tree files listed in a processor output
+
+    Columns are only read when the dataset is scanned, e.g. with
+    to_table(columns=..., filter=...). The dataset and region of
+    each event are available as columns of the same name. Columns
+    missing from some of the files, e.g. since they are only saved
+    for some of the regions, are filled with nulls there.
+
+    :param files: List of tree files, as in output[MANIFEST]
+    :type files: list
+    :param treedir: Directory the paths of the files are relative to
+    :type treedir: str
+    :param region: Only include this region
+    :type region: str, optional
+    :param dataset: Only include this dataset
+    :type dataset: str, optional
+    :rtype: pyarrow.dataset.FileSystemDataset
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+
+    files = [x for x in files if region in (None, x['region']) and dataset in (None, x['dataset'])]
+    paths = [os.path.abspath(pjoin(treedir, x['path'])) for x in files]
+
+    schema = pa.unify_schemas(
+                              [pq.read_schema(x) for x in paths]
+                              + [pa.schema([('dataset', pa.string()), ('region', pa.string())])]
+                              )
+    partitions = [(ds.field('dataset') == x['dataset']) & (ds.field('region') == x['region']) for x in files]
+    return ds.FileSystemDataset.from_paths(
+                                           paths,
+                                           schema=schema,
+                                           format=ds.ParquetFileFormat(),
+                                           filesystem=pyarrow.fs.LocalFileSystem(),
+                                           partitions=partitions,
+                                           )
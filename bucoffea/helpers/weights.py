@@ -1,13 +1,16 @@
 import re
+from collections import ChainMap, OrderedDict
 
 import coffea.processor as processor
 import numpy as np
 
-from coffea.btag_tools.btagscalefactor import BTagScaleFactor
+from bucoffea.helpers.btag import get_btag_sf
 from bucoffea.helpers.dataset import extract_year
 from bucoffea.helpers.gen import get_gen_photon_pt
 from bucoffea.helpers.paths import bucoffea_path
+from bucoffea.helpers.profiling import timed
 
+@timed('weights')
 def get_veto_weights(df, cfg, evaluator, electrons, muons, taus, do_variations=False):
     """
     Calculate veto weights for SR W
@@ -171,23 +174,156 @@ def btag_weights(bjets, cfg):
         return weight_variations
 
     # Heavy lifting done by coffea implementation
-    bsf = BTagScaleFactor(
-                          filename=bucoffea_path(cfg.SF.DEEPCSV.FILE),
-                          workingpoint=cfg.BTAG.WP.upper(),
-                          methods='comb,comb,incl' # Comb for b and c flavors, incl for light
-                          )
-
-
-    for variation in ["central","up","down"]:
-        weights = bsf.eval(
-                        systematic=variation,
-                        flavor=bjets.hadflav,
-                        abseta=bjets.abseta,
-                        pt=bjets.pt)
-
-        # Cap the weights just in case
+    # The scale factor object is only built once per process
+    bsf = get_btag_sf(
+                      filename=bucoffea_path(cfg.SF.DEEPCSV.FILE),
+                      workingpoint=cfg.BTAG.WP.upper(),
+                      methods='comb,comb,incl' # Comb for b and c flavors, incl for light
+                      )
+
+    weight_variations = bsf.eval_many(
+                                      systematics=["central","up","down"],
+                                      flavor=bjets.hadflav,
+                                      abseta=bjets.abseta,
+                                      pt=bjets.pt
+                                      )
+
+    # Cap the weights just in case
+    for weights in weight_variations.values():
         weights[np.abs(weights)>5] = 1
 
-        weight_variations[variation] = weights
-
-    return weight_variations
\ No newline at end of file
+    return weight_variations
+
+
+class LayeredWeights(object):
+    '''
+    Region-specific view on a shared processor.Weights object.
+
+    The base weights are referenced, not copied. Weights added to the
+    view, e.g. trigger or veto weights, are only stored in the view
+    and are multiplied on top of the base weights when requested.
+    Provides the parts of the processor.Weights interface used by the
+    processors: add, weight, partial_weight, variations and _weights.
+
+    Products of the base weights for a given set of weight names are
+    cached in a dictionary that can be shared between all views on the
+    same base, so that e.g. the weight without the lepton scale factors
+    is only computed once per chunk. The base must therefore not be
+    modified while views on it are in use.
+    '''
+    def __init__(self, base, shared_cache=None):
+        """
+        :param base: Weights common to all regions, needs storeIndividual=True
+        :type base: coffea.processor.Weights
+        :param shared_cache: Cache for products of base weights
+        :type shared_cache: dict, optional
+        """
+        self._base = base
+        self._base_cache = {} if shared_cache is None else shared_cache
+        self._own = OrderedDict()
+        self._own_weight = None
+        self._modifiers = {}
+        self._weightStats = {}
+        self._cache = {}
+        # Read-only combined view of the individual weights, region-specific ones take precedence
+        self._weights = ChainMap(self._own, base._weights)
+
+    def add(self, name, weight, weightUp=None, weightDown=None, shift=False):
+        '''Adds a region-specific weight, same arguments as processor.Weights.add'''
+        if name.endswith('Up') or name.endswith('Down'):
+            raise ValueError("Avoid using 'Up' and 'Down' in weight names, instead pass appropriate shifts to add() call")
+        weight = np.array(weight)
+        self._own_weight = weight if self._own_weight is None else self._own_weight * weight
+        self._own[name] = weight
+        if weightUp is not None:
+            weightUp = np.array(weightUp)
+            if shift:
+                weightUp += weight
+            weightUp[weight != 0.] /= weight[weight != 0.]
+            self._modifiers[name + 'Up'] = weightUp
+        if weightDown is not None:
+            weightDown = np.array(weightDown)
+            if shift:
+                weightDown = weight - weightDown
+            weightDown[weight != 0.] /= weight[weight != 0.]
+            self._modifiers[name + 'Down'] = weightDown
+        self._weightStats[name] = {
+            'sumw': weight.sum(),
+            'sumw2': (weight**2).sum(),
+            'min': weight.min(),
+            'max': weight.max(),
+            'n': weight.size,
+        }
+        self._cache.clear()
+
+    def _modifier(self, modifier):
+        if modifier in self._modifiers:
+            return self._modifiers[modifier]
+        if modifier in self._base._modifiers:
+            return self._base._modifiers[modifier]
+        if 'Down' in modifier:
+            return 1. / self._modifier(modifier.replace('Down', 'Up'))
+        raise KeyError(modifier)
+
+    def weight(self, modifier=None):
+        '''Total event weight, optionally with a systematic shift applied'''
+        if None not in self._cache:
+            self._cache[None] = self._base._weight if self._own_weight is None else self._base._weight * self._own_weight
+        if modifier is None:
+            return self._cache[None]
+        return self._cache[None] * self._modifier(modifier)
+
+    def _base_product(self, names):
+        key = frozenset(names)
+        try:
+            return self._base_cache[key]
+        except KeyError:
+            pass
+        w = np.ones(self._base._weight.size)
+        for name in names:
+            w = w * self._base._weights[name]
+        self._base_cache[key] = w
+        return w
+
+    def partial_weight(self, include=[], exclude=[]):
+        """Product of a subset of the individual weights
+
+        Same as processor.Weights.partial_weight. The returned
+        arrays are cached and must not be modified in place.
+
+        :param include: Weight names to include
+        :type include: list
+        :param exclude: Weight names to exclude
+        :type exclude: list
+        :return: Partial event weight
+        :rtype: numpy.ndarray
+        """
+        if (include and exclude) or not (include or exclude):
+            raise ValueError("Need to specify exactly one of the 'exclude' or 'include' arguments.")
+        key = (frozenset(include), frozenset(exclude))
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        names = set(self._weights.keys())
+        if include:
+            names = names & set(include)
+        if exclude:
+            names = names - set(exclude)
+
+        # Region-specific weights replace base weights of the same name
+        own = [name for name in self._own if name in names]
+        w = self._base_product(names - set(own))
+        for name in own:
+            w = w * self._own[name]
+        self._cache[key] = w
+        return w
+
+    @property
+    def variations(self):
+        '''List of available modifiers'''
+        keys = set(self._modifiers.keys()) | set(self._base._modifiers.keys())
+        for k in list(keys):
+            keys.add(k.replace('Up', 'Down'))
+        return keys
@@ -9,7 +9,6 @@ from coffea import hist
 from coffea.hist.export import export1d
 
 import ROOT as r
-from bucoffea.plot.util import merge_datasets, merge_extensions, scale_xs_lumi
 
 pjoin = os.path.join
 
@@ -208,8 +207,8 @@ def suppress_negative_bins(histogram):
 def legacy_limit_input_monojet(acc, args):
     """Writes ROOT TH1s to file as a limit input
 
-    :param acc: Accumulator (processor output)
-    :type acc: coffea.processor.accumulator
+    :param acc: Accumulator with normalized histograms, see load_and_merge
+    :type acc: bucoffea.plot.util.LazyAccumulator
     :param args.outdir: Output directory
     :type args.outdir: string
     """
@@ -233,9 +232,6 @@ def legacy_limit_input_monojet(acc, args):
     h = copy.deepcopy(acc[distribution])
     newax = hist.Bin('recoil','Recoil (GeV)', recoil_bins_2016())
     h = h.rebin(h.axis(newax.name), newax)
-    h = merge_extensions(h, acc)
-    scale_xs_lumi(h)
-    h = merge_datasets(h)
 
     for year in [2017,2018]:
         f = uproot.recreate(pjoin(args.outdir, f'legacy_limit_monojet_{year}.root'))
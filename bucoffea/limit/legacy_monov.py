@@ -9,7 +9,6 @@ from coffea import hist
 from coffea.hist.export import export1d
 
 import ROOT as r
-from bucoffea.plot.util import merge_datasets, merge_extensions, scale_xs_lumi
 from legacy_monojet import legacy_dataset_name, datasets, legacy_region_name, suppress_negative_bins
 
 pjoin = os.path.join
@@ -21,8 +20,8 @@ def recoil_bins_2016():
 def legacy_limit_input_monov(acc,  args):
     """Writes ROOT TH1s to file as a limit input
 
-    :param acc: Accumulator (processor output)
-    :type acc: coffea.processor.accumulator
+    :param acc: Accumulator with normalized histograms, see load_and_merge
+    :type acc: bucoffea.plot.util.LazyAccumulator
     :param args.outdir: Output directory
     :type args.outdir: string
     """
@@ -47,9 +46,6 @@ def legacy_limit_input_monov(acc,  args):
     # Histogram prep, rebin, etc
     h = copy.deepcopy(acc[distribution])
     h = h.rebin(h.axis(newax.name), newax)
-    h = merge_extensions(h, acc)
-    scale_xs_lumi(h)
-    h = merge_datasets(h)
 
     for wp in ['tau21','loose','tight']:
         for year in [2017,2018]:
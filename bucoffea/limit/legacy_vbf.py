@@ -9,7 +9,6 @@ from coffea import hist
 from coffea.hist.export import export1d
 
 import ROOT as r
-from bucoffea.plot.util import merge_datasets, merge_extensions, scale_xs_lumi
 from legacy_monojet import suppress_negative_bins
 pjoin = os.path.join
 
@@ -161,8 +160,8 @@ def mjj_bins_2016():
 def legacy_limit_input_vbf(acc, outdir='./output', unblind=False):
     """Writes ROOT TH1s to file as a limit input
 
-    :param acc: Accumulator (processor output)
-    :type acc: coffea.processor.accumulator
+    :param acc: Accumulator with normalized histograms, see load_and_merge
+    :type acc: bucoffea.plot.util.LazyAccumulator
     :param outdir: Output directory
     :type outdir: string
     """
@@ -186,9 +185,6 @@ def legacy_limit_input_vbf(acc, outdir='./output', unblind=False):
     h = copy.deepcopy(acc[distribution])
     newax = hist.Bin('mjj','$M_{jj}$ (GeV)', mjj_bins_2016())
     h = h.rebin(h.axis(newax.name), newax)
-    h = merge_extensions(h, acc)
-    scale_xs_lumi(h)
-    h = merge_datasets(h)
 
     for year in [2017,2018]:
         signal = re.compile(f'VBF_HToInvisible.*{year}')
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 import os
-from bucoffea.plot.util import acc_from_dir
-from klepto.archives import dir_archive
+from bucoffea.plot.cache import HistogramCache
+from bucoffea.plot.util import load_and_merge
 import argparse
 pjoin = os.path.join
 
@@ -22,16 +22,8 @@ def parse_commandline():
 def main():
     args = parse_commandline()
 
-    klepto = True
-    if klepto:
-        acc = dir_archive(args.inpath, serialized=True, compression=0, memsize=1e3)
-        acc.load('recoil')
-        acc.load('mjj')
-        acc.load('sumw')
-        acc.load('sumw_pileup')
-        acc.load('nevents')
-    else:
-        acc = acc_from_dir(args.inpath)
+    # Only the histograms used for the limit inputs are loaded and normalized
+    acc = load_and_merge(args.inpath, lazy=True, cache=HistogramCache())
 
     args.outdir = pjoin('./output/',list(filter(lambda x:x,args.inpath.split('/')))[-1])
     for channel in args.channel.split(','):
@@ -9,6 +9,7 @@ from coffea.analysis_objects import JaggedCandidateArray
 
 from bucoffea.helpers import object_overlap, sigmoid, exponential
 from bucoffea.helpers.dataset import extract_year
+from bucoffea.helpers.profiling import timed
 
 Hist = hist.Hist
 Bin = hist.Bin
@@ -302,6 +303,7 @@ def monojet_accumulator(cfg):
     items['tree_bool'] = processor.defaultdict_accumulator(defaultdict_accumulator_of_empty_column_accumulator_bool)
     items['tree_int64'] = processor.defaultdict_accumulator(defaultdict_accumulator_of_empty_column_accumulator_int64)
     items['tree_float16'] = processor.defaultdict_accumulator(defaultdict_accumulator_of_empty_column_accumulator_float16)
+    items['tree_files'] = processor.list_accumulator()
 
     items['weights'] = Hist("Weights", dataset_ax, region_ax, weight_type_ax, weight_ax)
     items['npv'] = Hist('Number of primary vertices', dataset_ax, region_ax, nvtx_ax)
@@ -328,6 +330,30 @@ def monojet_accumulator(cfg):
     return  processor.dict_accumulator(items)
 
 
+def clean_overlaps(candidates, overlap_cfg, **others):
+    """Removes candidates overlapping with other collections
+
+    All collections are handled by a single call of object_overlap.
+
+    :param candidates: Candidates to clean
+    :type candidates: JaggedCandidateArray
+    :param overlap_cfg: Overlap configuration of the candidates, e.g. cfg.OVERLAP.AK4
+    :param others: Collections to clean against, by name in the configuration,
+                   e.g. muon=muons. Only those with CLEAN set are used.
+    :return: Cleaned candidates
+    :rtype: JaggedCandidateArray
+    """
+    against, dr = [], []
+    for name, other in others.items():
+        settings = getattr(overlap_cfg, name.upper())
+        if settings.CLEAN:
+            against.append(other)
+            dr.append(settings.DR)
+    if not against:
+        return candidates
+    return candidates[object_overlap(candidates, against, dr=dr)]
+
+@timed('candidates')
 def setup_candidates(df, cfg):
     if df['is_data'] and extract_year(df['dataset']) != 2018:
         # 2016, 2017 data
@@ -422,10 +448,7 @@ def setup_candidates(df, cfg):
                 & (taus.abseta < cfg.TAU.CUTS.ETA) \
                 & ((taus.iso&2)==2)]
 
-    if cfg.OVERLAP.TAU.MUON.CLEAN:
-        taus = taus[object_overlap(taus, muons, dr=cfg.OVERLAP.TAU.MUON.DR)]
-    if cfg.OVERLAP.TAU.ELECTRON.CLEAN:
-        taus = taus[object_overlap(taus, electrons, dr=cfg.OVERLAP.TAU.ELECTRON.DR)]
+    taus = clean_overlaps(taus, cfg.OVERLAP.TAU, muon=muons, electron=electrons)
 
     # choose the right branch name for photon ID bitmap depending on the actual name in the file (different between nano v5 and v7)
     if cfg.PHOTON.BRANCH.ID in df.keys():
@@ -449,10 +472,7 @@ def setup_candidates(df, cfg):
               & (photons.abseta < cfg.PHOTON.CUTS.LOOSE.eta)
               ]
 
-    if cfg.OVERLAP.PHOTON.MUON.CLEAN:
-        photons = photons[object_overlap(photons, muons, dr=cfg.OVERLAP.PHOTON.MUON.DR)]
-    if cfg.OVERLAP.PHOTON.ELECTRON.CLEAN:
-        photons = photons[object_overlap(photons, electrons, dr=cfg.OVERLAP.PHOTON.ELECTRON.DR)]
+    photons = clean_overlaps(photons, cfg.OVERLAP.PHOTON, muon=muons, electron=electrons)
 
     ak4 = JaggedCandidateArray.candidatesfromcounts(
         df['nJet'],
@@ -495,21 +515,11 @@ def setup_candidates(df, cfg):
         & (btag_discriminator > btag_cut)
     ]
 
-    if cfg.OVERLAP.BTAG.MUON.CLEAN:
-        bjets = bjets[object_overlap(bjets, muons, dr=cfg.OVERLAP.BTAG.MUON.DR)]
-    if cfg.OVERLAP.BTAG.ELECTRON.CLEAN:
-        bjets = bjets[object_overlap(bjets, electrons, dr=cfg.OVERLAP.BTAG.ELECTRON.DR)]
-    if cfg.OVERLAP.BTAG.PHOTON.CLEAN:
-        bjets = bjets[object_overlap(bjets, photons, dr=cfg.OVERLAP.BTAG.PHOTON.DR)]
+    bjets = clean_overlaps(bjets, cfg.OVERLAP.BTAG, muon=muons, electron=electrons, photon=photons)
 
     ak4 = ak4[ak4.looseId]
 
-    if cfg.OVERLAP.AK4.MUON.CLEAN:
-        ak4 = ak4[object_overlap(ak4, muons, dr=cfg.OVERLAP.AK4.MUON.DR)]
-    if cfg.OVERLAP.AK4.ELECTRON.CLEAN:
-        ak4 = ak4[object_overlap(ak4, electrons, dr=cfg.OVERLAP.AK4.ELECTRON.DR)]
-    if cfg.OVERLAP.AK4.PHOTON.CLEAN:
-        ak4 = ak4[object_overlap(ak4, photons, dr=cfg.OVERLAP.AK4.PHOTON.DR)]
+    ak4 = clean_overlaps(ak4, cfg.OVERLAP.AK4, muon=muons, electron=electrons, photon=photons)
 
 
     if df['is_data']:
@@ -541,7 +551,7 @@ def setup_candidates(df, cfg):
         wvstqcd=df['FatJet_deepTag_WvsQCD']*(1-df['FatJet_deepTag_TvsQCD'])/(1-df['FatJet_deepTag_WvsQCD']*df['FatJet_deepTag_TvsQCD']),
         wvstqcdmd=df['FatJet_deepTagMD_WvsQCD']*(1-df['FatJet_deepTagMD_TvsQCD'])/(1-df['FatJet_deepTagMD_WvsQCD']*df['FatJet_deepTagMD_TvsQCD']),
     )
-    ak8 = ak8[ak8.tightId & object_overlap(ak8, muons) & object_overlap(ak8, electrons) & object_overlap(ak8, photons)]
+    ak8 = ak8[ak8.tightId & object_overlap(ak8, [muons, electrons, photons])]
 
     if extract_year(df['dataset']) == 2017:
         met_branch = 'METFixEE2017'
@@ -829,6 +839,7 @@ def monojet_regions(cfg):
 def fitfun(x, a, b, c):
     return a * np.exp(-b * x) + c
 
+@timed('weights')
 def theory_weights_monojet(weights, df, evaluator, gen_v_pt, gen_ak8_mass):
     weights = processor.Weights(size=df.size, storeIndividual=True)
 
@@ -900,6 +911,7 @@ def theory_weights_monojet(weights, df, evaluator, gen_v_pt, gen_ak8_mass):
     weights.add('sf_nlo_ewk',           ewk_nlo)
     return weights
 
+@timed('weights')
 def theory_weights_vbf(weights, df, evaluator, gen_v_pt, mjj):
     if df['is_lo_w']:
         theory_weights = evaluator["qcd_nlo_w_2017_2d"](mjj, gen_v_pt) * evaluator["ewk_nlo_w"](gen_v_pt)
@@ -931,6 +943,7 @@ def theory_weights_vbf(weights, df, evaluator, gen_v_pt, mjj):
 
     return weights
 
+@timed('weights')
 def pileup_weights(weights, df, evaluator, cfg):
 
     if cfg.SF.PILEUP.MODE == 'nano':
@@ -945,6 +958,7 @@ def pileup_weights(weights, df, evaluator, cfg):
     weights.add("pileup", pu_weight)
     return weights
 
+@timed('weights')
 def photon_trigger_sf(weights, photons, df):
     """MC-to-data photon trigger scale factor.
 
@@ -973,6 +987,7 @@ def photon_trigger_sf(weights, photons, df):
 
     weights.add("trigger_photon", sf)
 
+@timed('weights')
 def candidate_weights(weights, df, evaluator, muons, electrons, photons, cfg):
     year = extract_year(df['dataset'])
     # Muon ID and Isolation for tight and loose WP
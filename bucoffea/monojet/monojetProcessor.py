@@ -1,11 +1,9 @@
-import copy
 import re
 
 import numpy as np
 
 import coffea.processor as processor
 
-from dynaconf import settings as cfg
 from bucoffea.monojet.definitions import (
                                           monojet_accumulator,
                                           setup_candidates,
@@ -22,7 +20,6 @@ from bucoffea.helpers import (
                               recoil,
                               mt,
                               weight_shape,
-                              bucoffea_path,
                               dphi,
                               mask_and,
                               mask_or,
@@ -30,10 +27,16 @@ from bucoffea.helpers import (
                               calculate_vecB,
                               calculate_vecDPhi
                              )
+from bucoffea.helpers.config import ConfigCache
+from bucoffea.helpers.cutflow import SelectionPlanner
+from bucoffea.helpers.histogram import FillPlan
+from bucoffea.helpers.profiling import timed
+from bucoffea.helpers.trees import write_chunk_trees
 from bucoffea.helpers.weights import (
                               get_veto_weights,
                               diboson_nlo_weights,
-                              btag_weights
+                              btag_weights,
+                              LayeredWeights
                              )
 
 from bucoffea.helpers.dataset import (
@@ -56,6 +59,7 @@ from bucoffea.helpers.gen import (
                                   get_gen_photon_pt, setup_gen_jets_ak8
                                  )
 
+@timed('selection')
 def trigger_selection(selection, df, cfg):
     pass_all = np.zeros(df.size) == 0
     pass_none = ~pass_all
@@ -142,32 +146,26 @@ class monojetProcessor(processor.ProcessorABC):
     def __init__(self, blind=True):
         self._year=None
         self._blind=False
-        self._configure()
-        self._accumulator = monojet_accumulator(cfg)
+        self._configs = ConfigCache("config/monojet.yaml")
+        self._accumulator = monojet_accumulator(self._configure())
 
     @property
     def accumulator(self):
         return self._accumulator
 
     def _configure(self, df=None):
-        cfg.DYNACONF_WORKS="merge_configs"
-        cfg.MERGE_ENABLED_FOR_DYNACONF=True
-        cfg.SETTINGS_FILE_FOR_DYNACONF = bucoffea_path("config/monojet.yaml")
-
-        # Reload config based on year
+        # Pick the pre-resolved config based on year
         if df:
             dataset = df['dataset']
             self._year = extract_year(dataset)
             df["year"] = self._year
-            cfg.ENV_FOR_DYNACONF = f"era{self._year}"
-        else:
-            cfg.ENV_FOR_DYNACONF = f"default"
-        cfg.reload()
+            return self._configs.get(f"era{self._year}")
+        return self._configs.get("default")
 
     def process(self, df):
         if not df.size:
             return self.accumulator.identity()
-        self._configure(df)
+        cfg = self._configure(df)
         dataset = df['dataset']
         df['is_lo_w'] = is_lo_w(dataset)
         df['is_lo_z'] = is_lo_z(dataset)
@@ -220,6 +218,7 @@ class monojetProcessor(processor.ProcessorABC):
 
         # ak4
         leadak4_index=ak4.pt.argmax()
+        leadak4 = ak4[leadak4_index]
 
         elejet_pairs = ak4[:,:1].cross(electrons)
         df['dREleJet'] = np.hypot(elejet_pairs.i0.eta-elejet_pairs.i1.eta , dphi(elejet_pairs.i0.phi,elejet_pairs.i1.phi)).min()
@@ -463,10 +462,19 @@ class monojetProcessor(processor.ProcessorABC):
 
         regions = monojet_regions(cfg)
 
+        # Masks and cutflows for all regions,
+        # cuts shared between regions are only evaluated once
+        region_selections = SelectionPlanner(regions).evaluate(selection)
+
         # Get veto weights (only for MC)
         if not df['is_data']:
             veto_weights = get_veto_weights(df, cfg, evaluator, electrons, muons, taus, do_variations=True)
 
+        # Products of the common weights, shared between regions
+        base_weight_cache = {}
+
+        # Histogram fills are collected and executed in batches
+        fills = FillPlan(output, dataset=dataset)
         for region, cuts in regions.items():
 
             if re.match('sr_.*', region):
@@ -477,7 +485,7 @@ class monojetProcessor(processor.ProcessorABC):
                 recoil_phi = df['recoil_phi']
 
             exclude = [None]
-            region_weights = copy.deepcopy(weights)
+            region_weights = LayeredWeights(weights, base_weight_cache)
 
             if not df['is_data']:
                 ### Trigger weights
@@ -555,12 +563,11 @@ class monojetProcessor(processor.ProcessorABC):
                 continue
 
             # Cutflow plot for signal and control regions
+            mask, cutflow_counts = region_selections[region]
             if any(x in region for x in ["sr", "cr", "tr"]):
                 output['cutflow_' + region][dataset]['all']+=df.size
-                for icut, cutname in enumerate(cuts):
-                    output['cutflow_' + region][dataset][cutname] += selection.all(*cuts[:icut+1]).sum()
-
-            mask = selection.all(*cuts)
+                for cutname, count in zip(cuts, cutflow_counts):
+                    output['cutflow_' + region][dataset][cutname] += count
 
 
             if cfg.RUN.SAVE.TREE:
@@ -660,8 +667,8 @@ class monojetProcessor(processor.ProcessorABC):
 
             # Multiplicities
             def fill_mult(name, candidates):
-                output[name].fill(
-                                  dataset=dataset,
+                fills.add(
+                                  name,
                                   region=region,
                                   multiplicity=candidates[mask].counts,
                                   weight=region_weights.partial_weight(exclude=exclude)[mask]
@@ -683,30 +690,33 @@ class monojetProcessor(processor.ProcessorABC):
                 if not cfg.RUN.HISTOGRAM.get(name, True):
                     return
 
-                if not ('dataset' in kwargs):
-                    kwargs['dataset'] = dataset
-                output[name].fill(
-                                  region=region,
-                                  **kwargs
-                                  )
+                fills.add(name, region=region, **kwargs)
+
+            # Columns used by several histograms are only
+            # masked and binned once
+            ak4_masked = ak4[mask]
+            ak4_eta = ak4_masked.eta.flatten()
+            ak4_phi = ak4_masked.phi.flatten()
+            recoil_masked = recoil_pt[mask]
+
             # Monitor weights
             for wname, wvalue in region_weights._weights.items():
                 ezfill("weights", weight_type=wname, weight_value=wvalue[mask])
 
             # All ak4
             # This is a workaround to create a weight array of the right dimension
-            w_alljets = weight_shape(ak4[mask].eta, region_weights.partial_weight(exclude=exclude)[mask])
-
-            ezfill('ak4_eta',    jeteta=ak4[mask].eta.flatten(), weight=w_alljets)
-            ezfill('ak4_phi',    jetphi=ak4[mask].phi.flatten(), weight=w_alljets)
-            ezfill('ak4_eta_phi', phi=ak4[mask].phi.flatten(),eta=ak4[mask].eta.flatten(), weight=w_alljets)
-            ezfill('ak4_pt',     jetpt=ak4[mask].pt.flatten(),   weight=w_alljets)
-            ezfill('ak4_deepcsv', deepcsv=ak4[mask].deepcsv.flatten(),   weight=w_alljets)
-            ezfill('ak4_chf',    frac=ak4[mask].chf.flatten(),      weight=w_alljets)
-            ezfill('ak4_nhf',    frac=ak4[mask].nhf.flatten(),      weight=w_alljets)
-            ezfill('ak4_nef',    frac=ak4[mask].nef.flatten(),      weight=w_alljets)
-            ezfill('ak4_muf',    frac=ak4[mask].muf.flatten(),      weight=w_alljets)
-            ezfill('ak4_cef',    frac=ak4[mask].cef.flatten(),      weight=w_alljets)
+            w_alljets = weight_shape(ak4_masked.eta, region_weights.partial_weight(exclude=exclude)[mask])
+
+            ezfill('ak4_eta',    jeteta=ak4_eta, weight=w_alljets)
+            ezfill('ak4_phi',    jetphi=ak4_phi, weight=w_alljets)
+            ezfill('ak4_eta_phi', phi=ak4_phi,eta=ak4_eta, weight=w_alljets)
+            ezfill('ak4_pt',     jetpt=ak4_masked.pt.flatten(),   weight=w_alljets)
+            ezfill('ak4_deepcsv', deepcsv=ak4_masked.deepcsv.flatten(),   weight=w_alljets)
+            ezfill('ak4_chf',    frac=ak4_masked.chf.flatten(),      weight=w_alljets)
+            ezfill('ak4_nhf',    frac=ak4_masked.nhf.flatten(),      weight=w_alljets)
+            ezfill('ak4_nef',    frac=ak4_masked.nef.flatten(),      weight=w_alljets)
+            ezfill('ak4_muf',    frac=ak4_masked.muf.flatten(),      weight=w_alljets)
+            ezfill('ak4_cef',    frac=ak4_masked.cef.flatten(),      weight=w_alljets)
 
             w_bjets = weight_shape(bjets[mask].eta, region_weights.partial_weight(exclude=["bveto"])[mask])
             ezfill('bjet_eta',    jeteta=bjets[mask].eta.flatten(), weight=w_bjets)
@@ -714,20 +724,20 @@ class monojetProcessor(processor.ProcessorABC):
             ezfill('bjet_pt',     jetpt=bjets[mask].pt.flatten(),   weight=w_bjets)
 
             # Leading ak4
-            w_leadak4 = weight_shape(ak4[leadak4_index].eta[mask], region_weights.partial_weight(exclude=exclude)[mask])
-            ezfill('ak4_eta0',       jeteta=ak4[leadak4_index].eta[mask].flatten(),    weight=w_leadak4)
-            ezfill('ak4_eta0_phi0',  phi=ak4[leadak4_index].phi[mask].flatten(), eta=ak4[leadak4_index].eta[mask].flatten(),    weight=w_leadak4)
-            ezfill('ak4_phi0',   jetphi=ak4[leadak4_index].phi[mask].flatten(),    weight=w_leadak4)
-            ezfill('ak4_pt0',    jetpt=ak4[leadak4_index].pt[mask].flatten(),      weight=w_leadak4)
+            w_leadak4 = weight_shape(leadak4.eta[mask], region_weights.partial_weight(exclude=exclude)[mask])
+            ezfill('ak4_eta0',       jeteta=leadak4.eta[mask].flatten(),    weight=w_leadak4)
+            ezfill('ak4_eta0_phi0',  phi=leadak4.phi[mask].flatten(), eta=leadak4.eta[mask].flatten(),    weight=w_leadak4)
+            ezfill('ak4_phi0',   jetphi=leadak4.phi[mask].flatten(),    weight=w_leadak4)
+            ezfill('ak4_pt0',    jetpt=leadak4.pt[mask].flatten(),      weight=w_leadak4)
 
             if '_j_' in region:
-                ezfill('ak4_pt0_recoil',    jetpt=ak4[leadak4_index].pt[mask].flatten(), recoil=recoil_pt[mask],      weight=w_leadak4)
-            ezfill('ak4_ptraw0',    jetpt=ak4[leadak4_index].ptraw[mask].flatten(),      weight=w_leadak4)
-            ezfill('ak4_chf0',    frac=ak4[leadak4_index].chf[mask].flatten(),      weight=w_leadak4)
-            ezfill('ak4_nhf0',    frac=ak4[leadak4_index].nhf[mask].flatten(),      weight=w_leadak4)
-            ezfill('ak4_nef0',    frac=ak4[leadak4_index].nef[mask].flatten(),      weight=w_leadak4)
-            ezfill('ak4_muf0',    frac=ak4[leadak4_index].muf[mask].flatten(),      weight=w_leadak4)
-            ezfill('ak4_cef0',    frac=ak4[leadak4_index].cef[mask].flatten(),      weight=w_leadak4)
+                ezfill('ak4_pt0_recoil',    jetpt=leadak4.pt[mask].flatten(), recoil=recoil_masked,      weight=w_leadak4)
+            ezfill('ak4_ptraw0',    jetpt=leadak4.ptraw[mask].flatten(),      weight=w_leadak4)
+            ezfill('ak4_chf0',    frac=leadak4.chf[mask].flatten(),      weight=w_leadak4)
+            ezfill('ak4_nhf0',    frac=leadak4.nhf[mask].flatten(),      weight=w_leadak4)
+            ezfill('ak4_nef0',    frac=leadak4.nef[mask].flatten(),      weight=w_leadak4)
+            ezfill('ak4_muf0',    frac=leadak4.muf[mask].flatten(),      weight=w_leadak4)
+            ezfill('ak4_cef0',    frac=leadak4.cef[mask].flatten(),      weight=w_leadak4)
 
             rw=region_weights.partial_weight(exclude=exclude)
             ezfill('drelejet',    dr=df['dREleJet'][mask],      weight=rw[mask])
@@ -767,27 +777,27 @@ class monojetProcessor(processor.ProcessorABC):
                 # print(trailak8_ak4_dr_min[mask&(trailak8.counts>0)].flatten())
                 # ezfill("trailak8_ak4_dr_min", dr=trailak8_ak4_dr_min[mask&(trailak8.counts>0)].flatten(), weight=w_trailak8)
                 # Leading
-                w_leadak8 = weight_shape(ak8[leadak8_index].eta[mask], region_weights.partial_weight(exclude=exclude)[mask])
-
-                ezfill('ak8_eta0',       jeteta=ak8[leadak8_index].eta[mask].flatten(),    weight=w_leadak8)
-                ezfill('ak8_phi0',       jetphi=ak8[leadak8_index].phi[mask].flatten(),    weight=w_leadak8)
-                ezfill('ak8_pt0',        jetpt=ak8[leadak8_index].pt[mask].flatten(),      weight=w_leadak8 )
-                ezfill('ak8_pt0_recoil', jetpt=ak8[leadak8_index].pt[mask].flatten(), recoil=recoil_pt[mask],     weight=w_leadak8 )
-                ezfill('ak8_mass0',      mass=ak8[leadak8_index].mass[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_tau210',     tau21=ak8[leadak8_index].tau21[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_wvsqcd0',    tagger=ak8[leadak8_index].wvsqcd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_wvsqcdmd0',  tagger=ak8[leadak8_index].wvsqcdmd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_zvsqcd0',    tagger=ak8[leadak8_index].zvsqcd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_zvsqcdmd0',  tagger=ak8[leadak8_index].zvsqcdmd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_tvsqcd0',    tagger=ak8[leadak8_index].tvsqcd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_tvsqcdmd0',    tagger=ak8[leadak8_index].tvsqcdmd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_wvstqcd0',    tagger=ak8[leadak8_index].wvstqcd[mask].flatten(),     weight=w_leadak8)
-                ezfill('ak8_wvstqcdmd0',    tagger=ak8[leadak8_index].wvstqcdmd[mask].flatten(),     weight=w_leadak8)
-
-                ezfill('ak8_eta0_phi0', phi=ak8[leadak8_index].phi[mask].flatten(),eta=ak8[leadak8_index].eta[mask].flatten(), weight=w_leadak8)
+                w_leadak8 = weight_shape(leadak8.eta[mask], region_weights.partial_weight(exclude=exclude)[mask])
+
+                ezfill('ak8_eta0',       jeteta=leadak8.eta[mask].flatten(),    weight=w_leadak8)
+                ezfill('ak8_phi0',       jetphi=leadak8.phi[mask].flatten(),    weight=w_leadak8)
+                ezfill('ak8_pt0',        jetpt=leadak8.pt[mask].flatten(),      weight=w_leadak8 )
+                ezfill('ak8_pt0_recoil', jetpt=leadak8.pt[mask].flatten(), recoil=recoil_masked,     weight=w_leadak8 )
+                ezfill('ak8_mass0',      mass=leadak8.mass[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_tau210',     tau21=leadak8.tau21[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_wvsqcd0',    tagger=leadak8.wvsqcd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_wvsqcdmd0',  tagger=leadak8.wvsqcdmd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_zvsqcd0',    tagger=leadak8.zvsqcd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_zvsqcdmd0',  tagger=leadak8.zvsqcdmd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_tvsqcd0',    tagger=leadak8.tvsqcd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_tvsqcdmd0',    tagger=leadak8.tvsqcdmd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_wvstqcd0',    tagger=leadak8.wvstqcd[mask].flatten(),     weight=w_leadak8)
+                ezfill('ak8_wvstqcdmd0',    tagger=leadak8.wvstqcdmd[mask].flatten(),     weight=w_leadak8)
+
+                ezfill('ak8_eta0_phi0', phi=leadak8.phi[mask].flatten(),eta=leadak8.eta[mask].flatten(), weight=w_leadak8)
 
                 if not df['is_data']:
-                    ezfill('ak8_mass_response',   response=ak8[leadak8_index].mass[mask].max() / df['leadak8_gen_match_ak8_mass'][mask].max(),  weight=w_leadak8)
+                    ezfill('ak8_mass_response',   response=leadak8.mass[mask].max() / df['leadak8_gen_match_ak8_mass'][mask].max(),  weight=w_leadak8)
 
                 # histogram with only gen-matched lead ak8 pt
                 if not df['is_data']:
@@ -797,16 +807,16 @@ class monojetProcessor(processor.ProcessorABC):
 
                 # specifically for deepak8 mistag rate measurement
                 if cfg.RUN.MONOVMISTAG_STUDY and 'inclusive_v' in region:
-                    ezfill('ak8_passloose_pt0', wppass=ak8[leadak8_index].wvsqcd[mask].max()>cfg.WTAG.LOOSE, jetpt=ak8[leadak8_index].pt[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passmedium_pt0', wppass=ak8[leadak8_index].wvsqcd[mask].max()>cfg.WTAG.LOOSE, jetpt=ak8[leadak8_index].pt[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passtight_pt0', wppass=ak8[leadak8_index].wvsqcd[mask].max()>cfg.WTAG.TIGHT, jetpt=ak8[leadak8_index].pt[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passloosemd_pt0', wppass=ak8[leadak8_index].wvsqcdmd[mask].max()>cfg.WTAG.LOOSEMD, jetpt=ak8[leadak8_index].pt[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passtightmd_pt0', wppass=ak8[leadak8_index].wvsqcdmd[mask].max()>cfg.WTAG.TIGHTMD, jetpt=ak8[leadak8_index].pt[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passloose_mass0', wppass=ak8[leadak8_index].wvsqcd[mask].max()>cfg.WTAG.LOOSE, mass=ak8[leadak8_index].mass[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passmedium_mass0', wppass=ak8[leadak8_index].wvsqcd[mask].max()>cfg.WTAG.LOOSE, mass=ak8[leadak8_index].mass[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passtight_mass0', wppass=ak8[leadak8_index].wvsqcd[mask].max()>cfg.WTAG.TIGHT, mass=ak8[leadak8_index].mass[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passloosemd_mass0', wppass=ak8[leadak8_index].wvsqcdmd[mask].max()>cfg.WTAG.LOOSEMD, mass=ak8[leadak8_index].mass[mask].max(),      weight=w_leadak8 )
-                    ezfill('ak8_passtightmd_mass0', wppass=ak8[leadak8_index].wvsqcdmd[mask].max()>cfg.WTAG.TIGHTMD, mass=ak8[leadak8_index].mass[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passloose_pt0', wppass=leadak8.wvsqcd[mask].max()>cfg.WTAG.LOOSE, jetpt=leadak8.pt[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passmedium_pt0', wppass=leadak8.wvsqcd[mask].max()>cfg.WTAG.LOOSE, jetpt=leadak8.pt[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passtight_pt0', wppass=leadak8.wvsqcd[mask].max()>cfg.WTAG.TIGHT, jetpt=leadak8.pt[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passloosemd_pt0', wppass=leadak8.wvsqcdmd[mask].max()>cfg.WTAG.LOOSEMD, jetpt=leadak8.pt[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passtightmd_pt0', wppass=leadak8.wvsqcdmd[mask].max()>cfg.WTAG.TIGHTMD, jetpt=leadak8.pt[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passloose_mass0', wppass=leadak8.wvsqcd[mask].max()>cfg.WTAG.LOOSE, mass=leadak8.mass[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passmedium_mass0', wppass=leadak8.wvsqcd[mask].max()>cfg.WTAG.LOOSE, mass=leadak8.mass[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passtight_mass0', wppass=leadak8.wvsqcd[mask].max()>cfg.WTAG.TIGHT, mass=leadak8.mass[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passloosemd_mass0', wppass=leadak8.wvsqcdmd[mask].max()>cfg.WTAG.LOOSEMD, mass=leadak8.mass[mask].max(),      weight=w_leadak8 )
+                    ezfill('ak8_passtightmd_mass0', wppass=leadak8.wvsqcdmd[mask].max()>cfg.WTAG.TIGHTMD, mass=leadak8.mass[mask].max(),      weight=w_leadak8 )
 
             # MET
             rw = region_weights.partial_weight(exclude=exclude)
@@ -820,15 +830,15 @@ class monojetProcessor(processor.ProcessorABC):
 
             ezfill('met',                met=met_pt[mask],            weight=rw[mask] )
             ezfill('met_phi',            phi=met_phi[mask],           weight=rw[mask] )
-            ezfill('recoil',             recoil=recoil_pt[mask],      weight=rw[mask] )
+            ezfill('recoil',             recoil=recoil_masked,      weight=rw[mask] )
             ezfill('recoil_phi',         phi=recoil_phi[mask],        weight=rw[mask] )
-            ezfill('recoil_nopog',       recoil=recoil_pt[mask],      weight=region_weights.partial_weight(include=['pileup','theory','gen','prefire'])[mask])
-            ezfill('recoil_nopref',      recoil=recoil_pt[mask],      weight=region_weights.partial_weight(exclude=['prefire']+exclude)[mask])
-            ezfill('recoil_nopu',        recoil=recoil_pt[mask],      weight=region_weights.partial_weight(exclude=['pileup']+exclude)[mask])
-            ezfill('recoil_notrg',       recoil=recoil_pt[mask],      weight=region_weights.partial_weight(exclude=['trigger']+exclude)[mask])
+            ezfill('recoil_nopog',       recoil=recoil_masked,      weight=region_weights.partial_weight(include=['pileup','theory','gen','prefire'])[mask])
+            ezfill('recoil_nopref',      recoil=recoil_masked,      weight=region_weights.partial_weight(exclude=['prefire']+exclude)[mask])
+            ezfill('recoil_nopu',        recoil=recoil_masked,      weight=region_weights.partial_weight(exclude=['pileup']+exclude)[mask])
+            ezfill('recoil_notrg',       recoil=recoil_masked,      weight=region_weights.partial_weight(exclude=['trigger']+exclude)[mask])
 
             if '_j_' in region:
-                ezfill('ak4_pt0_over_recoil',    ratio=ak4.pt.max()[mask]/recoil_pt[mask],      weight=region_weights.partial_weight(exclude=exclude)[mask])
+                ezfill('ak4_pt0_over_recoil',    ratio=ak4.pt.max()[mask]/recoil_masked,      weight=region_weights.partial_weight(exclude=exclude)[mask])
             ezfill('dphijm',             dphi=df["minDPhiJetMet"][mask],    weight=region_weights.partial_weight(exclude=exclude)[mask] )
             ezfill('dphijr',             dphi=df["minDPhiJetRecoil"][mask],    weight=region_weights.partial_weight(exclude=exclude)[mask] )
 
@@ -839,19 +849,19 @@ class monojetProcessor(processor.ProcessorABC):
             # Diboson NLO
             ezfill(
                     'recoil_nodibosonnlo',
-                    recoil=recoil_pt[mask],
+                    recoil=recoil_masked,
                     weight=region_weights.partial_weight(exclude=['weight_diboson_nlo']+exclude)[mask]
                     )
 
             if not df['is_data']:
                 ezfill(
                         'recoil_dibosonnlo_up',
-                        recoil=recoil_pt[mask],
+                        recoil=recoil_masked,
                         weight=(region_weights.partial_weight(exclude=exclude)*(1+df['weight_diboson_nlo_rel_unc']))[mask]
                         )
                 ezfill(
                         'recoil_dibosonnlo_dn',
-                        recoil=recoil_pt[mask],
+                        recoil=recoil_masked,
                         weight=(region_weights.partial_weight(exclude=exclude)*(1-df['weight_diboson_nlo_rel_unc']))[mask]
                         )
 
@@ -864,21 +874,21 @@ class monojetProcessor(processor.ProcessorABC):
                 ezfill('recoil_hardbveto',   recoil=recoil_pt[mask&(bjets.counts==0)],      weight=region_weights.partial_weight(exclude=exclude+['bveto'])[mask&(bjets.counts==0)])
                 if not df['is_data']:
                     rw = region_weights.partial_weight(exclude=exclude+['bveto'])
-                    ezfill('recoil_bveto_up',    recoil=recoil_pt[mask],  weight=(rw*(1-bsf_variations['up']).prod())[mask])
-                    ezfill('recoil_bveto_down',  recoil=recoil_pt[mask],  weight=(rw*(1-bsf_variations['down']).prod())[mask])
+                    ezfill('recoil_bveto_up',    recoil=recoil_masked,  weight=(rw*(1-bsf_variations['up']).prod())[mask])
+                    ezfill('recoil_bveto_down',  recoil=recoil_masked,  weight=(rw*(1-bsf_variations['down']).prod())[mask])
 
             if cfg.RUN.PHOTON_ID_STUDY and (not df['is_data']) and ('cr_g' in region) and (df['year']!=2016):
                 photon_id_sf_nom = evaluator['photon_id_tight_tnp'](np.abs(photons[df['is_tight_photon']].eta))
                 photon_id_sf_err = evaluator['photon_id_tight_tnp_error'](np.abs(photons[df['is_tight_photon']].eta))
 
                 rw = region_weights.partial_weight(exclude=exclude+['photon_id_tight'])
-                ezfill('recoil_photon_id_up', recoil=recoil_pt[mask], weight=(rw * (photon_id_sf_nom+photon_id_sf_err).prod())[mask])
-                ezfill('recoil_photon_id_dn', recoil=recoil_pt[mask], weight=(rw * (photon_id_sf_nom-photon_id_sf_err).prod())[mask])
+                ezfill('recoil_photon_id_up', recoil=recoil_masked, weight=(rw * (photon_id_sf_nom+photon_id_sf_err).prod())[mask])
+                ezfill('recoil_photon_id_dn', recoil=recoil_masked, weight=(rw * (photon_id_sf_nom-photon_id_sf_err).prod())[mask])
 
                 photon_id_sf_err_extrap_err = evaluator['photon_id_tight_tnp_extrap_unc_slope'](np.abs(photons[df['is_tight_photon']].eta)) * (photons[df['is_tight_photon']].pt - 150)
 
-                ezfill('recoil_photon_id_extrap_up', recoil=recoil_pt[mask], weight=(rw * (photon_id_sf_nom+photon_id_sf_err_extrap_err)).prod()[mask])
-                ezfill('recoil_photon_id_extrap_dn', recoil=recoil_pt[mask], weight=(rw * (photon_id_sf_nom-photon_id_sf_err_extrap_err)).prod()[mask])
+                ezfill('recoil_photon_id_extrap_up', recoil=recoil_masked, weight=(rw * (photon_id_sf_nom+photon_id_sf_err_extrap_err)).prod()[mask])
+                ezfill('recoil_photon_id_extrap_dn', recoil=recoil_masked, weight=(rw * (photon_id_sf_nom-photon_id_sf_err_extrap_err)).prod()[mask])
 
             if cfg.RUN.ELE_ID_STUDY and (not df['is_data']) and ('cr_1e' in region or 'cr_2e' in region) and (df['year']!=2016):
                 # note that electrons in the gap do not count in this study, the "nominal recoil" distribution is different from the default "recoil" distribution
@@ -914,9 +924,9 @@ class monojetProcessor(processor.ProcessorABC):
                     eletight_id_sf["nm"] = eletight_id_sf["nm"]*(tight_dielectrons.counts != 1) + weights_2e_tight_nm*(tight_dielectrons.counts == 1)
 
                 rw = region_weights.partial_weight(exclude=exclude+['ele_id_tight','ele_id_loose'])
-                ezfill('recoil_ele_id_up', recoil=recoil_pt[mask], weight=(rw * eletight_id_sf["up"].prod() * eleloose_id_sf["up"].prod())[mask])
-                ezfill('recoil_ele_id_dn', recoil=recoil_pt[mask], weight=(rw * eletight_id_sf["dn"].prod() * eleloose_id_sf["dn"].prod())[mask])
-                ezfill('recoil_ele_id_nm', recoil=recoil_pt[mask], weight=(rw * eletight_id_sf["nm"].prod() * eleloose_id_sf["nm"].prod())[mask])
+                ezfill('recoil_ele_id_up', recoil=recoil_masked, weight=(rw * eletight_id_sf["up"].prod() * eleloose_id_sf["up"].prod())[mask])
+                ezfill('recoil_ele_id_dn', recoil=recoil_masked, weight=(rw * eletight_id_sf["dn"].prod() * eleloose_id_sf["dn"].prod())[mask])
+                ezfill('recoil_ele_id_nm', recoil=recoil_masked, weight=(rw * eletight_id_sf["nm"].prod() * eleloose_id_sf["nm"].prod())[mask])
 
                 ### Electron Reco efficiency up&down variations
                 ele_reco_sf = {}
@@ -930,14 +940,14 @@ class monojetProcessor(processor.ProcessorABC):
                     ele_reco_sf["up"] = (evaluator['ele_reco'](electrons.etasc, electrons.pt) + evaluator['ele_reco_error'](electrons.etasc, electrons.pt)).prod()
                     ele_reco_sf["dn"] = (evaluator['ele_reco'](electrons.etasc, electrons.pt) - evaluator['ele_reco_error'](electrons.etasc, electrons.pt)).prod()
                 rw = region_weights.partial_weight(exclude=exclude+['ele_reco'])
-                ezfill('recoil_ele_reco_up', recoil=recoil_pt[mask], weight=(rw * ele_reco_sf["up"])[mask])
-                ezfill('recoil_ele_reco_dn', recoil=recoil_pt[mask], weight=(rw * ele_reco_sf["dn"])[mask])
+                ezfill('recoil_ele_reco_up', recoil=recoil_masked, weight=(rw * ele_reco_sf["up"])[mask])
+                ezfill('recoil_ele_reco_dn', recoil=recoil_masked, weight=(rw * ele_reco_sf["dn"])[mask])
 
             if re.match('.*no_veto.*', region) and not df['is_data']:
                 for variation in veto_weights._weights.keys():
                     ezfill(
                             "recoil_veto_weight",
-                            recoil=recoil_pt[mask],
+                            recoil=recoil_masked,
                             weight=region_weights.partial_weight(exclude=exclude+["vetoweight"])[mask]*veto_weights.partial_weight(include=[variation])[mask],
                             variation=variation
                             )
@@ -948,7 +958,7 @@ class monojetProcessor(processor.ProcessorABC):
                 output['recoil'].fill(
                                     dataset=data_driven_qcd_dataset(dataset),
                                     region=region,
-                                    recoil=recoil_pt[mask],
+                                    recoil=recoil_masked,
                                     weight=region_weights.partial_weight(exclude=exclude)[mask] * w_imp
                                 )
 
@@ -1030,29 +1040,38 @@ class monojetProcessor(processor.ProcessorABC):
                 # w_drphoton_jet = weight_shape(df['dRPhotonJet'][mask], region_weights.partial_weight(exclude=exclude)[mask])
 
             # PV
+            npv = df['PV_npvs'][mask]
+            npvgood = df['PV_npvsGood'][mask]
+            rho_all = df['fixedGridRhoFastjetAll'][mask]
+            rho_central = df['fixedGridRhoFastjetCentral'][mask]
             rweight = region_weights.partial_weight(exclude=exclude)
             rweight_nopu = region_weights.partial_weight(exclude=['pileup']+exclude)
-            ezfill('npv', nvtx=df['PV_npvs'][mask], weight=rweight[mask])
-            ezfill('npvgood', nvtx=df['PV_npvsGood'][mask], weight=rweight[mask])
+            ezfill('npv', nvtx=npv, weight=rweight[mask])
+            ezfill('npvgood', nvtx=npvgood, weight=rweight[mask])
+
+            ezfill('npv_nopu', nvtx=npv, weight=rweight_nopu[mask])
+            ezfill('npvgood_nopu', nvtx=npvgood, weight=rweight_nopu[mask])
+
+            ezfill('rho_all', rho=rho_all, weight=rweight[mask])
+            ezfill('rho_central', rho=rho_central, weight=rweight[mask])
+            ezfill('rho_all_nopu', rho=rho_all, weight=rweight_nopu[mask])
+            ezfill('rho_central_nopu', rho=rho_central, weight=rweight_nopu[mask])
 
-            ezfill('npv_nopu', nvtx=df['PV_npvs'][mask], weight=rweight_nopu[mask])
-            ezfill('npvgood_nopu', nvtx=df['PV_npvsGood'][mask], weight=rweight_nopu[mask])
+            ezfill('npv_vs_recoil',     nvtx=npv,     recoil=recoil_masked,   weight=rweight[mask])
+            ezfill('npvgood_vs_recoil', nvtx=npvgood, recoil=recoil_masked,   weight=rweight[mask])
 
-            ezfill('rho_all', rho=df['fixedGridRhoFastjetAll'][mask], weight=rweight[mask])
-            ezfill('rho_central', rho=df['fixedGridRhoFastjetCentral'][mask], weight=rweight[mask])
-            ezfill('rho_all_nopu', rho=df['fixedGridRhoFastjetAll'][mask], weight=rweight_nopu[mask])
-            ezfill('rho_central_nopu', rho=df['fixedGridRhoFastjetCentral'][mask], weight=rweight_nopu[mask])
+            ezfill('npv_vs_recoil_nopu',     nvtx=npv,     recoil=recoil_masked, weight=rweight_nopu[mask])
+            ezfill('npvgood_vs_recoil_nopu', nvtx=npvgood, recoil=recoil_masked, weight=rweight_nopu[mask])
 
-            ezfill('npv_vs_recoil',     nvtx=df['PV_npvs'][mask],     recoil=recoil_pt[mask],   weight=rweight[mask])
-            ezfill('npvgood_vs_recoil', nvtx=df['PV_npvsGood'][mask], recoil=recoil_pt[mask],   weight=rweight[mask])
+            ezfill('rho_all_vs_recoil',          rho=rho_all,     recoil=recoil_masked, weight=rweight[mask])
+            ezfill('rho_central_vs_recoil',      rho=rho_central, recoil=recoil_masked, weight=rweight[mask])
+            ezfill('rho_all_vs_recoil_nopu',     rho=rho_all,     recoil=recoil_masked, weight=rweight_nopu[mask])
+            ezfill('rho_central_vs_recoil_nopu', rho=rho_central, recoil=recoil_masked, weight=rweight_nopu[mask])
 
-            ezfill('npv_vs_recoil_nopu',     nvtx=df['PV_npvs'][mask],     recoil=recoil_pt[mask], weight=rweight_nopu[mask])
-            ezfill('npvgood_vs_recoil_nopu', nvtx=df['PV_npvsGood'][mask], recoil=recoil_pt[mask], weight=rweight_nopu[mask])
+        fills.execute()
 
-            ezfill('rho_all_vs_recoil',          rho=df['fixedGridRhoFastjetAll'][mask],     recoil=recoil_pt[mask], weight=rweight[mask])
-            ezfill('rho_central_vs_recoil',      rho=df['fixedGridRhoFastjetCentral'][mask], recoil=recoil_pt[mask], weight=rweight[mask])
-            ezfill('rho_all_vs_recoil_nopu',     rho=df['fixedGridRhoFastjetAll'][mask],     recoil=recoil_pt[mask], weight=rweight_nopu[mask])
-            ezfill('rho_central_vs_recoil_nopu', rho=df['fixedGridRhoFastjetCentral'][mask], recoil=recoil_pt[mask], weight=rweight_nopu[mask])
+        if cfg.RUN.SAVE.TREE and cfg.RUN.SAVE.TREEFORMAT == 'parquet':
+            write_chunk_trees(output, df)
         return output
 
     def postprocess(self, accumulator):
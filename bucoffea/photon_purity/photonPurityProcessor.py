@@ -9,14 +9,13 @@ from coffea.analysis_objects import JaggedCandidateArray
 from coffea.lumi_tools import LumiMask
 
 from bucoffea.helpers import bucoffea_path,min_dphi_jet_met, object_overlap, weight_shape, mask_and
+from bucoffea.helpers.config import ConfigCache
 from bucoffea.helpers.dataset import (extract_year, is_data, is_lo_w, is_lo_z,
                                       is_nlo_w, is_nlo_z)
 from bucoffea.helpers.gen import (fill_gen_v_info, find_gen_dilepton, islep,
                                   isnu, setup_dressed_gen_candidates,
                                   setup_gen_candidates)
 
-from dynaconf import settings as cfg
-
 Hist = hist.Hist
 Bin = hist.Bin
 Cat = hist.Cat
@@ -134,21 +133,15 @@ class photonPurityProcessor(processor.ProcessorABC):
         items['sumw2'] = processor.defaultdict_accumulator(float)
 
         self._accumulator = processor.dict_accumulator(items)
-        self._configure()
+        self._configs = ConfigCache("config/monojet.yaml")
 
     def _configure(self, df=None):
-        cfg.DYNACONF_WORKS="merge_configs"
-        cfg.MERGE_ENABLED_FOR_DYNACONF=True
-        cfg.SETTINGS_FILE_FOR_DYNACONF = bucoffea_path("config/monojet.yaml")
-
-        # Reload config based on year
+        # Pick the pre-resolved config based on year
         if df:
             dataset = df['dataset']
             self._year = extract_year(dataset)
-            cfg.ENV_FOR_DYNACONF = f"era{self._year}"
-        else:
-            cfg.ENV_FOR_DYNACONF = f"default"
-        cfg.reload()
+            return self._configs.get(f"era{self._year}")
+        return self._configs.get("default")
 
     @property
     def accumulator(self):
@@ -156,7 +149,7 @@ class photonPurityProcessor(processor.ProcessorABC):
 
 
     def process(self, df):
-        self._configure(df)
+        cfg = self._configure(df)
         output = self.accumulator.identity()
         dataset = df['dataset']
 
@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+from coffea.util import load, save
+
+from bucoffea.helpers.diskcache import DiskCache, write_atomic
+
+pjoin = os.path.join
+
+def file_sha256(path):
+    '''Returns the SHA-256 digest of a file'''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def input_fingerprint(inpath):
+    """Cheap fingerprint of a coffea file or klepto directory
+
+    Only file names, sizes and modification times are used,
+    so that the inputs do not need to be read. The merge caches
+    written by acc_from_dir are not part of the inputs.
+
+    :param inpath: Path to the coffea file, klepto directory or directory of coffea files
+    :type inpath: str
+    :return: Fingerprint
+    :rtype: str
+    """
+    inpath = os.path.abspath(inpath)
+    entries = []
+    if os.path.isdir(inpath):
+        for path, _, files in os.walk(inpath):
+            for fn in files:
+                if fn.startswith('merged_cache') or os.path.basename(path).startswith('merged_cache'):
+                    continue
+                stat = os.stat(pjoin(path, fn))
+                entries.append((os.path.relpath(pjoin(path, fn), inpath), stat.st_size, stat.st_mtime_ns))
+    else:
+        stat = os.stat(inpath)
+        entries.append((inpath, stat.st_size, stat.st_mtime_ns))
+    h = hashlib.sha256(inpath.encode('utf-8'))
+    h.update(repr(sorted(entries)).encode('utf-8'))
+    return h.hexdigest()
+
+class HistogramCache(DiskCache):
+    '''
+    Content-addressed on-disk cache for normalized histograms.
+
+    Every entry is stored as a coffea file named after the hash of
+    everything that went into the normalization. The directory can
+    be set via BUCOFFEA_HIST_CACHE.
+    '''
+    dirname = 'histograms'
+    envvar = 'BUCOFFEA_HIST_CACHE'
+
+    def __init__(self, cachedir=None, maxsize=2*1024**3):
+        super().__init__(cachedir, maxsize)
+
+    def _path(self, key):
+        return pjoin(self.cachedir, f'{key}.coffea')
+
+    def get(self, key):
+        '''Returns the cached item or None'''
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            item = load(path)
+        except Exception:
+            os.remove(path)
+            return None
+
+        self.touch(path)
+        return item
+
+    def put(self, key, item):
+        write_atomic(self._path(key), lambda tmp: save(item, tmp))
+        self.prune()
@@ -12,8 +12,7 @@ from coffea import hist
 from coffea.util import load
 from matplotlib import pyplot as plt
 
-from bucoffea.plot.util import (acc_from_dir, lumi, merge_datasets,
-                                merge_extensions, scale_xs_lumi)
+from bucoffea.plot.util import lumi
 from bucoffea.plot.stack_plot import Style, make_plot
 from coffea.hist.plot import clopper_pearson_interval
 pjoin = os.path.join
@@ -23,6 +22,11 @@ colors ={
     'mc' : '#b30000'
 }
 def cr_ratio_plot(acc, distribution='recoil', regions=['cr_2m_j','cr_1m_j','cr_1e_j','cr_2e_j','cr_g_j'], year=2017, tag='', outdir='./output',mc=None, data=None):
+    """Plots the ratios between control regions in data and MC
+
+    :param acc: Accumulator with normalized histograms, see load_and_merge
+    :type acc: bucoffea.plot.util.LazyAccumulator
+    """
     if not os.path.exists(outdir):
         os.makedirs(outdir)
     # Rebin
@@ -34,12 +38,6 @@ def cr_ratio_plot(acc, distribution='recoil', regions=['cr_2m_j','cr_1m_j','cr_1
     except KeyError:
         pass
 
-    h = merge_extensions(h, acc)
-
-    scale_xs_lumi(h)
-
-    h = merge_datasets(h)
-
     histograms = {}
     for region in regions:
         histograms[region] = copy.deepcopy(h).integrate(h.axis('region'), region)
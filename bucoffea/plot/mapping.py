@@ -0,0 +1,139 @@
+import hashlib
+import re
+from collections import OrderedDict
+
+import yaml
+
+from bucoffea.helpers.paths import bucoffea_path
+
+# Extension tags that are removed from the
+# dataset name to find the base data set
+EXTENSION_TAGS = [
+    '.*(_EXT).*',
+    r'.*(_ext\d+).*',
+    '.*(_new_+pmx).*',
+    '.*(_PSweights).*'
+]
+_EXTENSION_TAGS_COMPILED = [re.compile(x) for x in EXTENSION_TAGS]
+_EXTENSION_BASE_CACHE = {}
+
+def extension_base(dataset):
+    '''Returns the name of a dataset with extension tags removed'''
+    try:
+        return _EXTENSION_BASE_CACHE[dataset]
+    except KeyError:
+        pass
+    base = dataset
+    for regex in _EXTENSION_TAGS_COMPILED:
+        m = regex.match(base)
+        if m:
+            base = base.replace(m.groups()[0],"")
+    _EXTENSION_BASE_CACHE[dataset] = base
+    return base
+
+class DatasetMapper(object):
+    '''
+    Groups datasets into physics processes.
+
+    The rules are read from a YAML file and compiled once. The groups
+    each dataset belongs to are memoized per dataset name, and complete
+    mappings are memoized per set of datasets, so that repeated calls,
+    e.g. once per distribution, reduce to dictionary look ups.
+    '''
+    def __init__(self, rulefile=None):
+        """
+        :param rulefile: YAML file with the grouping rules, defaults
+                         to data/datasets/dataset_mapping.yml
+        :type rulefile: str, optional
+        """
+        self.rulefile = rulefile if rulefile else bucoffea_path('data/datasets/dataset_mapping.yml')
+        with open(self.rulefile, 'rb') as f:
+            content = f.read()
+
+        # Identifies the rules, e.g. for invalidating caches
+        self.version = hashlib.sha256(content).hexdigest()
+
+        rules = yaml.load(content, Loader=yaml.FullLoader)
+        self._groups = []
+        for name, rule in rules.get('groups', {}).items():
+            self._add_group(name, rule)
+        for year in rules.get('years', []):
+            for name, rule in rules.get('yearly', {}).items():
+                self._add_group(
+                                name.format(year=year),
+                                {k : [x.format(year=year) for x in v] for k, v in rule.items()}
+                                )
+
+        # Single expression to quickly find datasets
+        # that do not belong to any group
+        patterns = [regex.pattern for _, regex, _ in self._groups if regex]
+        self._any = re.compile('|'.join(f'(?:{x})' for x in patterns)) if patterns else None
+
+        self._membership = {}
+        self._mappings = {}
+
+    def _add_group(self, name, rule):
+        regexes = rule.get('regex', [])
+        regex = re.compile('|'.join(f'(?:{x})' for x in regexes)) if regexes else None
+        self._groups.append((name, regex, list(rule.get('literal', []))))
+
+    def groups_for(self, dataset):
+        '''Returns the indices of all groups a dataset matches'''
+        try:
+            return self._membership[dataset]
+        except KeyError:
+            pass
+        if self._any and self._any.match(dataset):
+            groups = tuple(i for i, (_, regex, _) in enumerate(self._groups) if regex and regex.match(dataset))
+        else:
+            groups = ()
+        self._membership[dataset] = groups
+        return groups
+
+    def mapping(self, all_datasets):
+        """Creates the mapping from group name to the datasets in it
+
+        :param all_datasets: Names of all datasets to map
+        :type all_datasets: list
+        :return: Mapping between group and dataset names
+        :rtype: OrderedDict
+        """
+        key = tuple(all_datasets)
+        try:
+            cached = self._mappings[key]
+        except KeyError:
+            cached = self._mappings[key] = self._create_mapping(all_datasets)
+        # Return a copy, so that callers may modify it
+        return OrderedDict((k, list(v)) for k, v in cached.items())
+
+    def _create_mapping(self, all_datasets):
+        members = [list(literal) for _, _, literal in self._groups]
+        unmapped = []
+        for ds in all_datasets:
+            groups = self.groups_for(ds)
+            for i in groups:
+                members[i].append(ds)
+            if not groups:
+                unmapped.append(ds)
+
+        # Remove empty groups
+        mapping = OrderedDict()
+        for (name, _, _), datasets in zip(self._groups, members):
+            if len(datasets):
+                mapping[name] = datasets
+
+        # Add datasets we didn't catch yet
+        mapped_datasets = set()
+        for val in mapping.values():
+            mapped_datasets.update(val)
+        for ds in unmapped:
+            if ds not in mapped_datasets:
+                mapping[ds] = [ds]
+        return mapping
+
+_MAPPER = {}
+def dataset_mapper():
+    '''Returns the process-wide mapper for the default rule file'''
+    if 'default' not in _MAPPER:
+        _MAPPER['default'] = DatasetMapper()
+    return _MAPPER['default']
@@ -15,8 +15,8 @@ from matplotlib import pyplot as plt
 from bucoffea.execute.dataset_definitions import short_name
 from bucoffea.helpers.dataset import is_data
 from bucoffea.helpers.paths import bucoffea_path
-from bucoffea.plot.util import (acc_from_dir, lumi, merge_datasets,
-                                merge_extensions, scale_xs_lumi)
+from bucoffea.plot.cache import HistogramCache
+from bucoffea.plot.util import load_and_merge, lumi
 from bucoffea.plot import style
 
 pjoin = os.path.join
@@ -414,8 +414,9 @@ def main():
     # 'acc' is short for 'accumulator', which is the output
     # produced by a coffea processor. It behaves like a python dict,
     # so you can import it also in an interactive python shell to play with it
-    # Note that 'acc_from_indir' uses caching, so subsequent readings will be much faster!
-    acc = acc_from_dir(indir)
+    # Histograms are only loaded and normalized when they are plotted,
+    # and the normalized histograms are kept for later runs
+    acc = load_and_merge(indir, lazy=True, cache=HistogramCache())
 
     # The make_plot function currently just makes a dimuon
     # mass plot for the dimuon control region.
@@ -427,14 +428,14 @@ def main():
         mc = re.compile(f'DY.*HT.*{year}')
         region='cr_2m_j'
         for distribution in ['recoil', 'dimuon_mass']:
-            make_plot(copy.deepcopy(acc), region=region,distribution=distribution, year=year, data=data, mc=mc)
+            make_plot(acc, region=region,distribution=distribution, year=year, data=data, mc=mc)
 
     for year in [2017, 2018]:
         data = re.compile(f'SingleMuon_{year}')
         mc = re.compile(f'W.*HT.*{year}')
         region='cr_1m_j'
         for distribution in ['recoil']:
-            make_plot(copy.deepcopy(acc), region=region,distribution=distribution, year=year, data=data, mc=mc)
+            make_plot(acc, region=region,distribution=distribution, year=year, data=data, mc=mc)
 
 
 
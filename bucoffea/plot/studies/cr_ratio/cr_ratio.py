@@ -12,8 +12,8 @@ from coffea import hist
 from coffea.util import load
 from matplotlib import pyplot as plt
 
-from bucoffea.plot.util import (acc_from_dir, lumi, merge_datasets,
-                                merge_extensions, scale_xs_lumi)
+from bucoffea.plot.cache import HistogramCache
+from bucoffea.plot.util import load_and_merge
 from bucoffea.plot.stack_plot import Style, make_plot
 from bucoffea.plot.cr_ratio_plot import cr_ratio_plot
 from coffea.hist.plot import clopper_pearson_interval
@@ -21,7 +21,7 @@ pjoin = os.path.join
 
 def main():
     infile=os.path.abspath('input/2019-09-09_gen_dilep_sf/')
-    acc = acc_from_dir(infile)
+    acc = load_and_merge(infile, lazy=True, cache=HistogramCache())
 
     for year in [2017,2018]:
         mc = {
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 #import sys
 from bucoffea.plot.stack_plot import *
+from bucoffea.plot.util import merge_datasets, merge_extensions, scale_xs_lumi
 from klepto.archives import dir_archive
 np.seterr(divide='ignore', invalid='ignore')
 import argparse
@@ -14,7 +14,8 @@ from matplotlib import pyplot as plt
 from bucoffea.execute.dataset_definitions import short_name
 from bucoffea.helpers.dataset import is_data
 from bucoffea.helpers.paths import bucoffea_path
-from bucoffea.plot.util import (acc_from_dir, lumi, merge_datasets,
+from bucoffea.plot.cache import HistogramCache
+from bucoffea.plot.util import (load_and_merge, lumi, merge_datasets,
                                 merge_extensions, scale_xs_lumi)
 from bucoffea.plot.stack_plot import make_plot
 
@@ -22,7 +23,7 @@ from bucoffea.plot.stack_plot import make_plot
 def data_mc_after_kfac():
     indir = "input/21Aug_newsf"
 
-    acc = acc_from_dir(indir)
+    acc = load_and_merge(indir, lazy=True, cache=HistogramCache())
     outdir = f'./output/{os.path.basename(indir)}'
     for year in [2017,2018]:
         data = re.compile(f'MET_{year}')
@@ -59,7 +60,7 @@ def data_mc_after_kfac():
 def ttbarcheck():
     indir = "input/21Aug_newsf"
 
-    acc = acc_from_dir(indir)
+    acc = load_and_merge(indir, lazy=True, cache=HistogramCache())
     outdir = f'./output/{os.path.basename(indir)}/ttbar/fxfx_vs_mlm'
     for year in [2017,2018]:
         data = re.compile(f'TTJets.*FXFX.*{year}')
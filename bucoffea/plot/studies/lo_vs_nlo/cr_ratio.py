@@ -3,7 +3,8 @@
 import os
 import re
 from pprint import pprint
-from bucoffea.plot.util import acc_from_dir
+from bucoffea.plot.cache import HistogramCache
+from bucoffea.plot.util import load_and_merge
 from bucoffea.plot.stack_plot import Style, make_plot
 from bucoffea.plot.cr_ratio_plot import cr_ratio_plot
 
@@ -180,7 +181,7 @@ plot_settings = defaultdict(lambda: defaultdict(lambda : None),
 )
 def cr_ratio():
         indir=os.path.abspath('input/2019-09-09_gen_dilep_sf/')
-        acc = acc_from_dir(indir)
+        acc = load_and_merge(indir, lazy=True, cache=HistogramCache())
         
 
         
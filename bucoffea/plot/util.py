@@ -17,7 +17,10 @@ from tqdm import tqdm
 
 from bucoffea.execute.dataset_definitions import short_name
 from bucoffea.helpers.dataset import extract_year, is_data
+from bucoffea.helpers.merging import IncrementalMerge
 from bucoffea.helpers.paths import bucoffea_path
+from bucoffea.plot.cache import HistogramCache, file_sha256, input_fingerprint
+from bucoffea.plot.mapping import dataset_mapper, extension_base
 
 from klepto.archives import dir_archive
 import uproot_methods.classes.TH1
@@ -53,16 +56,22 @@ def acc_from_dir(indir):
     """
     files = filter(lambda x: x.endswith(".coffea") and not ('cache' in x), os.listdir(indir))
     files = list(map(lambda x: os.path.abspath(pjoin(indir, x)), files))
-    listhash = sha256sum(files)
+
+    # Per-dataset partial sums, only new or
+    # replaced files are loaded here
+    incremental = IncrementalMerge(pjoin(indir, 'merged_cache_incremental'))
+    partials = incremental.update(files)
+
+    listhash = incremental.digest()
     cache = pjoin(indir, f'merged_cache_{listhash}.coffea')
     if os.path.exists(cache):
         return load(cache)
     else:
         # Progress bar
-        t = tqdm(total=len(files), desc='Merging input files')
+        t = tqdm(total=len(partials), desc='Merging input files')
 
         # Recursive merging
-        to_merge = files
+        to_merge = list(partials)
 
         # Use temporary files to store intermediate
         # merger results
@@ -129,20 +138,7 @@ def merge_extensions(histogram, acc, reweight_pu=True, noscale=False):
     nevents = defaultdict(float)
 
     for d in all_datasets:
-        base = d
-
-        to_replace =[
-            '.*(_EXT).*',
-            '.*(_ext\d+).*',
-            '.*(_new_+pmx).*',
-            '.*(_PSweights).*'
-        ]
-        for regex in to_replace:
-            m = re.match(regex, base)
-            if m:
-                base = base.replace(m.groups()[0],"")
-
-        mapping[base].append(d)
+        mapping[extension_base(d)].append(d)
 
 
     ### Duplicate removeal
@@ -185,105 +181,10 @@ def create_dataset_mapping(all_datasets):
     '''
     Given the input of all datasets in the histogram, create a mapping
     to merge datasets that belong to the same physics process.
+
+    The rules are defined in data/datasets/dataset_mapping.yml.
     '''
-    # TODO:
-    #   * Factor mapping out to configuration file?
-    #   * Fill in more data sets
-    #   * lots of duplicate code (re.match etc) -> simplify
-    mapping = {
-        'SingleMuon_2016' : [x for x in all_datasets if re.match('SingleMuon_2016[A-Z]+',x)],
-        'EGamma_2016' : [x for x in all_datasets if re.match('SingleElectron_.*2016[A-Z]+',x) or re.match('SinglePhoton_2016[A-Z]+',x)],
-        'MET_2016' : [x for x in all_datasets if re.match('MET_.*2016[A-Z]+',x)],
-        'JetHT_2016' : [x for x in all_datasets if re.match('JetHT_.*2016[A-Z]+',x)],
-
-        'SingleMuon_2017' : [x for x in all_datasets if re.match('SingleMuon_.*2017[A-Z]+',x)],
-        'EGamma_2017' : [x for x in all_datasets if re.match('SingleElectron_.*2017[A-Z]+',x) or re.match('SinglePhoton_.*2017[A-Z]+',x)],
-        'MET_2017' : [x for x in all_datasets if re.match('MET_.*2017[A-Z]+',x)],
-        'JetHT_2017' : [x for x in all_datasets if re.match('JetHT_.*2017[A-Z]+',x)],
-
-        'SingleMuon_2018' : [x for x in all_datasets if re.match('SingleMuon_.*2018[A-Z]+',x)],
-        'EGamma_2018' : [x for x in all_datasets if re.match('EGamma_.*2018[A-Z]+',x)],
-        'MET_2018' : [x for x in all_datasets if re.match('MET_.*2018[A-Z]+',x)],
-        'JetHT_2018' : [x for x in all_datasets if re.match('JetHT_.*2018[A-Z]+',x)],
-
-        'GJets_SM_5f_EWK-mg_2017' : ['GJets_SM_5f_EWK-mg_2017'],
-        'GJets_SM_5f_EWK-mg_2018' : ['GJets_SM_5f_EWK-mg_2017'],
-
-        'G1Jet_Pt-amcatnlo_2016' : [x for x in all_datasets if re.match('G1Jet_Pt-.*-amcatnlo_2016',x)],
-
-        'WNJetsToLNu_LHEWpT-FXFX_2017' : [x for x in all_datasets if re.match('W(\d+)JetsToLNu_LHEWpT_(\d+)-.*-FXFX_2017',x)],
-        'WNJetsToLNu-FXFX_2018' : [x for x in all_datasets if re.match('WJetsToLNu_(\d+)J-amcatnloFXFX_2018',x)],
-
-        'DYNJetsToLL_M-50_LHEZpT-FXFX_2017' : [x for x in all_datasets if re.match('DY(\d+)JetsToLL_M-50_LHEZpT_(\d+)-.*-FXFX_2017',x)],
-        'DYNJetsToLL_M-50_LHEZpT-FXFX_2018' : [x for x in all_datasets if re.match('DY(\d+)JetsToLL_M-50_LHEZpT_(\d+)-.*-FXFX_2018',x)],
-
-        'DYNJetsToLL_M-50-MLM_2017' : [x for x in all_datasets if re.match('DY(\d+)JetsToLL_M-50-MLM_2017',x)],
-        'DYNJetsToLL_M-50-MLM_2018' : [x for x in all_datasets if re.match('DY(\d+)JetsToLL_M-50-MLM_2018',x)],
-
-        'ZJetsToNuNu_HT_2017' : [x for x in all_datasets if re.match('ZJetsToNuNu_HT-(\d+)To.*-mg_2017',x)],
-        'ZJetsToNuNu_HT_2018' : [x for x in all_datasets if re.match('ZJetsToNuNu_HT-(\d+)To.*-mg_2018',x)],
-
-        'WNJetsToLNu-MLM_2017' : [x for x in all_datasets if re.match('W(\d+)JetsToLNu_2017',x)],
-        'WNJetsToLNu-MLM_2018' : [x for x in all_datasets if re.match('W(\d+)JetsToLNu_2018',x)],
-
-        'WH_WToQQ_Hinv_M125_2017' : [x for x in all_datasets if re.match('W.*H_WToQQ_HToInvisible_M125.*2017',x)],
-        'WH_WToQQ_Hinv_M125_2018' : [x for x in all_datasets if re.match('W.*H_WToQQ_HToInvisible_M125.*2018',x)]
-    }
-
-    # Some combinations are the same for all years
-    yearly = {
-        'GJets_1j_Gpt_5f_NLO-amcatnlo_{year}' : 'GJets_1j_Gpt-(\d+)To((\d+)|Inf)_5f_NLO-amcatnlo_{year}',
-        'GJets_1j_Gpt_5f_NLO_{year}' : 'GJets_1j_Gpt-(\d+)To((\d+)|Inf)_5f_NLO_{year}',
-        'GJets_HT_MLM_{year}' : 'GJets_HT-(\d+)To.*-MLM_{year}',
-        'GJets_DR-0p4_HT_MLM_{year}'    : 'GJets_DR-0p4_HT-(\d+)To.*-MLM_.*{year}',
-        'WJetsToQQ_HT_MLM_{year}' : 'WJetsToQQ_HT-?(\d+)(T|t)o.*-MLM_{year}',
-        'DYJetsToLL_M-50_HT_MLM_{year}' : 'DYJetsToLL_M-50_HT-(\d+)to.*-MLM_{year}',
-        'WJetsToLNu_HT_MLM_{year}' : 'WJetsToLNu_HT-(\d+)To.*-MLM_{year}',
-
-        'Top_FXFX_{year}' : '(TTJets-amcatnloFXFX|ST_((s|t)-channel|tW)_(anti)?top).*_{year}',
-        'Top_MLM_{year}' : '(TTJets.*MLM|ST_((s|t)-channel|tW)_(anti)?top).*_{year}',
-        'TT_pow_{year}' : '(TTTo.*pow|ST).*{year}',
-
-        'QCD_HT_{year}' : 'QCD_HT.*_{year}',
-
-        'EWKW2Jets_WToLNu_M-50-mg_{year}' : 'EWKW(Plus|Minus)2Jets.*-mg_{year}',
-
-        'Diboson_{year}' : '((W|Z)(W|Z))(_PSweights)?_{year}',
-        'WW_{year}' : 'WW(_PSweights)?_{year}',
-        'ZZ_{year}' : 'ZZ(_PSweights)?_{year}',
-        'WZ_{year}' : 'WZ(_PSweights)?_{year}',
-
-        'ZNJetsToNuNu_M-50_LHEZpT-FXFX_{year}' : 'Z\dJetsToNuN(u|U)_M-50_LHEZpT.*FXFX.*{year}',
-        'VQQGamma_FXFX_{year}' : '(W|Z)QQGamma_5f_NLO_FXFX-amcatnlo_{year}',
-        'WQQGamma_FXFX_{year}' : 'WQQGamma_5f_NLO_FXFX-amcatnlo_{year}',
-        'ZQQGamma_FXFX_{year}' : 'ZQQGamma_5f_NLO_FXFX-amcatnlo_{year}',
-
-        'WJetsToLNu_Pt-FXFX_{year}': 'WJetsToLNu_Pt-\d+To.*-amcatnloFXFX_{year}'
-    }
-    for year in [2016,2017,2018]:
-        for name, regex in yearly.items():
-            mapping[name.format(year=year)] = [x for x in all_datasets if re.match(regex.format(year=year), x)]
-
-    # Remove empty lists
-    tmp = {}
-    for k, v in mapping.items():
-        if len(v):
-            tmp[k] = v
-    mapping = tmp
-
-    # Add datasets we didn't catch yet
-    mapped_datasets =  []
-    for val in mapping.values():
-        mapped_datasets.extend(val)
-
-    for ds in all_datasets:
-        if ds in mapped_datasets:
-            continue
-        else:
-            mapping[ds] = [ds]
-    
-    # Mapping good to go to be used in "merge_datasets" function
-    return mapping
+    return dataset_mapper().mapping(all_datasets)
 
 def merge_datasets(histogram):
     """Merge datasets that belong same physics process
@@ -303,13 +204,20 @@ def merge_datasets(histogram):
     return histogram
 
 
-def load_xs():
+def load_xs(cache={}):
     """Function to read per-sample cross sections from file.
 
+    The parsed file is kept in memory and is only
+    read again if it has been modified.
+
     :return: Mapping dataset -> cross-section
     :rtype: dict
     """
     xsfile = bucoffea_path('data/datasets/xs/xs.yml')
+    mtime = os.path.getmtime(xsfile)
+    if cache.get('mtime', None) == mtime:
+        return dict(cache['xs'])
+
     with open(xsfile,'r') as f:
         xs_yml = yaml.load(f, Loader=yaml.FullLoader)
 
@@ -337,7 +245,10 @@ def load_xs():
             tmp[base] = xs[k]
 
     xs.update(tmp)
-    return xs
+
+    cache['mtime'] = mtime
+    cache['xs'] = xs
+    return dict(xs)
 
 def lumi(year):
     """Golden JSON luminosity per for given year
@@ -433,34 +344,136 @@ class URTH1(uproot_methods.classes.TH1.Methods, list):
         self._classname = "TH1D"
         self._fSumw2 = sumw2.astype(">f8")
 
-def load_and_merge(inpath, distributions=None, dataset_regex=None):
-    if not os.path.exists(inpath):
-        raise IOError("Directory not found: " + inpath)
-
-    if inpath.endswith(".coffea"):
-        acc = load(inpath)
-    else:
-        acc = klepto_load(inpath)
-        acc.load('sumw')
-        acc.load('sumw_pileup')
-        acc.load('nevents')
-        if distributions:
-            for distribution in distributions:
-                acc.load(distribution)
-        else:
-            acc.load()
-
+class LazyAccumulator(object):
+    '''
+    Read-only accumulator view that loads items only when accessed.
+
+    Histograms are normalized on first access: extensions are merged,
+    the MC is scaled to cross section and luminosity and the datasets
+    are grouped into physics processes. The result is memoized, so
+    every histogram is read and normalized at most once. All other
+    items, such as sumw, are returned as they are stored. The inputs
+    are only opened once an item is needed that is not in the cache.
+    '''
+    def __init__(self, inpath, dataset_regex=None, normalize=True, cache=None):
+        """
+        :param inpath: Path to a klepto directory, a directory of coffea files or a single coffea file
+        :type inpath: str
+        :param dataset_regex: If given, only keep datasets matching this regular expression
+        :type dataset_regex: str, optional
+        :param normalize: Whether to normalize histograms on access
+        :type normalize: bool, optional
+        :param cache: Persistent cache for normalized histograms
+        :type cache: HistogramCache, optional
+        """
+        if not os.path.exists(inpath):
+            raise IOError("Directory not found: " + inpath)
+        self._inpath = inpath
+        self._loaded = None
+        self._dataset_regex = dataset_regex
+        self._normalize = normalize
+        self._raw = {}
+        self._normalized = {}
+        self._cache = cache
+        self._fingerprint = input_fingerprint(inpath) if cache else None
+        self._xs_hash = file_sha256(bucoffea_path('data/datasets/xs/xs.yml')) if cache else None
+
+    @property
+    def _store(self):
+        '''The inputs, only opened once something is read from them'''
+        if self._loaded is None:
+            if self._inpath.endswith(".coffea"):
+                self._loaded = load(self._inpath)
+            elif any(x.endswith(".coffea") for x in os.listdir(self._inpath)):
+                # Job outputs, which are merged up front
+                self._loaded = acc_from_dir(self._inpath)
+            else:
+                self._loaded = klepto_load(self._inpath).archive
+        return self._loaded
+
+    def keys(self):
+        return self._store.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def items(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def raw(self, key):
+        '''Returns an item as it is stored, without normalization'''
+        if key not in self._raw:
+            self._raw[key] = self._store[key]
+        return self._raw[key]
+
+    def _cache_key(self, key):
+        return HistogramCache.key(
+                                  inputs=self._fingerprint,
+                                  distribution=key,
+                                  dataset_regex=self._dataset_regex,
+                                  xs=self._xs_hash,
+                                  mapping=dataset_mapper().version
+                                  )
+
+    def __getitem__(self, key):
+        if key in self._normalized:
+            return self._normalized[key]
+
+        # Items that are not histograms are returned as stored
+        if key in self._raw and not isinstance(self._raw[key], hist.Hist):
+            return self._raw[key]
+
+        if self._normalize and self._cache:
+            item = self._cache.get(self._cache_key(key))
+            if item is not None:
+                self._normalized[key] = item
+                return item
+
+        item = self.raw(key)
+        if not (self._normalize and isinstance(item, hist.Hist)):
+            return item
+
+        if self._dataset_regex:
+            item = item[re.compile(self._dataset_regex)]
+        item = merge_extensions(item, self, reweight_pu=not ('nopu' in key))
+        scale_xs_lumi(item)
+        item = merge_datasets(item)
+        item.axis('dataset').sorting = 'integral'
+
+        # The raw histogram is not needed anymore
+        self._raw.pop(key)
+        self._normalized[key] = item
+        if self._cache:
+            self._cache.put(self._cache_key(key), item)
+        return item
+
+def load_and_merge(inpath, distributions=None, dataset_regex=None, lazy=False, cache=None):
+    """Load an accumulator and normalize its histograms
+
+    :param inpath: Path to a klepto directory, a directory of coffea files or a single coffea file
+    :type inpath: str
+    :param distributions: Histograms to normalize right away, defaults to all histograms
+    :type distributions: list, optional
+    :param dataset_regex: If given, only keep datasets matching this regular expression
+    :type dataset_regex: str, optional
+    :param lazy: If true, nothing is loaded until it is accessed
+    :type lazy: bool, optional
+    :param cache: Persistent cache for normalized histograms
+    :type cache: HistogramCache, optional
+    :return: Accumulator view with normalized histograms
+    :rtype: LazyAccumulator
+    """
+    acc = LazyAccumulator(inpath, dataset_regex=dataset_regex, cache=cache)
+    if lazy:
+        return acc
 
     if not distributions:
-        distributions = [k for k,v in acc.items() if isinstance(v, hist.Hist)]
-
-    if dataset_regex:
-        for distribution in distributions:
-            acc[distribution] = acc[distribution][re.compile(dataset_regex)]
+        distributions = [k for k in acc.keys() if isinstance(acc.raw(k), hist.Hist)]
 
     for distribution in distributions:
-        acc[distribution] = merge_extensions(acc[distribution], acc, reweight_pu=not ('nopu' in distribution))
-        scale_xs_lumi(acc[distribution])
-        acc[distribution] = merge_datasets(acc[distribution])
-        acc[distribution].axis('dataset').sorting = 'integral'
+        acc[distribution]
     return acc
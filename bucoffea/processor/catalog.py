@@ -0,0 +1,268 @@
+"""Persistent catalog of the metadata of input files"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import uproot
+
+from bucoffea.helpers.paths import xrootd_format
+from bucoffea.processor.chunking import branches_key, event_bytes
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+def default_catalog_path():
+    '''Location of the file catalog, can be set via BUCOFFEA_FILE_CATALOG'''
+    return os.environ.get(
+                          'BUCOFFEA_FILE_CATALOG',
+                          os.path.expanduser('~/.cache/bucoffea/filecatalog.sqlite')
+                          )
+
+def read_metadata(path, treename, branches=None, xrootdtimeout=None):
+    """Reads the metadata of a tree from a file
+
+    :param path: File to read
+    :type path: str
+    :param treename: Name of the tree
+    :type treename: str
+    :param branches: Branches to count for the size per event, defaults to all
+    :type branches: list, optional
+    :param xrootdtimeout: Timeout for remote files in seconds
+    :type xrootdtimeout: int, optional
+    :return: Number of entries, file UUID, cluster boundaries,
+             uncompressed bytes per event, the branches
+             counted for it (see branches_key) and file size
+    :rtype: dict
+    """
+    xrootdsource = {"timeout": xrootdtimeout, "chunkbytes": 32 * 1024, "limitbytes": 1024**2, "parallel": False}
+    file = uproot.open(path, xrootdsource=xrootdsource)
+    tree = file[treename]
+    return {
+        'numentries' : tree.numentries,
+        'uuid' : file._context.uuid,
+        'clusters' : [0] + list(c[1] for c in tree.clusters()),
+        'eventbytes' : event_bytes(tree, branches),
+        'eventbranches' : branches_key(branches),
+        'size' : file.source.size(),
+    }
+
+# Columns of the catalog table in addition to path and tree
+_FIELDS = ['numentries', 'uuid', 'clusters', 'eventbytes', 'eventbranches', 'size']
+
+class FileCatalog(MutableMapping):
+    '''
+    Metadata of input files, stored in an SQLite database.
+
+    Keeps the number of entries, cluster boundaries, UUID and size
+    per file and tree, along with the time the entry was last used.
+    NanoAOD files do not change once they are written, so entries
+    are reused across runs and submissions without opening the
+    files again. Several processes can share the same catalog.
+
+    Keys are FileMeta objects or (file, tree) tuples, so that the
+    catalog can be used as metadata_cache of run_uproot_job_nanoaod.
+    '''
+    def __init__(self, path=None):
+        """
+        :param path: Database file, defaults to default_catalog_path()
+        :type path: str, optional
+        """
+        self.path = path if path else default_catalog_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS files (
+                    path TEXT NOT NULL,
+                    tree TEXT NOT NULL,
+                    numentries INTEGER NOT NULL,
+                    uuid BLOB,
+                    clusters TEXT,
+                    eventbytes REAL,
+                    eventbranches TEXT,
+                    size INTEGER,
+                    lastseen REAL NOT NULL,
+                    PRIMARY KEY (path, tree)
+                )'''
+            )
+            # Catalogs written before the counted branches were stored
+            if 'eventbranches' not in [x[1] for x in conn.execute("PRAGMA table_info(files)")]:
+                conn.execute("ALTER TABLE files ADD COLUMN eventbranches TEXT")
+
+    def __getstate__(self):
+        return {'path' : self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
+
+    def _connection(self):
+        '''Connection of the current thread, since connections cannot be shared between threads'''
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(key):
+        if isinstance(key, tuple):
+            path, tree = key
+        else:
+            path, tree = key.filename, key.treename
+        return xrootd_format(path), tree
+
+    @staticmethod
+    def _from_row(row):
+        metadata = {k : v for k, v in zip(_FIELDS, row) if v is not None}
+        if 'clusters' in metadata:
+            metadata['clusters'] = json.loads(metadata['clusters'])
+        return metadata
+
+    def __getitem__(self, key):
+        row = self._connection().execute(
+            f"SELECT {', '.join(_FIELDS)} FROM files WHERE path=? AND tree=?", self._key(key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._from_row(row)
+
+    def __setitem__(self, key, metadata):
+        self.update({key : metadata})
+
+    def __delitem__(self, key):
+        with self._connection() as conn:
+            if not conn.execute("DELETE FROM files WHERE path=? AND tree=?", self._key(key)).rowcount:
+                raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._connection().execute("SELECT path, tree FROM files").fetchall())
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def __bool__(self):
+        # Usable as cache even while empty
+        return True
+
+    def update(self, other):
+        """Adds or updates the metadata of several files in one transaction
+
+        Values missing from the new metadata, e.g. the clusters,
+        are kept from the existing entry.
+
+        :param other: Mapping from key to metadata
+        :type other: dict
+        """
+        now = time.time()
+        rows = []
+        for key, metadata in dict(other).items():
+            try:
+                metadata = dict(self[key], **metadata)
+            except KeyError:
+                pass
+            clusters = metadata.get('clusters')
+            rows.append(self._key(key) + (
+                metadata['numentries'],
+                metadata.get('uuid'),
+                json.dumps(list(map(int, clusters))) if clusters is not None else None,
+                metadata.get('eventbytes'),
+                metadata.get('eventbranches'),
+                metadata.get('size'),
+                now,
+            ))
+        with self._connection() as conn:
+            conn.executemany(f"INSERT OR REPLACE INTO files (path, tree, {', '.join(_FIELDS)}, lastseen) VALUES ({', '.join('?' * (len(_FIELDS) + 3))})", rows)
+
+    def lookup(self, files, treename):
+        """Metadata of the files that are in the catalog
+
+        The entries found are marked as used.
+
+        :param files: File paths
+        :type files: list
+        :param treename: Name of the tree
+        :type treename: str
+        :return: Mapping from file path, as given, to metadata
+        :rtype: dict
+        """
+        paths = {self._key((x, treename))[0] : x for x in files}
+        found = {}
+        conn = self._connection()
+        keys = list(paths)
+        # Stay below the limit on the number of SQL variables
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i+500]
+            rows = conn.execute(
+                f"SELECT path, {', '.join(_FIELDS)} FROM files WHERE tree=? AND path IN ({', '.join('?' * len(batch))})",
+                [treename] + batch
+            ).fetchall()
+            for row in rows:
+                found[paths[row[0]]] = self._from_row(row[1:])
+        with conn:
+            conn.executemany("UPDATE files SET lastseen=? WHERE path=? AND tree=?",
+                             [(time.time(),) + self._key((x, treename)) for x in found])
+        return found
+
+    def populate(self, files, treename, workers=8, fetch=read_metadata):
+        """Metadata of all given files, reading it for files not in the catalog yet
+
+        :param files: File paths
+        :type files: list
+        :param treename: Name of the tree
+        :type treename: str
+        :param workers: Number of files to read concurrently
+        :type workers: int, optional
+        :param fetch: Function reading the metadata, takes path and tree name
+        :type fetch: callable, optional
+        :return: Mapping from file path, as given, to metadata
+        :rtype: dict
+        """
+        metadata = self.lookup(files, treename)
+        missing = [x for x in files if x not in metadata]
+        if missing:
+            with ThreadPoolExecutor(workers) as pool:
+                fetched = dict(zip(missing, pool.map(lambda x: fetch(x, treename), missing)))
+            self.update({(path, treename) : m for path, m in fetched.items()})
+            metadata.update(fetched)
+        return metadata
+
+    def add_copies(self, copies, treename):
+        """Adds entries for copies of files, e.g. on local disk, taken from their sources
+
+        Sources that are not in the catalog are skipped.
+
+        :param copies: Mapping from path of the copy to path of the source
+        :type copies: dict
+        :param treename: Name of the tree
+        :type treename: str
+        """
+        found = self.lookup(list(copies.values()), treename)
+        self.update({(path, treename) : found[source] for path, source in copies.items() if source in found})
+
+    def export(self, files, treename, path):
+        """Copies the entries of the given files into a new catalog
+
+        :param path: Database file of the new catalog
+        :type path: str
+        :return: The new catalog
+        :rtype: FileCatalog
+        """
+        catalog = FileCatalog(path)
+        catalog.update({(x, treename) : m for x, m in self.lookup(files, treename).items()})
+        return catalog
+
+    def prune(self, older_than):
+        """Removes entries that were not used for the given number of seconds
+
+        :return: Number of removed entries
+        :rtype: int
+        """
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM files WHERE lastseen < ?", (time.time() - older_than,)).rowcount
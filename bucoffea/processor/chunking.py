@@ -0,0 +1,132 @@
+"""Cluster-aligned chunking with a byte or time budget per chunk"""
+
+import hashlib
+
+from coffea.processor.executor import WorkItem
+
+from bucoffea.processor.store import ProcessorStore
+
+class ThroughputHistory(ProcessorStore):
+    '''
+    Processing rate of a processor measured in previous runs, per dataset kind.
+
+    Only the most recent measurement is kept, since the rate
+    changes along with the processor. The history of a processor
+    is kept in BUCOFFEA_THROUGHPUT_DIR.
+    '''
+    dirname = 'throughput'
+    envvar = 'BUCOFFEA_THROUGHPUT_DIR'
+
+    def rate(self, kind):
+        """Processed events per second
+
+        :return: Rate or None if nothing was measured
+        :rtype: float
+        """
+        m = self.content.get(kind)
+        if not m or m['time'] <= 0:
+            return None
+        return m['entries'] / m['time']
+
+    def record(self, kind, entries, time):
+        if entries > 0 and time > 0:
+            self.content[kind] = {'entries' : int(entries), 'time' : float(time)}
+
+def branches_key(branches):
+    '''Identifier of the branches counted by event_bytes, None for all branches'''
+    if branches is None:
+        return None
+    return hashlib.md5(' '.join(sorted(branches)).encode('utf-8')).hexdigest()
+
+def event_bytes(tree, branches=None):
+    """Average uncompressed size of an event
+
+    :param tree: Tree to inspect
+    :type tree: uproot.tree.TTreeMethods
+    :param branches: Only count these branches, defaults to all
+    :type branches: list, optional
+    :return: Size in bytes
+    :rtype: float
+    """
+    if not tree.numentries:
+        return 0.
+    if branches is None:
+        selected = tree.allvalues()
+    else:
+        selected = []
+        for name in branches:
+            try:
+                selected.append(tree[name])
+            except KeyError:
+                continue
+    return sum(branch._fTotBytes for branch in selected) / tree.numentries
+
+def target_entries(metadata, chunksize, chunkbytes=None, chunktime=None, rate=None):
+    """Number of entries per chunk satisfying all budgets
+
+    :param metadata: File metadata, using the event size if available
+    :type metadata: dict
+    :param chunksize: Maximum number of entries
+    :type chunksize: int
+    :param chunkbytes: Maximum uncompressed bytes to read per chunk
+    :type chunkbytes: float, optional
+    :param chunktime: Processing time to aim for per chunk, in seconds
+    :type chunktime: float, optional
+    :param rate: Measured processing rate in events per second
+    :type rate: float, optional
+    :rtype: int
+    """
+    limits = [chunksize]
+    if chunkbytes and metadata.get('eventbytes'):
+        limits.append(chunkbytes / metadata['eventbytes'])
+    if chunktime and rate:
+        limits.append(chunktime * rate)
+    return max(int(min(limits)), 1)
+
+def cluster_boundaries(clusters, maxentries):
+    """Chunk boundaries at cluster boundaries
+
+    Chunks are made as even as possible without exceeding the given
+    number of entries. Only single clusters that are larger than
+    that become chunks of their own.
+
+    :param clusters: Cluster boundaries, starting with 0
+    :type clusters: list
+    :param maxentries: Maximum number of entries per chunk
+    :type maxentries: int
+    :return: Chunk boundaries
+    :rtype: list
+    """
+    clusters = sorted(set(clusters))
+    numentries = clusters[-1]
+    if numentries == 0:
+        # Empty files still contribute their Runs tree, e.g. the sum of weights
+        return [0, 0]
+    boundaries = [0]
+    icluster = 0
+    while boundaries[-1] < numentries:
+        start = boundaries[-1]
+        remaining = numentries - start
+        nchunks = -(-remaining // maxentries)
+        target = start + remaining / nchunks
+
+        # Closest cluster boundary to the target that stays within the limit
+        best = None
+        for i in range(icluster + 1, len(clusters)):
+            if clusters[i] - start > maxentries:
+                break
+            if best is None or abs(clusters[i] - target) <= abs(clusters[best] - target):
+                best = i
+        if best is None:
+            best = icluster + 1
+        boundaries.append(clusters[best])
+        icluster = best
+    return boundaries
+
+def dynamic_chunks(filemeta, maxentries):
+    '''Cluster-aligned work items for a file, see cluster_boundaries'''
+    metadata = filemeta.metadata
+    clusters = metadata.get('clusters') or [0, metadata['numentries']]
+    boundaries = cluster_boundaries(clusters, maxentries)
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        yield WorkItem(filemeta.dataset, filemeta.filename, filemeta.treename, start, stop, metadata['uuid'])
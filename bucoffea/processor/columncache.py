@@ -0,0 +1,177 @@
+"""On-disk cache of decompressed branch contents"""
+
+import os
+import shutil
+
+import awkward
+import numpy as np
+from coffea.processor.dataframe import LazyDataFrame
+
+from bucoffea.helpers.diskcache import DiskCache, write_atomic
+from bucoffea.helpers.profiling import timed
+
+pjoin = os.path.join
+
+# Default limit of the total cache size in bytes
+DEFAULT_MAXSIZE = 50*1024**3
+
+def file_uuid(file):
+    '''Identifier of an opened ROOT file, independent of where it is read from'''
+    uuid = file._context.uuid
+    return uuid.hex() if isinstance(uuid, bytes) else str(uuid)
+
+def _to_parts(array):
+    '''Splits an array into plain numpy arrays, or returns None if that is not possible'''
+    if isinstance(array, np.ndarray):
+        return None if array.dtype == object else {'content' : array}
+    if isinstance(array, awkward.JaggedArray):
+        if not isinstance(array.content, np.ndarray) or array.content.dtype == object:
+            return None
+        array = array.compact()
+        return {'offsets' : array.offsets, 'content' : array.content}
+    return None
+
+def _from_parts(parts):
+    if 'offsets' in parts:
+        return awkward.JaggedArray.fromoffsets(parts['offsets'], parts['content'])
+    return parts['content']
+
+class ColumnCache(DiskCache):
+    '''
+    On-disk cache of branch contents per file, tree and entry range.
+
+    Every entry is a directory holding the decompressed array as
+    NumPy files, plus the offsets for jagged arrays. Entries are
+    memory-mapped when read, so that a cached column costs no
+    more than reading it from local disk. Only flat and singly
+    jagged numeric branches are cached, i.e. all NanoAOD branches.
+    The directory can be set via BUCOFFEA_COLUMN_CACHE.
+    '''
+    dirname = 'columndata'
+    envvar = 'BUCOFFEA_COLUMN_CACHE'
+
+    def __init__(self, cachedir=None, maxsize=DEFAULT_MAXSIZE):
+        super().__init__(cachedir, maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+
+    def _path(self, key):
+        return pjoin(self.cachedir, key[:2], key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._path(key))
+
+    def get(self, key):
+        '''Returns the cached array or None'''
+        path = self._path(key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        try:
+            parts = {}
+            for fn in os.listdir(path):
+                # Copy-on-write, since processors may modify their inputs
+                parts[fn[:-len('.npy')]] = np.load(pjoin(path, fn), mmap_mode='c')
+            array = _from_parts(parts)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            self.misses += 1
+            return None
+
+        self.touch(path)
+        self.hits += 1
+        return array
+
+    def put(self, key, array):
+        """Stores an array
+
+        :return: True if the array could be stored
+        :rtype: bool
+        """
+        parts = _to_parts(array)
+        if parts is None:
+            return False
+        def write(tmp):
+            os.makedirs(tmp, exist_ok=True)
+            for name, part in parts.items():
+                np.save(pjoin(tmp, f'{name}.npy'), np.ascontiguousarray(part))
+        if not write_atomic(self._path(key), write):
+            # Stored by another process in the meantime
+            return True
+
+        # Listing all entries is expensive for a cache holding
+        # many columns, so only prune every few percent of the size
+        self._written += sum(part.nbytes for part in parts.values())
+        if self._written > self.maxsize / 20:
+            self.prune()
+        return True
+
+    def prune(self, maxsize=None):
+        self._written = 0
+        super().prune(maxsize)
+
+# Caches of this process, see get_column_cache
+_caches = {}
+
+def get_column_cache(cachedir=None, maxsize=DEFAULT_MAXSIZE):
+    """The column cache of a directory, shared by all chunks processed in this process
+
+    Keeping one instance per process lets the amount of written
+    data add up across chunks, so that the cache is pruned
+    regularly rather than only after very large chunks.
+
+    :rtype: ColumnCache
+    """
+    key = (os.getpid(), cachedir if cachedir else ColumnCache.default_dir(), maxsize)
+    if key not in _caches:
+        _caches[key] = ColumnCache(key[1], maxsize)
+    return _caches[key]
+
+class CachedLazyDataFrame(LazyDataFrame):
+    '''
+    LazyDataFrame that takes branches from a ColumnCache if possible.
+
+    Branches that are not cached yet are read from the tree
+    as usual and added to the cache.
+    '''
+    def __init__(self, tree, cache, fileid, entrystart=None, entrystop=None, flatten=False):
+        """
+        :param tree: Tree to read from
+        :type tree: uproot.tree.TTreeMethods
+        :param cache: Cache to use
+        :type cache: ColumnCache
+        :param fileid: Identifier of the file, see file_uuid()
+        :type fileid: str
+        """
+        super().__init__(tree, entrystart, entrystop, flatten=flatten)
+        self._cache = cache
+        self._fileid = fileid
+
+    def column_key(self, key):
+        '''Cache key of a branch for the entry range of this data frame'''
+        return self._cache.key(
+                               file=self._fileid,
+                               tree=self._tree.name.decode('utf-8'),
+                               branch=key,
+                               entrystart=self._branchargs['entrystart'],
+                               entrystop=self._branchargs['entrystop'],
+                               flatten=self._branchargs['flatten'],
+                               )
+
+    def __getitem__(self, key):
+        if key in self._dict:
+            return self._dict[key]
+        elif key in self._tree:
+            ckey = self.column_key(key)
+            with timed('columncache'):
+                array = self._cache.get(ckey)
+            if array is None:
+                array = self._tree[key].array(**self._branchargs)
+                with timed('columncache'):
+                    self._cache.put(ckey, array)
+            self._materialized.add(key)
+            self._dict[key] = array
+            return array
+        else:
+            raise KeyError(key)
@@ -0,0 +1,141 @@
+"""Column manifests and coalesced prefetching of the branches a processor reads"""
+
+import os
+from collections import defaultdict
+
+import numpy as np
+import uproot
+
+from bucoffea.helpers.dataset import is_data
+from bucoffea.processor.store import ProcessorStore
+
+pjoin = os.path.join
+
+# Limits of a single XRootD vector read request
+VECTOR_READ_MAXCHUNKS = 1024
+VECTOR_READ_MAXBYTES = 2097136
+
+def dataset_kind(dataset):
+    '''Data and MC read different branches, e.g. no generator information in data'''
+    return 'data' if is_data(dataset) else 'mc'
+
+class ColumnManifest(ProcessorStore):
+    '''
+    Branches read by a processor, per dataset kind.
+
+    The manifest is recorded from the columns that are
+    materialized while processing. The default one of a
+    processor is kept in BUCOFFEA_COLUMN_MANIFEST_DIR, unless
+    the processor has a column_manifest attribute.
+    '''
+    dirname = 'columns'
+    envvar = 'BUCOFFEA_COLUMN_MANIFEST_DIR'
+    attribute = 'column_manifest'
+
+    def _load(self, content):
+        return {k : sorted(v) for k, v in content.items()}
+
+    @property
+    def columns(self):
+        return self.content
+
+    def get(self, kind):
+        return self.content.get(kind, [])
+
+    def record(self, kind, columns):
+        """Adds columns to the manifest
+
+        :return: True if the manifest changed
+        :rtype: bool
+        """
+        known = set(self.get(kind))
+        if set(columns) <= known:
+            return False
+        self.content[kind] = sorted(known | set(columns))
+        return True
+
+def basket_ranges(tree, branches, entrystart, entrystop):
+    """Byte ranges of all baskets needed to read branches in an entry range
+
+    :return: Sorted list of (offset, length) tuples
+    :rtype: list
+    """
+    ranges = []
+    for name in branches:
+        try:
+            branch = tree[name]
+        except KeyError:
+            continue
+        basketstart, basketstop = branch._basketstartstop(entrystart, entrystop)
+        if basketstart is None:
+            continue
+        # Recovered baskets are held in memory and need no reading
+        for i in range(basketstart, min(basketstop, branch._numgoodbaskets)):
+            ranges.append((int(branch._fBasketSeek[i]), int(branch._fBasketBytes[i])))
+    return sorted(ranges)
+
+def prefetch(source, ranges):
+    """Reads byte ranges into the chunk cache of an XRootD source
+
+    The chunks covering all ranges that are not cached yet are requested
+    with as few vector reads as possible, instead of one read per chunk
+    as the branches are accessed. Other sources are left alone, since
+    local reads gain nothing from this. At most as many bytes as the cache
+    holds are prefetched, the remainder is read on demand as usual.
+
+    :param source: Source of the file the ranges refer to
+    :type source: uproot.source.source.Source
+    :param ranges: Tuples of (offset, length)
+    :type ranges: list
+    :return: Number of bytes read
+    :rtype: int
+    """
+    if not isinstance(source, uproot.source.xrootd.XRootDSource):
+        return 0
+
+    chunkbytes = source._chunkbytes
+    needed = set()
+    for offset, length in ranges:
+        needed.update(range(offset // chunkbytes, (offset + max(length, 1) - 1) // chunkbytes + 1))
+
+    missing = []
+    for chunkindex in sorted(needed):
+        try:
+            source.cache[chunkindex]
+        except KeyError:
+            missing.append(chunkindex)
+    if source._limitbytes is not None:
+        missing = missing[:source._limitbytes // chunkbytes]
+    if not missing:
+        return 0
+
+    source._open()
+    size = source.size()
+    timeout = int(0 if source.timeout is None else source.timeout)
+
+    # Chunks above the size limit of a vector read element are split
+    requests = []
+    for chunkindex in missing:
+        start = chunkindex * chunkbytes
+        stop = min(start + chunkbytes, size)
+        for piece in range(start, stop, VECTOR_READ_MAXBYTES):
+            requests.append((chunkindex, piece, min(VECTOR_READ_MAXBYTES, stop - piece)))
+
+    pieces = defaultdict(list)
+    for istart in range(0, len(requests), VECTOR_READ_MAXCHUNKS):
+        batch = requests[istart:istart + VECTOR_READ_MAXCHUNKS]
+        status, response = source._source.vector_read(
+                                                       chunks=[(offset, length) for _, offset, length in batch],
+                                                       timeout=timeout
+                                                       )
+        if status.get("error", None):
+            raise OSError(status["message"])
+        for (chunkindex, _, _), chunk in zip(batch, response['chunks']):
+            pieces[chunkindex].append(chunk['buffer'])
+
+    nbytes = 0
+    for chunkindex in missing:
+        data = b''.join(pieces[chunkindex])
+        source.cache[chunkindex] = np.frombuffer(data, dtype=np.uint8)
+        nbytes += len(data)
+    return nbytes
@@ -25,7 +25,13 @@ from coffea.processor.accumulator import (
 from coffea.processor.dataframe import (
     LazyDataFrame,
 )
-from coffea.processor.executor import _normalize_fileset, _get_metadata, dask_executor
+from coffea.processor.executor import FileMeta, _normalize_fileset, dask_executor
+from bucoffea.helpers.helpers import evaluator_stats
+from bucoffea.helpers.profiling import timed, timing_difference, timing_stats
+from bucoffea.processor.columns import ColumnManifest, basket_ranges, dataset_kind, prefetch
+from bucoffea.processor.columncache import DEFAULT_MAXSIZE, ColumnCache, CachedLazyDataFrame, file_uuid, get_column_cache
+from bucoffea.processor.catalog import read_metadata
+from bucoffea.processor.chunking import ThroughputHistory, branches_key, dynamic_chunks, target_entries
 try:
     from collections.abc import Mapping, Sequence
 except ImportError:
@@ -44,9 +50,19 @@ if not hasattr(uproot.source.xrootd.XRootDSource, '_read_real'):
     uproot.source.xrootd.XRootDSource._read_real = uproot.source.xrootd.XRootDSource._read
     uproot.source.xrootd.XRootDSource._read = _read
 
+# instrument branch reading, including decompression and interpretation
+if not hasattr(uproot.tree.TBranchMethods, '_array_real'):
+    def _array(self, *args, **kwargs):
+        with timed('read/' + self.name.decode('utf-8')):
+            return self._array_real(*args, **kwargs)
+
+    uproot.tree.TBranchMethods._array_real = uproot.tree.TBranchMethods.array
+    uproot.tree.TBranchMethods.array = _array
+
 def _work_function_nanoaod(item, processor_instance, flatten=False, savemetrics=False,
                    mmap=False, nano=False, cachestrategy=None, skipbadfiles=False,
-                   retries=0, xrootdtimeout=None):
+                   retries=0, xrootdtimeout=None, columns=None, column_cache=None, column_cache_size=DEFAULT_MAXSIZE,
+                   profile=False, throughput=False):
     if processor_instance == 'heavy':
         item, processor_instance = item
     if not isinstance(processor_instance, ProcessorABC):
@@ -65,10 +81,13 @@ def _work_function_nanoaod(item, processor_instance, flatten=False, savemetrics=
     retry_count = 0
     while retry_count <= retries:
         try:
+            times_before = timing_stats()
             from uproot.source.xrootd import XRootDSource
             xrootdsource = XRootDSource.defaults
             xrootdsource['timeout'] = xrootdtimeout
-            file = uproot.open(item.filename, localsource=localsource, xrootdsource=xrootdsource)
+            with timed('open'):
+                file = uproot.open(item.filename, localsource=localsource, xrootdsource=xrootdsource)
+                tree = file[item.treename]
             if nano:
                 pass
                 # cache = None
@@ -93,47 +112,99 @@ def _work_function_nanoaod(item, processor_instance, flatten=False, savemetrics=
                 #     cache=cache,
                 # )
             else:
-                tree = file[item.treename]
-                df = LazyDataFrame(tree, item.entrystart, item.entrystop, flatten=flatten)
+                if column_cache:
+                    cache = get_column_cache(column_cache, column_cache_size)
+                    # The cache is shared with other chunks, count only this one
+                    hits, misses = cache.hits, cache.misses
+                    df = CachedLazyDataFrame(tree, cache, file_uuid(file), item.entrystart, item.entrystop, flatten=flatten)
+                else:
+                    cache = None
+                    df = LazyDataFrame(tree, item.entrystart, item.entrystop, flatten=flatten)
+
+                # Read the baskets of all branches the processor is known
+                # to use up front, rather than one branch at a time
+                prefetched = 0
+                if columns:
+                    branches = columns.get(dataset_kind(item.dataset), [])
+                    if cache:
+                        branches = [x for x in branches if df.column_key(x) not in cache]
+                    with timed('prefetch'):
+                        ranges = basket_ranges(tree, branches, item.entrystart, item.entrystop)
+                        prefetched = prefetch(file.source, ranges)
+                    if prefetched:
+                        file.source.bytesread = getattr(file.source, 'bytesread', 0) + prefetched
                 # For NanoAOD, we have to look at the "Runs" TTree for info such as weight sums
                 # The different cases in the loop represent the different formats and accordingly
                 # different ways of dealing with the provided values.
-                for name in map(lambda x: x.decode('utf-8'), file['Runs'].keys()):
-                    if name.startswith('n'):
-                        arr = file['Runs'][name].array()
-                        # Check that all instances are the same, then save that value
-                        tmp = set([])
-                        for entry in arr:
-                            tmp.add(entry)
-                        assert(len(tmp)==1)
-                        df[name] = list(tmp)[0]
-                    elif any([x in name for x in ['genEventSumw','genEventSumw2']]):
-                        arr = file['Runs'][name].array()
-                        # One entry per run -> just sum
-                        df[name] = int(item.entrystart==0) * arr.sum()
-                    elif any([x in name for x in ['LHEScaleSumw','LHEPdfSumw']]):
-                        # # Sum per variation, conserve number of variations
-                        # tmp = 0 * arr[0]
-                        # for i in range(len(arr)):
-                        #     for j in range(len(arr[i])):
-                        #         tmp[j] += arr[i][j]
-                        # df[name] = int(item.entrystart==0) * tmp
-                        pass
+                with timed('open'):
+                    for name in map(lambda x: x.decode('utf-8'), file['Runs'].keys()):
+                        if name.startswith('n'):
+                            arr = file['Runs'][name].array()
+                            # Check that all instances are the same, then save that value
+                            tmp = set([])
+                            for entry in arr:
+                                tmp.add(entry)
+                            assert(len(tmp)==1)
+                            df[name] = list(tmp)[0]
+                        elif any([x in name for x in ['genEventSumw','genEventSumw2']]):
+                            arr = file['Runs'][name].array()
+                            # One entry per run -> just sum
+                            df[name] = int(item.entrystart==0) * arr.sum()
+                        elif any([x in name for x in ['LHEScaleSumw','LHEPdfSumw']]):
+                            # # Sum per variation, conserve number of variations
+                            # tmp = 0 * arr[0]
+                            # for i in range(len(arr)):
+                            #     for j in range(len(arr[i])):
+                            #         tmp[j] += arr[i][j]
+                            # df[name] = int(item.entrystart==0) * tmp
+                            pass
 
                 ### END NANOAOD
                 df['dataset'] = item.dataset
                 df['filename'] = item.filename
+                df['entrystart'] = item.entrystart
+                df['entrystop'] = item.entrystop
+            stats_before = evaluator_stats()
             tic = time.time()
-            out = processor_instance.process(df)
+            with timed('process'):
+                out = processor_instance.process(df)
             toc = time.time()
+            stats_after = evaluator_stats()
             metrics = dict_accumulator()
+            if columns is not None:
+                # Report columns missing from the manifest, so that it can be updated
+                kind = dataset_kind(item.dataset)
+                if not df.materialized <= set(columns.get(kind, [])):
+                    metrics['manifest'] = dict_accumulator({kind : set_accumulator(df.materialized)})
             if savemetrics:
                 if isinstance(file.source, uproot.source.xrootd.XRootDSource):
                     metrics['bytesread'] = value_accumulator(int, file.source.bytesread)
                     metrics['dataservers'] = set_accumulator({file.source._source.get_property('DataServer')})
                 metrics['columns'] = set_accumulator(df.materialized)
+                metrics['prefetchbytes'] = value_accumulator(int, prefetched)
+                metrics['columncache_hits'] = value_accumulator(int, cache.hits - hits if cache else 0)
+                metrics['columncache_misses'] = value_accumulator(int, cache.misses - misses if cache else 0)
                 metrics['entries'] = value_accumulator(int, df.size)
                 metrics['processtime'] = value_accumulator(float, toc - tic)
+                for name, dtype in [('hits', int), ('diskhits', int), ('builds', int), ('buildtime', float)]:
+                    metrics[f'evaluator_{name}'] = value_accumulator(dtype, stats_after[name] - stats_before[name])
+            if throughput:
+                metrics['throughput'] = dict_accumulator({
+                    dataset_kind(item.dataset) : dict_accumulator({
+                        'entries' : value_accumulator(int, df.size),
+                        'time' : value_accumulator(float, toc - tic),
+                    })
+                })
+            if profile:
+                # Time per processing step, branch and dataset
+                times = timing_difference(times_before, timing_stats())
+                metrics['profile'] = dict_accumulator({
+                    item.dataset : dict_accumulator({
+                        'chunks' : value_accumulator(int, 1),
+                        'entries' : value_accumulator(int, df.size),
+                        'times' : dict_accumulator({k : value_accumulator(float, v) for k, v in times.items()}),
+                    })
+                })
             wrapped_out = dict_accumulator({'out': out, 'metrics': metrics})
             file.source.close()
             break
@@ -158,8 +229,13 @@ def _work_function_nanoaod(item, processor_instance, flatten=False, savemetrics=
                 metrics['bytesread'] = value_accumulator(int, 0)
                 metrics['dataservers'] = set_accumulator({})
                 metrics['columns'] = set_accumulator({})
+                metrics['prefetchbytes'] = value_accumulator(int, 0)
+                metrics['columncache_hits'] = value_accumulator(int, 0)
+                metrics['columncache_misses'] = value_accumulator(int, 0)
                 metrics['entries'] = value_accumulator(int, 0)
                 metrics['processtime'] = value_accumulator(float, 0)
+                for name, dtype in [('hits', int), ('diskhits', int), ('builds', int), ('buildtime', float)]:
+                    metrics[f'evaluator_{name}'] = value_accumulator(dtype, 0)
             wrapped_out = dict_accumulator({'out': out, 'metrics': metrics})
         except Exception as e:
             if retries == retry_count:
@@ -170,6 +246,41 @@ def _work_function_nanoaod(item, processor_instance, flatten=False, savemetrics=
 
     return wrapped_out
 
+def _get_metadata_nanoaod(item, skipbadfiles=False, retries=0, xrootdtimeout=None, align_clusters=False, columns=None):
+    '''Like coffea's _get_metadata, also storing the uncompressed size per event'''
+    import warnings
+    out = set_accumulator()
+    retry_count = 0
+    while retry_count <= retries:
+        try:
+            # Count the branches the processor reads, if known
+            branches = columns.get(dataset_kind(item.dataset)) if columns else None
+            # Clusters are always stored, so that cached metadata can be used with aligned chunks
+            metadata = read_metadata(item.filename, item.treename, branches=branches, xrootdtimeout=xrootdtimeout)
+            out = set_accumulator([FileMeta(item.dataset, item.filename, item.treename, metadata)])
+            break
+        except OSError as e:
+            if not skipbadfiles:
+                raise e
+            else:
+                w_str = 'Bad file source %s.' % item.filename
+                if retries:
+                    w_str += ' Attempt %d of %d.' % (retry_count + 1, retries + 1)
+                    if retry_count + 1 < retries:
+                        w_str += ' Will retry.'
+                    else:
+                        w_str += ' Skipping.'
+                else:
+                    w_str += ' Skipping.'
+                warnings.warn(w_str)
+        except Exception as e:
+            if retries == retry_count:
+                raise e
+            w_str = 'Attempt %d of %d. Will retry.' % (retry_count + 1, retries + 1)
+            warnings.warn(w_str)
+        retry_count += 1
+    return out
+
 def run_uproot_job_nanoaod(fileset,
                    treename,
                    processor_instance,
@@ -209,7 +320,28 @@ def run_uproot_job_nanoaod(fileset,
             'savemetrics' saves some detailed metrics for xrootd processing (default False);
             'flatten' removes any jagged structure from the input files (default False);
             'processor_compression' sets the compression level used to send processor instance
-            to workers (default 1).
+            to workers (default 1);
+            'chunkbytes' and 'chunktime' enable dynamic chunking: Chunks are aligned to the
+            clusters of the tree, and hold as many entries as fit into the given number of
+            uncompressed bytes read, or into the given processing time in seconds estimated from
+            previous runs, but never more than chunksize (default None). The bytes read are
+            counted for the branches in the column manifest if there is one, or for all branches;
+            'throughput_history' is the file with the processing rates measured in previous runs
+            used with 'chunktime', defaults to the one of the processor in the
+            BUCOFFEA_THROUGHPUT_DIR directory;
+            'column_manifest' enables prefetching the branches recorded in the column manifest
+            and records the branches read in addition, can be True to use the default manifest
+            of the processor or a path to the manifest (default False);
+            'save_history' writes the branches read and the measured processing rates back
+            to the column manifest and throughput history, can be disabled where these files
+            are only copies, e.g. on batch workers (default True);
+            'profile' records the time spent per processing step and branch in the metrics,
+            see bucoffea.helpers.profiling (default False);
+            'column_cache' keeps the decompressed branches on local disk and reads them from
+            there in later runs over the same files, can be True to use the default directory
+            or a path to the cache directory (default False);
+            'column_cache_size' is the maximum size of the column cache in bytes, the least
+            recently used columns are removed beyond that (default 50 GB).
         pre_executor : callable
             A function like executor, used to calculate fileset metadata
             Defaults to executor
@@ -225,6 +357,7 @@ def run_uproot_job_nanoaod(fileset,
             determine chunking.  Defaults to a in-memory LRU cache that holds 100k entries
             (about 1MB depending on the length of filenames, etc.)  If you edit an input file
             (please don't) during a session, the session can be restarted to clear the cache.
+            A bucoffea.processor.catalog.FileCatalog keeps the metadata on disk for later runs.
     '''
     if not isinstance(fileset, (Mapping, str)):
         raise ValueError("Expected fileset to be a mapping dataset: list(files) or filename")
@@ -242,22 +375,59 @@ def run_uproot_job_nanoaod(fileset,
     for filemeta in fileset:
         filemeta.maybe_populate(metadata_cache)
 
+    column_manifest = executor_args.pop('column_manifest', False)
+    if column_manifest is True:
+        manifest = ColumnManifest.for_processor(processor_instance)
+    elif column_manifest:
+        manifest = ColumnManifest(column_manifest)
+    else:
+        manifest = None
+    save_history = executor_args.pop('save_history', True)
+
     # pop _get_metdata args here (also sent to _work_function)
     skipbadfiles = executor_args.pop('skipbadfiles', False)
     retries = executor_args.pop('retries', 0)
     xrootdtimeout = executor_args.pop('xrootdtimeout', None)
     align_clusters = executor_args.pop('align_clusters', False)
-    metadata_fetcher = partial(_get_metadata,
+    chunkbytes = executor_args.pop('chunkbytes', None)
+    chunktime = executor_args.pop('chunktime', None)
+    dynamic = bool(chunkbytes or chunktime)
+    if dynamic:
+        align_clusters = True
+    throughput_history = executor_args.pop('throughput_history', None)
+    if not chunktime:
+        throughput = None
+    elif throughput_history:
+        throughput = ThroughputHistory(throughput_history)
+    else:
+        throughput = ThroughputHistory.for_processor(processor_instance)
+    metadata_fetcher = partial(_get_metadata_nanoaod,
                                skipbadfiles=skipbadfiles,
                                retries=retries,
                                xrootdtimeout=xrootdtimeout,
                                align_clusters=align_clusters,
+                               columns=manifest.columns if manifest else None,
                                )
 
+    def populated(filemeta):
+        if not filemeta.populated(clusters=align_clusters):
+            return False
+        if not chunkbytes:
+            return True
+        # The event size has to count the same branches that are read
+        branches = manifest.columns.get(dataset_kind(filemeta.dataset)) if manifest else None
+        return 'eventbytes' in filemeta.metadata and filemeta.metadata.get('eventbranches') == branches_key(branches)
+
+    def file_chunks(filemeta):
+        if not dynamic:
+            return filemeta.chunks(chunksize, align_clusters)
+        rate = throughput.rate(dataset_kind(filemeta.dataset)) if throughput else None
+        return dynamic_chunks(filemeta, target_entries(filemeta.metadata, chunksize, chunkbytes, chunktime, rate))
+
     chunks = []
     if maxchunks is None:
         # this is a bit of an abuse of map-reduce but ok
-        to_get = set(filemeta for filemeta in fileset if not filemeta.populated(clusters=align_clusters))
+        to_get = set(filemeta for filemeta in fileset if not populated(filemeta))
         if len(to_get) > 0:
             out = set_accumulator()
             pre_arg_override = {
@@ -269,16 +439,15 @@ def run_uproot_job_nanoaod(fileset,
             }
             pre_args.update(pre_arg_override)
             pre_executor(to_get, metadata_fetcher, out, **pre_args)
-            while out:
-                item = out.pop()
-                metadata_cache[item] = item.metadata
+            # Stored all at once, which is faster for persistent caches
+            metadata_cache.update({item : item.metadata for item in out})
             for filemeta in fileset:
                 filemeta.maybe_populate(metadata_cache)
         while fileset:
             filemeta = fileset.pop()
-            if skipbadfiles and not filemeta.populated(clusters=align_clusters):
+            if skipbadfiles and not populated(filemeta):
                 continue
-            for chunk in filemeta.chunks(chunksize, align_clusters):
+            for chunk in file_chunks(filemeta):
                 chunks.append(chunk)
     else:
         # get just enough file info to compute chunking
@@ -287,12 +456,12 @@ def run_uproot_job_nanoaod(fileset,
             filemeta = fileset.pop()
             if nchunks[filemeta.dataset] >= maxchunks:
                 continue
-            if not filemeta.populated(clusters=align_clusters):
+            if not populated(filemeta):
                 filemeta.metadata = metadata_fetcher(filemeta).pop().metadata
                 metadata_cache[filemeta] = filemeta.metadata
-            if skipbadfiles and not filemeta.populated(clusters=align_clusters):
+            if skipbadfiles and not populated(filemeta):
                 continue
-            for chunk in filemeta.chunks(chunksize, align_clusters):
+            for chunk in file_chunks(filemeta):
                 chunks.append(chunk)
                 nchunks[filemeta.dataset] += 1
                 if nchunks[filemeta.dataset] >= maxchunks:
@@ -305,6 +474,11 @@ def run_uproot_job_nanoaod(fileset,
     nano = executor_args.pop('nano', False)
     cachestrategy = executor_args.pop('cachestrategy', None)
     pi_compression = executor_args.pop('processor_compression', 1)
+    column_cache = executor_args.pop('column_cache', False)
+    column_cache_size = executor_args.pop('column_cache_size', DEFAULT_MAXSIZE)
+    profile = executor_args.pop('profile', False)
+    if column_cache is True:
+        column_cache = ColumnCache().cachedir
     if pi_compression is None:
         pi_to_send = processor_instance
     else:
@@ -319,6 +493,11 @@ def run_uproot_job_nanoaod(fileset,
         skipbadfiles=skipbadfiles,
         retries=retries,
         xrootdtimeout=xrootdtimeout,
+        columns=manifest.columns if manifest else None,
+        column_cache=column_cache,
+        column_cache_size=column_cache_size,
+        profile=profile,
+        throughput=throughput is not None,
     )
     # hack around dask/dask#5503 which is really a silly request but here we are
     if executor is dask_executor:
@@ -336,6 +515,26 @@ def run_uproot_job_nanoaod(fileset,
     exe_args.update(executor_args)
     executor(chunks, closure, wrapped_out, **exe_args)
     wrapped_out['metrics']['chunks'] = value_accumulator(int, len(chunks))
+
+    # The workers only prune after writing a few percent of the
+    # maximum size, so make sure the limit holds after every run
+    if column_cache:
+        ColumnCache(column_cache, column_cache_size).prune()
+
+    # Columns that were read, but not prefetched
+    recorded = wrapped_out['metrics'].pop('manifest', {})
+    if manifest is not None:
+        changed = [manifest.record(kind, cols) for kind, cols in recorded.items()]
+        if any(changed) and save_history:
+            manifest.save()
+
+    # Measured processing rate, used to size the chunks of later runs
+    measured = wrapped_out['metrics'].pop('throughput', {})
+    if throughput is not None and measured:
+        for kind, m in measured.items():
+            throughput.record(kind, m['entries'].value, m['time'].value)
+        if save_history:
+            throughput.save()
     processor_instance.postprocess(out)
     if savemetrics:
         return out, wrapped_out['metrics']
@@ -0,0 +1,69 @@
+"""Information about a processor kept across runs, per dataset kind"""
+
+import json
+import os
+
+from bucoffea.helpers.diskcache import cache_path, write_atomic
+
+pjoin = os.path.join
+
+class ProcessorStore(object):
+    '''
+    Base class of the information kept per processor and dataset kind,
+    e.g. the column manifest, stored as JSON.
+
+    Subclasses set the default directory below ~/.cache/bucoffea and
+    the environment variable to set a different one, see for_processor.
+    '''
+    dirname = None
+    envvar = None
+    # Processor attribute that can give the path instead
+    attribute = None
+
+    def __init__(self, path):
+        """
+        :param path: JSON file holding the content
+        :type path: str
+        """
+        self.path = path
+        self.content = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.content = self._load(json.load(f))
+
+    def _load(self, content):
+        return content
+
+    @classmethod
+    def default_dir(cls):
+        return cache_path(cls.dirname, cls.envvar)
+
+    @classmethod
+    def for_processor(cls, processor):
+        '''The file of a processor instance or class, named after the class'''
+        path = getattr(processor, cls.attribute, None) if cls.attribute else None
+        if path is None:
+            name = processor.__name__ if isinstance(processor, type) else type(processor).__name__
+            path = pjoin(cls.default_dir(), f'{name}.json')
+        return cls(path)
+
+    def export(self, path, kinds=None):
+        """Copies the content into a new file, e.g. to send it along with jobs
+
+        :param path: JSON file to write
+        :type path: str
+        :param kinds: Dataset kinds to copy, defaults to all
+        :type kinds: list, optional
+        :return: The new copy
+        """
+        copy = type(self)(path)
+        copy.content = {k : v for k, v in self.content.items() if kinds is None or k in kinds}
+        copy.save()
+        return copy
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(self.content, f, indent=1, sort_keys=True)
+        write_atomic(self.path, write)
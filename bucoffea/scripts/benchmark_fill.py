@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+import numpy as np
+from coffea.hist import Bin
+
+from bucoffea.helpers.config import ConfigCache
+from bucoffea.helpers.histogram import FillPlan
+
+# Micro-benchmark for histogram filling.
+# Compares one Hist.fill call per histogram, with the columns
+# masked separately for every call, to the batched FillPlan,
+# using the real histogram definitions and a synthetic chunk.
+
+def parse_commandline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processor', type=str, default='monojet', choices=['monojet','vbfhinv'], help='Processor to take the histogram definitions from.')
+    parser.add_argument('--era', type=str, default='era2017', help='Configuration environment to use.')
+    parser.add_argument('--events', type=int, default=100000, help='Number of events per chunk.')
+    parser.add_argument('--regions', type=int, default=20, help='Number of regions to fill.')
+    parser.add_argument('--efficiency', type=float, default=0.3, help='Fraction of events passing each region selection.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions per method.')
+    args = parser.parse_args()
+    return args
+
+def get_accumulator(args):
+    if args.processor == 'monojet':
+        from bucoffea.monojet.definitions import monojet_accumulator
+        cfg = ConfigCache("config/monojet.yaml", preload=False).get(args.era)
+        return monojet_accumulator(cfg)
+    from bucoffea.vbfhinv.definitions import vbfhinv_accumulator
+    cfg = ConfigCache("config/vbfhinv.yaml", preload=False).get(args.era)
+    return vbfhinv_accumulator(cfg)
+
+def fillable_histograms(accumulator):
+    '''Histograms with dataset and region axes and otherwise only binned axes'''
+    names = []
+    for name, hist in accumulator.items():
+        axes = [ax.name for ax in getattr(hist, '_axes', ())]
+        if set(axes[:2]) != {'dataset', 'region'}:
+            continue
+        if all(isinstance(ax, Bin) for ax in hist._axes if ax.name not in ('dataset','region')):
+            names.append(name)
+    return names
+
+def make_chunk(accumulator, names, nevents):
+    '''One random column per axis name, like e.g. recoil used by many histograms'''
+    columns = {}
+    for name in names:
+        for ax in accumulator[name].dense_axes():
+            if ax.name in columns:
+                continue
+            edges = ax.edges()
+            lo, hi = edges[0], edges[-1]
+            columns[ax.name] = lo + (hi - lo) * np.random.random(nevents)
+    columns['weight'] = np.random.random(nevents)
+    return columns
+
+def per_call(output, names, columns, masks):
+    for region, mask in masks.items():
+        for name in names:
+            hist = output[name]
+            values = {ax.name : columns[ax.name][mask] for ax in hist.dense_axes()}
+            hist.fill(dataset='benchmark', region=region, weight=columns['weight'][mask], **values)
+
+def batched(output, names, columns, masks):
+    fills = FillPlan(output, dataset='benchmark')
+    for region, mask in masks.items():
+        masked = {key : value[mask] for key, value in columns.items()}
+        for name in names:
+            values = {ax.name : masked[ax.name] for ax in output[name].dense_axes()}
+            fills.add(name, region=region, weight=masked['weight'], **values)
+    fills.execute()
+
+def main():
+    args = parse_commandline()
+    accumulator = get_accumulator(args)
+    names = fillable_histograms(accumulator)
+    columns = make_chunk(accumulator, names, args.events)
+    masks = {f'region{i}' : np.random.random(args.events) < args.efficiency for i in range(args.regions)}
+    print(f"{len(names)} histograms, {len(columns)-1} distinct columns, {len(masks)} regions, {args.events} events.")
+
+    results = {}
+    for method_name, method in [
+                        ('per-call fill', per_call),
+                        ('fill plan', batched),
+                        ]:
+        times = []
+        for _ in range(args.repeat):
+            output = accumulator.identity()
+            tic = time.time()
+            method(output, names, columns, masks)
+            times.append(time.time() - tic)
+        results[method_name] = output
+        print(f"{method_name:15s}: {1e3*np.mean(times):8.1f} +- {1e3*np.std(times):.1f} ms per chunk")
+
+    reference = results['per-call fill']
+    for output in results.values():
+        for name in names:
+            for key, sumw in reference[name]._sumw.items():
+                assert np.allclose(sumw, output[name]._sumw[key])
+                assert np.allclose(reference[name]._sumw2[key], output[name]._sumw2[key])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+import numpy as np
+from coffea.analysis_objects import JaggedCandidateArray
+
+from bucoffea.helpers import dphi, object_overlap
+
+# Micro-benchmark for overlap removal.
+# Compares the cross product implementation, which builds
+# the delta R of all candidate pairs, to the compiled kernel,
+# cleaning jets against muons, electrons and photons
+# in a synthetic NanoAOD-like chunk.
+
+def parse_commandline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=100000, help='Number of events per chunk.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions per method.')
+    parser.add_argument('--dr', type=float, default=0.4, help='Delta R parameter.')
+    args = parser.parse_args()
+    return args
+
+def make_candidates(nevents, mean):
+    '''Candidates with Poisson distributed multiplicity and random directions'''
+    counts = np.random.poisson(mean, nevents)
+    n = counts.sum()
+    return JaggedCandidateArray.candidatesfromcounts(
+        counts,
+        pt=(20 + 100 * np.random.exponential(size=n)).astype(np.float32),
+        eta=np.random.uniform(-2.5, 2.5, n).astype(np.float32),
+        phi=np.random.uniform(-np.pi, np.pi, n).astype(np.float32),
+        mass=np.zeros(n, dtype=np.float32),
+    )
+
+def cross_product_overlap(toclean, cleanagainst, dr=0.4):
+    '''Previous implementation of object_overlap'''
+    comb_phi = toclean.phi.cross(cleanagainst.phi, nested=True)
+    comb_eta = toclean.eta.cross(cleanagainst.eta, nested=True)
+    delta_r = np.hypot( dphi(comb_phi.i0, comb_phi.i1), comb_eta.i0-comb_eta.i1)
+    return delta_r.min() > dr
+
+def cross_product(ak4, others, dr):
+    mask = ak4.pt > 0
+    for other in others:
+        mask = mask & cross_product_overlap(ak4, other, dr=dr)
+    return mask
+
+def kernel(ak4, others, dr):
+    return object_overlap(ak4, others, dr=dr)
+
+def main():
+    args = parse_commandline()
+    ak4 = make_candidates(args.events, 6)
+    others = [make_candidates(args.events, mean) for mean in (1.0, 1.0, 0.5)]
+    print(f"{args.events} events, {ak4.counts.sum()} jets cleaned against {sum(x.counts.sum() for x in others)} leptons and photons.")
+
+    # Compile the kernel before timing
+    kernel(ak4[:10], [x[:10] for x in others], args.dr)
+
+    reference = cross_product(ak4, others, args.dr)
+    for name, method in [
+                        ('cross product', cross_product),
+                        ('compiled kernel', kernel),
+                        ]:
+        times = []
+        for _ in range(args.repeat):
+            tic = time.time()
+            mask = method(ak4, others, args.dr)
+            times.append(time.time() - tic)
+
+        assert np.all(mask.counts == reference.counts)
+        assert np.all(mask.flatten() == reference.flatten())
+        print(f"{name:15s}: {1e3*np.mean(times):8.1f} +- {1e3*np.std(times):.1f} ms per chunk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+import numpy as np
+from coffea import processor
+
+from bucoffea.helpers.config import ConfigCache
+from bucoffea.helpers.cutflow import SelectionPlanner, cumulative_cutflow
+
+# Micro-benchmark for the evaluation of region masks and cutflows.
+# Compares the per-region evaluation of every cut prefix with
+# the running-AND cutflow and the shared-prefix planner,
+# using the real region definitions and random cut decisions.
+
+def parse_commandline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processor', type=str, default='monojet', choices=['monojet','vbfhinv'], help='Processor to take the region definitions from.')
+    parser.add_argument('--era', type=str, default='era2017', help='Configuration environment to use.')
+    parser.add_argument('--events', type=int, default=100000, help='Number of events per chunk.')
+    parser.add_argument('--efficiency', type=float, default=0.9, help='Probability for an event to pass each cut.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions per method.')
+    args = parser.parse_args()
+    return args
+
+def get_regions(args):
+    if args.processor == 'monojet':
+        from bucoffea.monojet.definitions import monojet_regions
+        cfg = ConfigCache("config/monojet.yaml", preload=False).get(args.era)
+        return monojet_regions(cfg)
+    from bucoffea.vbfhinv.definitions import vbfhinv_regions
+    cfg = ConfigCache("config/vbfhinv.yaml", preload=False).get(args.era)
+    return vbfhinv_regions(cfg)
+
+def make_selection(regions, nevents, efficiency):
+    names = []
+    for cuts in regions.values():
+        for cut in cuts:
+            if cut not in names:
+                names.append(cut)
+    selection = processor.PackedSelection()
+    for name in names:
+        selection.add(name, np.random.random(nevents) < efficiency)
+    return selection
+
+def per_region_prefixes(selection, regions):
+    results = {}
+    for region, cuts in regions.items():
+        counts = [selection.all(*cuts[:icut+1]).sum() for icut in range(len(cuts))]
+        results[region] = (selection.all(*cuts), counts)
+    return results
+
+def per_region_cumulative(selection, regions):
+    results = {}
+    for region, cuts in regions.items():
+        mask, counts, _ = cumulative_cutflow(selection, cuts)
+        results[region] = (mask, counts)
+    return results
+
+def planner(selection, regions):
+    return SelectionPlanner(regions).evaluate(selection)
+
+def main():
+    args = parse_commandline()
+    regions = get_regions(args)
+    selection = make_selection(regions, args.events, args.efficiency)
+
+    ncuts = sum(len(cuts) for cuts in regions.values())
+    nnodes = SelectionPlanner(regions).nodes()
+    print(f"{len(regions)} regions, {len(selection.names)} distinct cuts, {ncuts} cuts in total, {nnodes} cuts after prefix sharing.")
+
+    reference = per_region_prefixes(selection, regions)
+    for name, method in [
+                        ('per-region prefixes', per_region_prefixes),
+                        ('running AND', per_region_cumulative),
+                        ('shared-prefix planner', planner),
+                        ]:
+        times = []
+        for _ in range(args.repeat):
+            tic = time.time()
+            results = method(selection, regions)
+            times.append(time.time() - tic)
+
+        for region in regions:
+            assert np.all(results[region][0] == reference[region][0])
+            assert list(results[region][1]) == list(reference[region][1])
+        print(f"{name:25s}: {1e3*np.mean(times):8.1f} +- {1e3*np.std(times):.1f} ms per chunk")
+
+
+if __name__ == "__main__":
+    main()
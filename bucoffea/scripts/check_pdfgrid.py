@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+import numpy as np
+from tabulate import tabulate
+
+from bucoffea.gen.pdfWeightProcessor import setup_pdf_objs
+from bucoffea.gen.pdfgrid import PIDS, load_pdf_grid
+
+# Compares the tabulated PDF grids used for reweighting
+# to LHAPDF itself, at random (parton, x, Q2) points within
+# the range of the grid. Needs the lhapdf python bindings.
+
+def parse_commandline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdfs', type=int, nargs='+', help='LHAPDF IDs of the PDF set members to check.')
+    parser.add_argument('--points', type=int, default=100000, help='Number of random points per PDF.')
+    parser.add_argument('--tolerance', type=float, default=1e-2, help='Maximum allowed relative deviation for x below 0.5.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random points.')
+    args = parser.parse_args()
+    return args
+
+def random_points(grid, n, rng):
+    '''Random points, log-uniform in x and Q2, including partons not in the grid'''
+    pid = rng.choice(PIDS + [22], n)
+    x = np.exp(rng.uniform(np.log(grid.x[0]), np.log(grid.x[-1]), n))
+    q2 = np.exp(rng.uniform(np.log(grid.q2[0]), np.log(grid.q2[-1]), n))
+    return pid, x, q2
+
+def main():
+    args = parse_commandline()
+    rng = np.random.RandomState(args.seed)
+    pdfs = setup_pdf_objs(args.pdfs)
+
+    table = []
+    failed = False
+    for pdf_id in args.pdfs:
+        grid = load_pdf_grid(pdf_id)
+        pid, x, q2 = random_points(grid, args.points, rng)
+        ours = grid.xfxQ2(pid, x, q2)
+        theirs = np.array([pdfs[pdf_id].xfxQ2(int(p), float(xx), float(qq)) for p, xx, qq in zip(pid, x, q2)])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deviation = np.abs(ours / theirs - 1)
+        deviation[(ours == 0) & (theirs == 0)] = 0
+        for name, mask in [
+                           ('x < 0.01', x < 0.01),
+                           ('0.01 < x < 0.5', (x >= 0.01) & (x < 0.5)),
+                           ('x > 0.5', x >= 0.5),
+                          ]:
+            table.append([pdf_id, name, np.count_nonzero(mask), np.median(deviation[mask]), np.percentile(deviation[mask], 99), np.max(deviation[mask])])
+        if np.max(deviation[x < 0.5]) > args.tolerance:
+            failed = True
+
+    print(tabulate(table, headers=['PDF', 'Range', 'Points', 'Median', '99%', 'Max'], floatfmt='.2e'))
+    if failed:
+        print(f'Relative deviation above {args.tolerance} found for x below 0.5.')
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,17 @@
 #!/usr/bin/env python
 import argparse
-import itertools
 import os
 import re
-import sys
 from collections import defaultdict
-from pprint import pprint
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import uproot
 from coffea.util import load
 from tqdm import tqdm
 
+from bucoffea.helpers.trees import MANIFEST, open_trees, tree_accumulators
+
 pjoin = os.path.join
 
 def files_by_dataset(filelist):
@@ -30,65 +30,136 @@ def files_by_dataset(filelist):
 
     return datasets
 
-def make_trees(args):
-
-
+def branch_dtype(array):
+    """Type of the branch to store an array in
+
+    ROOT files written by uproot cannot hold half precision
+    floats, so these are stored as single precision.
+    """
+    if array.dtype == np.float16:
+        return np.dtype(np.float32)
+    return array.dtype
+
+def region_columns(acc):
+    """Non-empty columns of all tree accumulators, by region
+
+    :param acc: Output of a processor
+    :type acc: dict_accumulator
+    :return: Mapping from region to mapping from variable to array
+    :rtype: dict
+    """
+    columns = defaultdict(dict)
+    for treename in tree_accumulators(acc):
+        for region, variables in acc[treename].items():
+            for name, column in variables.items():
+                if len(column.value):
+                    columns[region][name] = column.value
+    return columns
+
+def find_tree_dir(fname, files):
+    """Directory holding the Parquet trees of a coffea file
+
+    Trees are written next to the coffea files, which
+    may since have been merged into a subdirectory.
+    """
+    for candidate in [os.path.dirname(fname), pjoin(os.path.dirname(fname), '..')]:
+        if all(os.path.exists(pjoin(candidate, x['path'])) for x in files):
+            return candidate
+    raise RuntimeError(f"Could not find the Parquet trees of {fname}, please specify --treedir.")
+
+def parquet_columns(files, treedir):
+    """Columns of the Parquet trees, in batches by region
+
+    :param files: Tree files as listed in the processor output
+    :type files: list
+    :param treedir: Directory the tree files are in
+    :type treedir: str
+    :return: Pairs of region and mapping from variable to array
+    :rtype: generator
+    """
+    for region in sorted(set(x['region'] for x in files)):
+        trees = open_trees(files, treedir, region=region)
+        variables = [x for x in trees.schema.names if x not in ['dataset', 'region']]
+        for batch in trees.to_batches(columns=variables):
+            if not batch.num_rows:
+                continue
+            missing = [k for k, v in zip(variables, batch.columns) if v.null_count]
+            if missing:
+                raise RuntimeError(f"Inconsistent variables for region {region}: {missing}")
+            yield region, {k : v.to_numpy(zero_copy_only=False) for k, v in zip(variables, batch.columns)}
+
+def file_columns(fname, treedir=None):
+    """Columns of the trees saved by a processor, in batches by region
+
+    :param fname: Coffea file to read
+    :type fname: str
+    :param treedir: Directory of the Parquet trees, defaults to the one of the coffea file
+    :type treedir: str, optional
+    :return: Pairs of region and mapping from variable to array
+    :rtype: generator
+    """
+    acc = load(fname)
+    yield from region_columns(acc).items()
+    files = acc.get(MANIFEST, [])
+    if files:
+        yield from parquet_columns(files, treedir if treedir else find_tree_dir(fname, files))
+
+def convert_dataset(dataset, files, outdir, treedir=None, progress=True):
+    """Writes the trees of one dataset into a ROOT file
+
+    Every input file is loaded once, and the columns of all regions
+    are appended to the respective trees right away. Branches keep
+    the type of the columns in the tree accumulators or Parquet files.
+
+    :param dataset: Name of the dataset
+    :type dataset: str
+    :param files: Coffea files of the dataset
+    :type files: list
+    :param outdir: Output directory
+    :type outdir: str
+    :param treedir: Directory of the Parquet trees, see file_columns
+    :type treedir: str, optional
+    :param progress: Show a progress bar
+    :type progress: bool, optional
+    :return: Path of the output file
+    :rtype: str
+    """
+    outpath = pjoin(outdir, f"tree_{dataset}.root")
+    branches = {}
+    with uproot.recreate(outpath, compression=uproot.ZLIB(4)) as f:
+        for fname in tqdm(files, desc=dataset, disable=not progress):
+            for region, d in file_columns(fname, treedir):
+                lengths = set(len(v) for v in d.values())
+                assert(len(lengths) == 1)
+
+                if region not in branches:
+                    branches[region] = {k : branch_dtype(v) for k, v in d.items()}
+                    f[region] = uproot.newtree(branches[region])
+                elif set(d) != set(branches[region]):
+                    raise RuntimeError(f"Inconsistent variables for region {region} in file {fname}: {sorted(set(d) ^ set(branches[region]))}")
+
+                # write
+                f[region].extend({k : v.astype(branches[region][k], copy=False) for k, v in d.items()})
+    return outpath
 
+def make_trees(args):
     filelists = files_by_dataset(args.files)
     # The output for each dataset will be written into a separate file
-    for dataset, files in filelists.items():
-        # Find region and branch names
-        datatypes = {}
-        tree_by_variable = {}
-        variables = []
-        regions = []
-
-        # Scout out what branches there are
-        for fname in files:
-            acc = load(fname)
-            
-            treenames = [x for x in map(str,acc.keys()) if x.startswith("tree")]
-
-            for tn in treenames:
-                datatype = tn.split("_")[-1]
-                for region in acc[tn].keys():
-                    vars = acc[tn][region].keys()
-                    regions.append(region)
-                    variables.extend(vars)
-                    for v in vars:
-                        datatypes[v] = np.float64 #getattr(np, datatype)
-                        tree_by_variable[v] = tn
-
-        # Combine
-        with uproot.recreate(pjoin(args.outdir, f"tree_{dataset}.root"),compression=uproot.ZLIB(4)) as f:
-            for region, fname in tqdm(list(itertools.product(set(regions), files)), desc=dataset):
-                    acc = load(fname)
-                    d = {x: acc[tree_by_variable[x]][region][x].value for x in variables}
-
-                    # Remove empty entries
-                    to_remove = []
-                    for k, v in d.items():
-                        if not len(v):
-                            to_remove.append(k)
-                    for k in to_remove:
-                        d.pop(k)
-
-                    if not len(d):
-                        continue
-                    if not (region in [re.sub(";.*","",x.decode("utf-8")) for x in f.keys()]):
-                        f[region] = uproot.newtree({x : np.float64 for x in d.keys()})
-
-                    lengths = set()
-                    for k,v in d.items():
-                        lengths.add(len(v))
-                    assert(len(lengths) == 1)
-                    # write
-                    f[region].extend(d)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as executor:
+            futures = [executor.submit(convert_dataset, dataset, files, args.outdir, args.treedir, False) for dataset, files in filelists.items()]
+            for future in tqdm(as_completed(futures), total=len(futures), desc='Datasets'):
+                future.result()
+    else:
+        for dataset, files in filelists.items():
+            convert_dataset(dataset, files, args.outdir, args.treedir)
 
 def commandline():
     parser = argparse.ArgumentParser(prog='Convert coffea files to TTrees.')
     parser.add_argument('files', type=str, nargs='+', help='Input folder to use.')
     parser.add_argument('--outdir', type=str, default='./trees', help='Output directory')
+    parser.add_argument('--treedir', type=str, default=None, help='Directory of the Parquet trees, defaults to the one of the input files.')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of datasets to convert in parallel.')
 
 
     args = parser.parse_args()
@@ -14,6 +14,7 @@ from bucoffea.helpers import object_overlap, sigmoid3
 from bucoffea.helpers.dataset import extract_year
 from bucoffea.helpers.paths import bucoffea_path
 from bucoffea.helpers.gen import find_first_parent
+from bucoffea.helpers.profiling import timed
 from bucoffea.monojet.definitions import accu_int, defaultdict_accumulator_of_empty_column_accumulator_float16, defaultdict_accumulator_of_empty_column_accumulator_int64,defaultdict_accumulator_of_empty_column_accumulator_bool
 from pprint import pprint
 
@@ -208,6 +209,7 @@ def vbfhinv_accumulator(cfg):
     items['tree_float16'] = processor.defaultdict_accumulator(defaultdict_accumulator_of_empty_column_accumulator_float16)
     items['tree_int64'] = processor.defaultdict_accumulator(defaultdict_accumulator_of_empty_column_accumulator_int64)
     items['tree_bool'] = processor.defaultdict_accumulator(defaultdict_accumulator_of_empty_column_accumulator_bool)
+    items['tree_files'] = processor.list_accumulator()
     return  processor.dict_accumulator(items)
 
 def vbfhinv_regions(cfg):
@@ -390,6 +392,7 @@ def vbfhinv_regions(cfg):
     
     return regions
 
+@timed('weights')
 def ak4_em_frac_weights(weights, diak4, evaluator):
     '''Apply SF for EM fraction cut on jets. Event weight = (Leading jet weight) * (Trailing jet weight)'''
     # Separate weights for the two leading jets:
@@ -426,6 +429,7 @@ def ak4_em_frac_weights(weights, diak4, evaluator):
 
     return weights
 
+@timed('weights')
 def met_trigger_sf(weights, diak4, df, apply_categorized=True):
     '''
     Data/MC SF for the MET trigger, determined as the ratio of 
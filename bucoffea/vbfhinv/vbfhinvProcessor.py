@@ -1,11 +1,8 @@
-import copy
 import coffea.processor as processor
 import re
 import numpy as np
-from dynaconf import settings as cfg
 
 from bucoffea.helpers import (
-                              bucoffea_path,
                               dphi,
                               evaluator_from_config,
                               mask_and,
@@ -37,9 +34,15 @@ from bucoffea.helpers.gen import (
                                   setup_lhe_cleaned_genjets,
                                   fill_gen_v_info
                                  )
+from bucoffea.helpers.config import ConfigCache
+from bucoffea.helpers.cutflow import SelectionPlanner
+from bucoffea.helpers.histogram import FillPlan
+from bucoffea.helpers.profiling import timed
+from bucoffea.helpers.trees import write_chunk_trees
 from bucoffea.helpers.weights import (
                                   get_veto_weights,
-                                  btag_weights
+                                  btag_weights,
+                                  LayeredWeights
                                  )
 from bucoffea.monojet.definitions import (
                                           candidate_weights,
@@ -59,6 +62,7 @@ from bucoffea.vbfhinv.definitions import (
                                            met_xy_correction
                                          )
 
+@timed('selection')
 def trigger_selection(selection, df, cfg):
     pass_all = np.zeros(df.size) == 0
     pass_none = ~pass_all
@@ -110,32 +114,26 @@ class vbfhinvProcessor(processor.ProcessorABC):
     def __init__(self, blind=False):
         self._year=None
         self._blind=blind
-        self._configure()
-        self._accumulator = vbfhinv_accumulator(cfg)
+        self._configs = ConfigCache("config/vbfhinv.yaml")
+        self._accumulator = vbfhinv_accumulator(self._configure())
 
     @property
     def accumulator(self):
         return self._accumulator
 
     def _configure(self, df=None):
-        cfg.DYNACONF_WORKS="merge_configs"
-        cfg.MERGE_ENABLED_FOR_DYNACONF=True
-        cfg.SETTINGS_FILE_FOR_DYNACONF = bucoffea_path("config/vbfhinv.yaml")
-
-        # Reload config based on year
+        # Pick the pre-resolved config based on year
         if df:
             dataset = df['dataset']
             self._year = extract_year(dataset)
             df["year"] = self._year
-            cfg.ENV_FOR_DYNACONF = f"era{self._year}"
-        else:
-            cfg.ENV_FOR_DYNACONF = f"default"
-        cfg.reload()
+            return self._configs.get(f"era{self._year}")
+        return self._configs.get("default")
 
     def process(self, df):
         if not df.size:
             return self.accumulator.identity()
-        self._configure(df)
+        cfg = self._configure(df)
         dataset = df['dataset']
         df['is_lo_w'] = is_lo_w(dataset)
         df['is_lo_z'] = is_lo_z(dataset)
@@ -462,13 +460,22 @@ class vbfhinvProcessor(processor.ProcessorABC):
 
         regions = vbfhinv_regions(cfg)
 
+        # Masks and cutflows for all regions,
+        # cuts shared between regions are only evaluated once
+        region_selections = SelectionPlanner(regions).evaluate(selection)
+
         # Get veto weights (only for MC)
         if not df['is_data']:
             veto_weights = get_veto_weights(df, cfg, evaluator, electrons, muons, taus)
         
+        # Products of the common weights, shared between regions
+        base_weight_cache = {}
+
+        # Histogram fills are collected and executed in batches
+        fills = FillPlan(output, dataset=dataset)
         for region, cuts in regions.items():
             exclude = [None]
-            region_weights = copy.deepcopy(weights)
+            region_weights = LayeredWeights(weights, base_weight_cache)
 
             if not df['is_data']:
                 ### Trigger weights
@@ -517,12 +524,11 @@ class vbfhinvProcessor(processor.ProcessorABC):
                 continue
 
             # Cutflow plot for signal and control regions
+            mask, cutflow_counts = region_selections[region]
             if any(x in region for x in ["sr", "cr", "tr"]):
                 output['cutflow_' + region][dataset]['all']+=df.size
-                for icut, cutname in enumerate(cuts):
-                    output['cutflow_' + region][dataset][cutname] += selection.all(*cuts[:icut+1]).sum()
-
-            mask = selection.all(*cuts)
+                for cutname, count in zip(cuts, cutflow_counts):
+                    output['cutflow_' + region][dataset][cutname] += count
 
             if cfg.RUN.SAVE.TREE:
                 if region in ['cr_1e_vbf','cr_1m_vbf']:
@@ -566,8 +572,8 @@ class vbfhinvProcessor(processor.ProcessorABC):
 
             # Multiplicities
             def fill_mult(name, candidates):
-                output[name].fill(
-                                  dataset=dataset,
+                fills.add(
+                                  name,
                                   region=region,
                                   multiplicity=candidates[mask].counts,
                                   weight=rweight[mask]
@@ -584,11 +590,19 @@ class vbfhinvProcessor(processor.ProcessorABC):
 
             def ezfill(name, **kwargs):
                 """Helper function to make filling easier."""
-                output[name].fill(
-                                  dataset=dataset,
-                                  region=region,
-                                  **kwargs
-                                  )
+                fills.add(name, region=region, **kwargs)
+
+            # Columns used by several histograms are only
+            # masked and binned once
+            ak4_masked = ak4[mask]
+            ak4_eta = ak4_masked.eta.flatten()
+            ak4_phi = ak4_masked.phi.flatten()
+            ak4_pt = ak4_masked.pt.flatten()
+            diak4_masked = diak4[mask]
+            diak4_i0 = diak4_masked.i0
+            diak4_i1 = diak4_masked.i1
+            recoil_masked = df['recoil_pt'][mask]
+            mjj_masked = df['mjj'][mask]
 
             # Monitor weights
             for wname, wvalue in region_weights._weights.items():
@@ -597,35 +611,35 @@ class vbfhinvProcessor(processor.ProcessorABC):
 
             # All ak4
             # This is a workaround to create a weight array of the right dimension
-            w_alljets = weight_shape(ak4[mask].eta, rweight[mask])
-            w_alljets_nopref = weight_shape(ak4[mask].eta, region_weights.partial_weight(exclude=exclude+['prefire'])[mask])
+            w_alljets = weight_shape(ak4_masked.eta, rweight[mask])
+            w_alljets_nopref = weight_shape(ak4_masked.eta, region_weights.partial_weight(exclude=exclude+['prefire'])[mask])
 
-            ezfill('ak4_eta',    jeteta=ak4[mask].eta.flatten(), weight=w_alljets)
-            ezfill('ak4_phi',    jetphi=ak4[mask].phi.flatten(), weight=w_alljets)
-            ezfill('ak4_pt',     jetpt=ak4[mask].pt.flatten(),   weight=w_alljets)
+            ezfill('ak4_eta',    jeteta=ak4_eta, weight=w_alljets)
+            ezfill('ak4_phi',    jetphi=ak4_phi, weight=w_alljets)
+            ezfill('ak4_pt',     jetpt=ak4_pt,   weight=w_alljets)
 
-            ezfill('ak4_eta_nopref',    jeteta=ak4[mask].eta.flatten(), weight=w_alljets_nopref)
-            ezfill('ak4_phi_nopref',    jetphi=ak4[mask].phi.flatten(), weight=w_alljets_nopref)
-            ezfill('ak4_pt_nopref',     jetpt=ak4[mask].pt.flatten(),   weight=w_alljets_nopref)
+            ezfill('ak4_eta_nopref',    jeteta=ak4_eta, weight=w_alljets_nopref)
+            ezfill('ak4_phi_nopref',    jetphi=ak4_phi, weight=w_alljets_nopref)
+            ezfill('ak4_pt_nopref',     jetpt=ak4_pt,   weight=w_alljets_nopref)
 
             # Leading ak4
-            w_diak4 = weight_shape(diak4.pt[mask], rweight[mask])
-            ezfill('ak4_eta0',      jeteta=diak4.i0.eta[mask].flatten(),    weight=w_diak4)
-            ezfill('ak4_phi0',      jetphi=diak4.i0.phi[mask].flatten(),    weight=w_diak4)
-            ezfill('ak4_pt0',       jetpt=diak4.i0.pt[mask].flatten(),      weight=w_diak4)
-            ezfill('ak4_ptraw0',    jetpt=diak4.i0.ptraw[mask].flatten(),   weight=w_diak4)
-            ezfill('ak4_chf0',      frac=diak4.i0.chf[mask].flatten(),      weight=w_diak4)
-            ezfill('ak4_nhf0',      frac=diak4.i0.nhf[mask].flatten(),      weight=w_diak4)
-            ezfill('ak4_nconst0',   nconst=diak4.i0.nconst[mask].flatten(), weight=w_diak4)
+            w_diak4 = weight_shape(diak4_masked.pt, rweight[mask])
+            ezfill('ak4_eta0',      jeteta=diak4_i0.eta.flatten(),    weight=w_diak4)
+            ezfill('ak4_phi0',      jetphi=diak4_i0.phi.flatten(),    weight=w_diak4)
+            ezfill('ak4_pt0',       jetpt=diak4_i0.pt.flatten(),      weight=w_diak4)
+            ezfill('ak4_ptraw0',    jetpt=diak4_i0.ptraw.flatten(),   weight=w_diak4)
+            ezfill('ak4_chf0',      frac=diak4_i0.chf.flatten(),      weight=w_diak4)
+            ezfill('ak4_nhf0',      frac=diak4_i0.nhf.flatten(),      weight=w_diak4)
+            ezfill('ak4_nconst0',   nconst=diak4_i0.nconst.flatten(), weight=w_diak4)
 
             # Trailing ak4
-            ezfill('ak4_eta1',      jeteta=diak4.i1.eta[mask].flatten(),    weight=w_diak4)
-            ezfill('ak4_phi1',      jetphi=diak4.i1.phi[mask].flatten(),    weight=w_diak4)
-            ezfill('ak4_pt1',       jetpt=diak4.i1.pt[mask].flatten(),      weight=w_diak4)
-            ezfill('ak4_ptraw1',    jetpt=diak4.i1.ptraw[mask].flatten(),   weight=w_diak4)
-            ezfill('ak4_chf1',      frac=diak4.i1.chf[mask].flatten(),      weight=w_diak4)
-            ezfill('ak4_nhf1',      frac=diak4.i1.nhf[mask].flatten(),      weight=w_diak4)
-            ezfill('ak4_nconst1',   nconst=diak4.i1.nconst[mask].flatten(), weight=w_diak4)
+            ezfill('ak4_eta1',      jeteta=diak4_i1.eta.flatten(),    weight=w_diak4)
+            ezfill('ak4_phi1',      jetphi=diak4_i1.phi.flatten(),    weight=w_diak4)
+            ezfill('ak4_pt1',       jetpt=diak4_i1.pt.flatten(),      weight=w_diak4)
+            ezfill('ak4_ptraw1',    jetpt=diak4_i1.ptraw.flatten(),   weight=w_diak4)
+            ezfill('ak4_chf1',      frac=diak4_i1.chf.flatten(),      weight=w_diak4)
+            ezfill('ak4_nhf1',      frac=diak4_i1.nhf.flatten(),      weight=w_diak4)
+            ezfill('ak4_nconst1',   nconst=diak4_i1.nconst.flatten(), weight=w_diak4)
 
             # B tag discriminator
             btag = getattr(ak4, cfg.BTAG.ALGO)
@@ -637,21 +651,21 @@ class vbfhinvProcessor(processor.ProcessorABC):
             ezfill('dpfcalo_sr',            dpfcalo=df["dPFCaloSR"][mask],       weight=rweight[mask] )
             ezfill('met',                met=met_pt[mask],            weight=rweight[mask] )
             ezfill('met_phi',            phi=met_phi[mask],           weight=rweight[mask] )
-            ezfill('recoil',             recoil=df["recoil_pt"][mask],      weight=rweight[mask] )
+            ezfill('recoil',             recoil=recoil_masked,      weight=rweight[mask] )
             ezfill('recoil_phi',         phi=df["recoil_phi"][mask],        weight=rweight[mask] )
             ezfill('dphijm',             dphi=df["minDPhiJetMet"][mask],    weight=rweight[mask] )
             ezfill('dphijr',             dphi=df["minDPhiJetRecoil"][mask], weight=rweight[mask] )
 
             ezfill('dphijj',             dphi=df["dphijj"][mask],   weight=rweight[mask] )
             ezfill('detajj',             deta=df["detajj"][mask],   weight=rweight[mask] )
-            ezfill('mjj',                mjj=df["mjj"][mask],      weight=rweight[mask] )
+            ezfill('mjj',                mjj=mjj_masked,      weight=rweight[mask] )
 
             # b-tag weight up and down variations
             if cfg.RUN.BTAG_STUDY:
                 if not df['is_data']:
                     rw = region_weights.partial_weight(exclude=exclude+['bveto'])
-                    ezfill('mjj_bveto_up',    mjj=df['mjj'][mask],  weight=(rw*(1-bsf_variations['up']).prod())[mask])
-                    ezfill('mjj_bveto_down',  mjj=df['mjj'][mask],  weight=(rw*(1-bsf_variations['down']).prod())[mask])
+                    ezfill('mjj_bveto_up',    mjj=mjj_masked,  weight=(rw*(1-bsf_variations['up']).prod())[mask])
+                    ezfill('mjj_bveto_down',  mjj=mjj_masked,  weight=(rw*(1-bsf_variations['down']).prod())[mask])
 
             if gen_v_pt is not None:
                 ezfill('gen_vpt', vpt=gen_v_pt[mask], weight=df['Generator_weight'][mask])
@@ -664,13 +678,13 @@ class vbfhinvProcessor(processor.ProcessorABC):
                 output['mjj'].fill(
                                     dataset=data_driven_qcd_dataset(dataset),
                                     region=region,
-                                    mjj=df["mjj"][mask],
+                                    mjj=mjj_masked,
                                     weight=rweight[mask] * w_imp
                                 )
                 output['recoil'].fill(
                                     dataset=data_driven_qcd_dataset(dataset),
                                     region=region,
-                                    recoil=df["recoil_pt"][mask],
+                                    recoil=recoil_masked,
                                     weight=rweight[mask] * w_imp
                                 )
 
@@ -682,12 +696,12 @@ class vbfhinvProcessor(processor.ProcessorABC):
                     w = (region_weights.weight() * reweight)[mask]
                     ezfill(
                         'mjj_unc',
-                        mjj=df['mjj'][mask],
+                        mjj=mjj_masked,
                         uncertainty=unc,
                         weight=w)
 
             # Two dimensional
-            ezfill('recoil_mjj',         recoil=df["recoil_pt"][mask], mjj=df["mjj"][mask], weight=rweight[mask] )
+            ezfill('recoil_mjj',         recoil=recoil_masked, mjj=mjj_masked, weight=rweight[mask] )
 
             # Muons
             if '_1m_' in region or '_2m_' in region or 'no_veto' in region:
@@ -750,16 +764,25 @@ class vbfhinvProcessor(processor.ProcessorABC):
                 ezfill("tau_pt", pt=taus.pt[mask].flatten(), weight=w_all_taus)
 
             # PV
-            ezfill('npv', nvtx=df['PV_npvs'][mask], weight=rweight[mask])
-            ezfill('npvgood', nvtx=df['PV_npvsGood'][mask], weight=rweight[mask])
+            npv = df['PV_npvs'][mask]
+            npvgood = df['PV_npvsGood'][mask]
+            rho_all = df['fixedGridRhoFastjetAll'][mask]
+            rho_central = df['fixedGridRhoFastjetCentral'][mask]
+            ezfill('npv', nvtx=npv, weight=rweight[mask])
+            ezfill('npvgood', nvtx=npvgood, weight=rweight[mask])
+
+            ezfill('npv_nopu', nvtx=npv, weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
+            ezfill('npvgood_nopu', nvtx=npvgood, weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
+
+            ezfill('rho_all', rho=rho_all, weight=region_weights.partial_weight(exclude=exclude)[mask])
+            ezfill('rho_central', rho=rho_central, weight=region_weights.partial_weight(exclude=exclude)[mask])
+            ezfill('rho_all_nopu', rho=rho_all, weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
+            ezfill('rho_central_nopu', rho=rho_central, weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
 
-            ezfill('npv_nopu', nvtx=df['PV_npvs'][mask], weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
-            ezfill('npvgood_nopu', nvtx=df['PV_npvsGood'][mask], weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
+        fills.execute()
 
-            ezfill('rho_all', rho=df['fixedGridRhoFastjetAll'][mask], weight=region_weights.partial_weight(exclude=exclude)[mask])
-            ezfill('rho_central', rho=df['fixedGridRhoFastjetCentral'][mask], weight=region_weights.partial_weight(exclude=exclude)[mask])
-            ezfill('rho_all_nopu', rho=df['fixedGridRhoFastjetAll'][mask], weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
-            ezfill('rho_central_nopu', rho=df['fixedGridRhoFastjetCentral'][mask], weight=region_weights.partial_weight(exclude=exclude+['pileup'])[mask])
+        if cfg.RUN.SAVE.TREE and cfg.RUN.SAVE.TREEFORMAT == 'parquet':
+            write_chunk_trees(output, df)
         return output
 
     def postprocess(self, accumulator):
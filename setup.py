@@ -15,6 +15,7 @@ setup(
     scripts=[
         'bucoffea/execute/buexec',
         'bucoffea/execute/bumon',
-        'bucoffea/scripts/bumerge'
+        'bucoffea/scripts/bumerge',
+        'bucoffea/scripts/bucache'
         ],
 )
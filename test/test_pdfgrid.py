@@ -0,0 +1,92 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from bucoffea.gen.pdfgrid import PIDS, PDFGrid, PDFReweighter
+
+# Small grid, so that tabulating it is fast
+X = np.logspace(-4, 0, 17)
+Q2 = np.logspace(1, 5, 9)
+
+def bilinear(pid, x, q2):
+    '''Bilinear in log x and log Q2, which the interpolation reproduces exactly'''
+    lx, lq = np.log(x), np.log(q2)
+    return (abs(pid) + 1) * (2. - 0.1 * lx + 0.3 * lq + 0.05 * lx * lq)
+
+def smooth(pid, x, q2):
+    '''PDF-like shape'''
+    return (abs(pid) + 1) * x**-0.2 * (1 - x)**3 * np.log(q2)
+
+@pytest.fixture
+def grid():
+    return PDFGrid.from_function(bilinear, x=X, q2=Q2)
+
+def random_points(n, seed=1):
+    rng = np.random.RandomState(seed)
+    pid = rng.choice(PIDS, n)
+    x = np.exp(rng.uniform(np.log(X[0]), np.log(X[-1]), n))
+    q2 = np.exp(rng.uniform(np.log(Q2[0]), np.log(Q2[-1]), n))
+    return pid, x, q2
+
+def test_grid_points(grid):
+    pid = np.repeat(PIDS, len(X))
+    x = np.tile(X, len(PIDS))
+    q2 = np.full(len(x), Q2[3])
+    assert np.allclose(grid.xfxQ2(pid, x, q2), bilinear(pid, x, q2))
+
+def test_bilinear_is_exact(grid):
+    pid, x, q2 = random_points(1000)
+    assert np.allclose(grid.xfxQ2(pid, x, q2), bilinear(pid, x, q2))
+
+def test_interpolation_accuracy():
+    # Default sampling, as used for the real PDFs. At very high x,
+    # where the density vanishes, the relative error gets larger.
+    grid = PDFGrid.from_function(smooth, q2=Q2)
+    pid, x, q2 = random_points(2000)
+    x = np.clip(x, None, 0.7)
+    assert np.allclose(grid.xfxQ2(pid, x, q2), smooth(pid, x, q2), rtol=1e-3)
+
+def test_gluon_ids(grid):
+    x, q2 = np.array([0.01, 0.2]), np.array([100., 1000.])
+    assert np.array_equal(grid.xfxQ2(np.array([0, 0]), x, q2), grid.xfxQ2(np.array([21, 21]), x, q2))
+
+def test_unknown_partons_are_zero(grid):
+    pid = np.array([22, -11, 7, -7, 1])
+    x = np.full(5, 0.1)
+    q2 = np.full(5, 100.)
+    values = grid.xfxQ2(pid, x, q2)
+    assert np.array_equal(values[:4], np.zeros(4))
+    assert values[4] > 0
+
+def test_outside_of_grid_is_clamped(grid):
+    with pytest.warns(UserWarning):
+        values = grid.xfxQ2(np.array([1, 1]), np.array([1e-6, 0.5]), np.array([100., 1e7]))
+    assert np.isclose(values[0], bilinear(1, X[0], 100.))
+    assert np.isclose(values[1], bilinear(1, 0.5, Q2[-1]))
+
+def test_inside_of_grid_does_not_warn(grid):
+    pid, x, q2 = random_points(100)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        grid.xfxQ2(pid, x, q2)
+
+def test_save_and_load(grid, tmpdir):
+    path = str(tmpdir.join('grid.npz'))
+    grid.save(path)
+    loaded = PDFGrid.load(path)
+    pid, x, q2 = random_points(100)
+    assert np.array_equal(loaded.xfxQ2(pid, x, q2), grid.xfxQ2(pid, x, q2))
+
+def test_ratios():
+    base = PDFGrid.from_function(bilinear, x=X, q2=Q2)
+    doubled = PDFGrid.from_function(lambda *args: 2 * bilinear(*args), x=X, q2=Q2)
+    reweighter = PDFReweighter({1 : base, 2 : doubled}, base=1)
+
+    id1, id2 = np.array([1, 22]), np.array([21, 2])
+    x1, x2 = np.array([0.1, 0.1]), np.array([0.01, 0.01])
+    q2 = np.array([100., 100.])
+    ratios = reweighter.ratios(id1, id2, x1, x2, q2)
+    assert np.allclose(ratios[1], [1, 1])
+    # Photon-initiated events keep their weight
+    assert np.allclose(ratios[2], [4, 1])